@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the TA Worker
+
+Times the indicator helpers, `compute_indicators`, the structure detectors and
+`build_snapshot` on seeded synthetic candles (see synthetic_data.py) across a
+range of lookbacks. Reports per-call time, throughput (bars/s) and peak memory,
+and compares against a stored baseline.
+
+Usage:
+    python benchmark.py                       # run and compare with bench_baseline.json
+    python benchmark.py --sizes 300,1000      # quick run
+    python benchmark.py --only rsi,build_snapshot
+    python benchmark.py --only startup        # cold start: import, first /v1/healthz, warmup done
+    python benchmark.py --update-baseline     # store the current results as the baseline
+
+Exit code is 1 when any target is slower (or uses more memory) than the
+baseline by more than --tolerance.
+"""
+
+import os, sys, json, time, argparse, statistics, tracemalloc, platform, subprocess, resource
+from typing import Dict, Any, Callable, List
+
+import pandas as pd
+
+os.environ.setdefault("WRITE_SNAPSHOT_JSON", "false")
+import main
+from synthetic_data import make_ohlcv
+
+DEFAULT_SIZES = [300, 1000, 10000, 100000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# Targets still dominated by per-bar Python loops are capped so a full run stays
+# in minutes. Raise the cap once they are vectorized.
+MAX_BARS: Dict[str, int] = {
+    "build_snapshot": 20000,
+}
+
+def prepare_frame(bars: int, seed: int) -> pd.DataFrame:
+    """Synthetic candles indexed the same way `run()` indexes fetched candles"""
+    df = make_ohlcv(bars, seed=seed)
+    df.index = pd.to_datetime(df["ts"])
+    return df
+
+TARGET_NAMES = ("ema", "rsi", "macd", "atr", "bollinger_bands", "adx", "obv", "vwap", "compute_indicators",
+                "find_order_blocks", "find_support_resistance_levels", "identify_elliott_waves", "build_snapshot",
+                "build_history")
+
+def build_targets(df: pd.DataFrame, df_ind: pd.DataFrame) -> Dict[str, Callable[[], Any]]:
+    """Map of target name -> zero-argument callable"""
+    close, high, low, volume = df["close"], df["high"], df["low"], df["volume"]
+    row = main.last_closed_row(df_ind)
+    return {
+        "ema": lambda: main.ema(close, 200),
+        "rsi": lambda: main.rsi(close, 14),
+        "macd": lambda: main.macd(close, 12, 26, 9),
+        "atr": lambda: main.atr(high, low, close, 14),
+        "bollinger_bands": lambda: main.bollinger_bands(close, 20, 2.0),
+        "adx": lambda: main.adx(high, low, close, 14),
+        "obv": lambda: main.obv(close, volume),
+        "vwap": lambda: main.vwap(high, low, close, volume),
+        "compute_indicators": lambda: main.compute_indicators(df),
+        "find_order_blocks": lambda: main.find_order_blocks(df_ind),
+        "find_support_resistance_levels": lambda: main.find_support_resistance_levels(df_ind),
+        "identify_elliott_waves": lambda: main.identify_elliott_waves(df_ind),
+        "build_snapshot": lambda: main.build_snapshot("SYNTHETIC", {"15m": row}, {"15m": df_ind}, include_position=False),
+        "build_history": lambda: sum(1 for _ in main.build_history(df, None, main.ENV_LOOKBACK)),
+    }
+
+def time_call(fn: Callable[[], Any], min_time: float, max_reps: int) -> Dict[str, float]:
+    """Repeat `fn` until `min_time` seconds have elapsed (at least once)"""
+    samples: List[float] = []
+    started = time.perf_counter()
+    while len(samples) < max_reps:
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+        if time.perf_counter() - started >= min_time:
+            break
+    return {"best_s": min(samples), "median_s": statistics.median(samples), "reps": len(samples)}
+
+def peak_memory(fn: Callable[[], Any]) -> int:
+    """Peak bytes allocated by Python during one call of `fn`"""
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def run_suite(sizes: List[int], only: List[str], seed: int, min_time: float, max_reps: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    if only and not set(only) & set(TARGET_NAMES):
+        return results
+    for bars in sizes:
+        df = prepare_frame(bars, seed)
+        df_ind = main.compute_indicators(df)
+        for name, fn in build_targets(df, df_ind).items():
+            if only and name not in only:
+                continue
+            if bars > MAX_BARS.get(name, bars):
+                continue
+            t = time_call(fn, min_time, max_reps)
+            peak = peak_memory(fn)
+            key = f"{name}@{bars}"
+            results[key] = {
+                "target": name, "bars": bars,
+                "best_s": t["best_s"], "median_s": t["median_s"], "reps": t["reps"],
+                "bars_per_s": bars / t["best_s"] if t["best_s"] > 0 else None,
+                "peak_kb": peak / 1024,
+            }
+            print(f"{key:<40} {t['best_s']*1000:>10.2f} ms  {results[key]['bars_per_s']:>12,.0f} bars/s"
+                  f"  {results[key]['peak_kb']:>10,.0f} KiB  (x{t['reps']})", flush=True)
+    return results
+
+# Cold start in a fresh interpreter: import main, first liveness answer, warmup done (no network)
+STARTUP_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import main
+t_import = time.perf_counter() - t0
+main.health()
+t_health = time.perf_counter() - t0
+main.WARMUP_CONNECT = False
+main.warmup()
+t_ready = time.perf_counter() - t0
+print(t_import, t_health, t_ready)
+"""
+
+def run_startup(reps: int) -> Dict[str, Any]:
+    samples: Dict[str, List[float]] = {"import": [], "first_health": [], "ready": []}
+    env = dict(os.environ, WRITE_SNAPSHOT_JSON="false")
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    for _ in range(reps):
+        out = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET], cwd=cwd, env=env,
+                             capture_output=True, text=True, check=True).stdout.split()
+        for name, value in zip(samples, out[-3:]):
+            samples[name].append(float(value))
+    peak_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss  # KiB on Linux
+    results: Dict[str, Any] = {}
+    for name, values in samples.items():
+        key = f"startup_{name}@0"
+        results[key] = {"target": f"startup_{name}", "bars": 0, "best_s": min(values),
+                        "median_s": statistics.median(values), "reps": reps, "bars_per_s": None,
+                        "peak_kb": peak_kb}
+        print(f"{key:<40} {min(values)*1000:>10.2f} ms  {'':>12}        {peak_kb:>10,.0f} KiB  (x{reps}, max RSS)", flush=True)
+    return results
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return human readable regressions against `baseline`"""
+    regressions = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if cur["best_s"] > base["best_s"] * (1 + tolerance):
+            regressions.append(f"{key}: time {base['best_s']*1000:.2f} ms -> {cur['best_s']*1000:.2f} ms")
+        if cur["peak_kb"] > base["peak_kb"] * (1 + tolerance):
+            regressions.append(f"{key}: peak memory {base['peak_kb']:.0f} KiB -> {cur['peak_kb']:.0f} KiB")
+    return regressions
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="TA Worker offline benchmark")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="comma-separated lookbacks (bars)")
+    parser.add_argument("--only", default="", help="comma-separated target names")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to spend per target/size")
+    parser.add_argument("--max-reps", type=int, default=50)
+    parser.add_argument("--startup-reps", type=int, default=5, help="fresh interpreters for the cold start benchmark")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown before failing, e.g. 0.5 = 50%%")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", default="", help="also write results to this path")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    only = [s.strip() for s in args.only.split(",") if s.strip()]
+
+    print(f"TA Worker benchmark — python {platform.python_version()}, pandas {pd.__version__}")
+    print("=" * 90)
+    results = run_suite(sizes, only, args.seed, args.min_time, args.max_reps)
+    if not only or "startup" in only:
+        results.update(run_startup(args.startup_reps))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+        print(f"\nBaseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline found; run with --update-baseline to create one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    print("\n" + "=" * 90)
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+        for r in regressions:
+            print("  -", r)
+        return 1
+    print(f"✅ No regressions beyond {args.tolerance:.0%} of baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
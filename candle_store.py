@@ -0,0 +1,138 @@
+"""
+Bounded-memory candle store.
+
+Each (symbol, tf, category) series is a fixed-capacity ring buffer: open
+times as int64 milliseconds plus one compact OHLCV array (float64, or
+float32 to halve the footprint). Appending a bar overwrites the oldest one
+in place, so a series never grows past its capacity. All series share one
+byte budget; when it is exceeded the least recently used series are evicted.
+
+Only raw candles are stored. Indicator columns are recomputed per request
+from a frame built on demand.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from lazy import lazy_module
+
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
+
+FIELDS = ("open", "high", "low", "close", "volume")
+
+class RingSeries:
+    def __init__(self, capacity: int, dtype: str = "float64"):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, len(FIELDS)), dtype=dtype)
+        self.start = 0  # physical slot of the oldest bar
+        self.size = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.ts.nbytes + self.values.nbytes
+
+    def last_ts(self) -> Optional[int]:
+        return int(self.ts[(self.start + self.size - 1) % self.capacity]) if self.size else None
+
+    def merge(self, ts, values):
+        """Add bars sorted by open time: a bar with the newest stored open time replaces it
+        (the forming bar moved on), newer bars are appended, older ones are ignored"""
+        ts = np.asarray(ts, dtype=np.int64)
+        values = np.asarray(values)
+        last = self.last_ts()
+        if last is not None:
+            same = ts == last
+            if same.any():
+                self.values[(self.start + self.size - 1) % self.capacity] = values[same][-1]
+            newer = ts > last
+            ts, values = ts[newer], values[newer]
+        if len(ts) > self.capacity:
+            ts, values = ts[-self.capacity:], values[-self.capacity:]
+        n = len(ts)
+        if not n:
+            return
+        slots = (self.start + self.size + np.arange(n)) % self.capacity
+        self.ts[slots] = ts
+        self.values[slots] = values
+        overflow = max(0, self.size + n - self.capacity)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.capacity, self.size + n)
+
+    def tail(self, n: int) -> Tuple[Any, Any]:
+        """(open times, OHLCV rows) of the newest `n` bars, oldest first (copies)"""
+        n = min(n, self.size)
+        slots = (self.start + np.arange(self.size - n, self.size)) % self.capacity
+        return self.ts[slots], self.values[slots]
+
+class CandleStore:
+    def __init__(self, budget_bytes: int, capacity: int = 1000, dtype: str = "float64"):
+        self.budget_bytes = budget_bytes
+        self.capacity = capacity
+        self.dtype = dtype
+        self.evictions = 0
+        self._series: "OrderedDict[Hashable, RingSeries]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def size(self, key: Hashable) -> int:
+        series = self._series.get(key)
+        return series.size if series else 0
+
+    def last_ts(self, key: Hashable) -> Optional[int]:
+        with self._lock:
+            series = self._series.get(key)
+            return series.last_ts() if series else None
+
+    def put(self, key: Hashable, ts, values, replace: bool = False):
+        """Merge bars into a series (created on first use), then evict LRU series over budget"""
+        with self._lock:
+            series = self._series.get(key)
+            if series is None or replace:
+                if series is not None:
+                    self._bytes -= series.nbytes
+                series = RingSeries(self.capacity, self.dtype)
+                self._series[key] = series
+                self._bytes += series.nbytes
+            series.merge(ts, values)
+            self._series.move_to_end(key)
+            while self._bytes > self.budget_bytes and len(self._series) > 1:
+                _, old = self._series.popitem(last=False)
+                self._bytes -= old.nbytes
+                self.evictions += 1
+
+    def put_frame(self, key: Hashable, df, replace: bool = False):
+        """Merge a `fetch_ohlcv_bybit`-shaped frame (ISO `ts` + OHLCV columns)"""
+        if len(df) == 0:
+            return
+        ts = pd.to_datetime(df["ts"]).astype("int64").to_numpy() // 1_000_000
+        self.put(key, ts, df[list(FIELDS)].to_numpy(dtype=self.dtype), replace)
+
+    def tail(self, key: Hashable, n: int) -> Optional[Tuple[Any, Any]]:
+        """(open times, OHLCV rows) of the newest `n` bars, marking the series used; None when absent"""
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return None
+            self._series.move_to_end(key)
+            return series.tail(n)
+
+    def frame(self, key: Hashable, n: int):
+        """Newest `n` bars as a `fetch_ohlcv_bybit`-shaped frame (float64), marking the series used"""
+        bars = self.tail(key, n)
+        if bars is None:
+            return None
+        ts, values = bars
+        df = pd.DataFrame(values.astype(np.float64, copy=False), columns=list(FIELDS))
+        df.insert(0, "ts", pd.to_datetime(ts, unit="ms", utc=True).strftime("%Y-%m-%dT%H:%M:%S+00:00"))
+        return df
+
+    def usage(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"series": len(self._series), "bytes": self._bytes, "budget_bytes": self.budget_bytes,
+                    "capacity_bars": self.capacity, "dtype": self.dtype, "evictions": self.evictions}
@@ -0,0 +1,165 @@
+"""
+Record/replay transport for Bybit REST calls.
+
+`RecordingSession` wraps a `requests.Session` and appends every call (request
+parameters, status, selected headers, body and latency) to a cassette: one
+JSON record per line, gzip-compressed when the path ends in `.gz`. API keys,
+signatures and signing timestamps are redacted before anything is written.
+
+`ReplaySession` serves a cassette back with the same `request()` / `get()`
+interface, sleeping for each call's recorded latency times `scale` (0 = no
+delay). Calls are matched on method, path and parameters without the signing
+fields; repeated calls get the recorded responses in order, the last one
+repeating. A call whose time range or limit differs from anything recorded
+(candles are fetched relative to the current time) falls back to the
+recorded calls to the same path with the same other parameters. A call with
+no match raises `CassetteMiss`, a `requests` ConnectionError, so callers
+treat it as a network failure.
+"""
+
+import datetime, gzip, http.client, json, threading, time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+REDACTED = "REDACTED"
+SECRET_FIELDS = {"api_key", "sign", "X-BAPI-API-KEY", "X-BAPI-SIGN"}
+SIGNING_FIELDS = SECRET_FIELDS | {"timestamp", "recv_window", "X-BAPI-TIMESTAMP", "X-BAPI-RECV-WINDOW"}
+RANGE_FIELDS = {"start", "end", "startTime", "endTime", "limit"}  # depend on when the call was made
+KEPT_HEADERS = ("Content-Type", "X-Bapi-Limit", "X-Bapi-Limit-Status", "X-Bapi-Limit-Reset-Timestamp")
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    pass
+
+def _open(path: str, mode: str):
+    return gzip.open(path, mode + "t", encoding="utf-8") if path.endswith(".gz") else open(path, mode, encoding="utf-8")
+
+def _redact(fields: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if fields is None:
+        return None
+    return {k: (REDACTED if k in SIGNING_FIELDS else v) for k, v in fields.items()}
+
+def _params(method: str, url: str, kwargs: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """(path, request fields from the query string, `params` and the JSON body)"""
+    parts = urlsplit(url)
+    fields: Dict[str, Any] = dict(parse_qsl(parts.query))
+    fields.update({k: str(v) for k, v in (kwargs.get("params") or {}).items()})
+    if isinstance(kwargs.get("json"), dict):
+        fields.update(kwargs["json"])
+    return parts.path, fields
+
+def match_keys(method: str, path: str, fields: Dict[str, Any]) -> Tuple[str, str]:
+    """(exact key, key ignoring the time range) of a call"""
+    exact = {k: v for k, v in fields.items() if k not in SIGNING_FIELDS}
+    loose = {k: v for k, v in exact.items() if k not in RANGE_FIELDS}
+    dump = lambda d: json.dumps(d, sort_keys=True, default=str)
+    return f"{method.upper()} {path} {dump(exact)}", f"{method.upper()} {path} {dump(loose)}"
+
+def make_response(method: str, url: str, status: int, headers: Dict[str, str], body: str,
+                  elapsed_s: float = 0.0) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.reason = http.client.responses.get(status, "")
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body.encode("utf-8")
+    response.encoding = "utf-8"
+    response.url = url
+    response.request = requests.Request(method.upper(), url).prepare()
+    response.elapsed = datetime.timedelta(seconds=elapsed_s)
+    return response
+
+class RecordingSession:
+    def __init__(self, path: str, session: Optional[requests.Session] = None):
+        self.path = path
+        self.session = session or requests.Session()
+        self.records = 0
+        self._started = time.time()
+        self._lock = threading.Lock()
+        self._file = _open(path, "w")
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        t0 = time.perf_counter()
+        response = self.session.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - t0
+        path, fields = _params(method, url, kwargs)
+        record = {
+            "t": round(time.time() - self._started, 4),
+            "method": method.upper(),
+            "path": path,
+            "fields": _redact(fields),
+            "status": response.status_code,
+            "headers": {h: response.headers[h] for h in KEPT_HEADERS if h in response.headers},
+            "elapsed_ms": round(elapsed * 1000, 2),
+            "body": response.text,
+        }
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()  # a killed process still leaves every completed call readable
+            self.records += 1
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def load(path: str) -> List[Dict[str, Any]]:
+    """Records of a cassette; a gzip stream cut short by a killed recorder yields what was flushed"""
+    records = []
+    with _open(path, "r") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        except (EOFError, json.JSONDecodeError):
+            pass
+    return records
+
+class ReplaySession:
+    def __init__(self, path: str, scale: float = 1.0, sleep=time.sleep):
+        self.path = path
+        self.scale = scale
+        self.sleep = sleep
+        self.hits = 0
+        self.misses = 0
+        self._exact: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._loose: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._lock = threading.Lock()
+        for record in load(path):
+            exact, loose = match_keys(record["method"], record["path"], record["fields"] or {})
+            self._exact[exact].append(record)
+            self._loose[loose].append(record)
+
+    def _next(self, queues: Dict[str, Deque[Dict[str, Any]]], key: str) -> Optional[Dict[str, Any]]:
+        queue = queues.get(key)
+        if not queue:
+            return None
+        return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        path, fields = _params(method, url, kwargs)
+        exact, loose = match_keys(method, path, fields)
+        with self._lock:
+            record = self._next(self._exact, exact) or self._next(self._loose, loose)
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if record is None:
+            raise CassetteMiss(f"no recorded response for {method.upper()} {path} in {self.path}")
+        if self.scale > 0:
+            self.sleep(record["elapsed_ms"] / 1000 * self.scale)
+        return make_response(method, url, record["status"], record["headers"], record["body"],
+                             record["elapsed_ms"] / 1000)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        pass
@@ -0,0 +1,93 @@
+"""
+Multi-timeframe confluence on aligned arrays.
+
+Every timeframe is mapped onto the base (shortest) timeframe's closed bars
+with an as-of join: a base bar sees the latest higher-TF bar that had
+closed by the base bar's close, never one still forming, so there is no
+look-ahead. Per-TF trend and momentum votes are then combined column-wise,
+and price levels from all TFs (S/R, Fibonacci, volume profile) are clustered
+into zones. Everything works on NumPy arrays already computed for the
+snapshot.
+"""
+
+from typing import Any, Dict, List, Sequence
+
+from lazy import lazy_module
+
+np = lazy_module("numpy")
+
+def asof_index(base_close_ms, open_ms, duration_ms: int):
+    """For each base close time, the row of the latest bar (opened at `open_ms`) closed by then; -1 if none"""
+    return np.searchsorted(np.asarray(open_ms) + duration_ms, base_close_ms, side="right") - 1
+
+def _mean_votes(votes: List[Any], n: int):
+    """Row-wise mean of the available ±1 votes (NaN where none is available)"""
+    if not votes:
+        return np.full(n, np.nan)
+    stacked = np.vstack(votes)
+    counts = np.sum(~np.isnan(stacked), axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, np.nansum(stacked, axis=0) / np.maximum(counts, 1), np.nan)
+
+def trend_votes(cols: Dict[str, Any], n: int):
+    """Mean of sign(close - ema20), sign(ema20 - ema50), sign(ema50 - ema200) over what is available"""
+    pairs = (("close", "ema_20"), ("ema_20", "ema_50"), ("ema_50", "ema_200"))
+    return _mean_votes([np.sign(cols[a] - cols[b]) for a, b in pairs if a in cols and b in cols], n)
+
+def momentum_votes(cols: Dict[str, Any], n: int):
+    """Mean of sign(rsi - 50), sign(macd_hist), sign(di_plus - di_minus) over what is available"""
+    votes = []
+    if "rsi_14" in cols:
+        votes.append(np.sign(cols["rsi_14"] - 50.0))
+    if "macd_hist" in cols:
+        votes.append(np.sign(cols["macd_hist"]))
+    if "di_plus" in cols and "di_minus" in cols:
+        votes.append(np.sign(cols["di_plus"] - cols["di_minus"]))
+    return _mean_votes(votes, n)
+
+def alignment(matrix, tfs: Sequence[str]) -> Dict[str, Any]:
+    """Score (mean vote across TFs) at the last row, the share of TFs agreeing with its sign, and for
+    how many trailing base bars every available TF has pointed the same way"""
+    avail = np.sum(~np.isnan(matrix), axis=1)
+    up, down = np.sum(matrix > 0, axis=1), np.sum(matrix < 0, axis=1)
+    unanimous = (avail > 0) & ((up == avail) | (down == avail))
+    breaks = np.flatnonzero(~unanimous)
+    last = matrix[-1]
+    valid = ~np.isnan(last)
+    score = float(np.mean(last[valid])) if valid.any() else 0.0
+    sign = np.sign(score)
+    return {
+        "score": round(score, 4),
+        "agreement": round(float(np.mean(np.sign(last[valid]) == sign)), 4) if valid.any() and sign else 0.0,
+        "aligned_bars": int(len(unanimous) - 1 - breaks[-1]) if len(breaks) else int(len(unanimous)),
+        "by_tf": {tf: (None if np.isnan(v) else round(float(v), 4)) for tf, v in zip(tfs, last)},
+    }
+
+def cluster_levels(prices, tf_ids, sources: Sequence[str], tfs: Sequence[str], tolerance: float,
+                   price: float, min_tfs: int = 2, limit: int = 5) -> List[Dict[str, Any]]:
+    """Group levels closer than `tolerance` to their neighbour into zones; keep zones backed by at
+    least `min_tfs` timeframes, nearest to `price` first"""
+    prices = np.asarray(prices, dtype=np.float64)
+    if not len(prices):
+        return []
+    order = np.argsort(prices, kind="stable")
+    p, ids = prices[order], np.asarray(tf_ids)[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(p) > tolerance) + 1))
+    low, high = p[starts], np.maximum.reduceat(p, starts)
+    masks = np.bitwise_or.reduceat(np.left_shift(1, ids.astype(np.int64)), starts)
+    sizes = np.diff(np.concatenate((starts, [len(p)])))
+    n_tfs = np.array([bin(int(m)).count("1") for m in masks])
+    keep = np.flatnonzero(n_tfs >= min_tfs)
+    mids = (low + high) / 2
+    keep = keep[np.argsort(np.abs(mids[keep] - price), kind="stable")][:limit]
+    zones = []
+    for z in keep:
+        members = order[starts[z]:starts[z] + sizes[z]]
+        zones.append({
+            "low": float(low[z]), "high": float(high[z]), "mid": float(mids[z]),
+            "side": "support" if mids[z] < price else "resistance",
+            "distance_pct": round(float((mids[z] - price) / price * 100), 4),
+            "tfs": [tf for i, tf in enumerate(tfs) if int(masks[z]) >> i & 1],
+            "sources": sorted({sources[m] for m in members}),
+        })
+    return zones
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Bybit v5 REST API, for load tests and offline runs.
+
+Serves kline, tickers, instruments-info, funding history, open interest,
+server time, position list and wallet balance from seeded synthetic data
+(see synthetic_data.py), plus the private WebSocket at `/v5/private` (auth,
+subscribe, ping; `position` and `wallet` pushes sent with
+`POST /fake/private/push`, connections dropped with `POST /fake/private/drop`). Candle history is stable: each (symbol, interval)
+series is generated once and extended as new bars open, so incremental
+caches in the app behave as they would against the real API.
+
+Faults are injected per request: a latency of `latency_ms` plus uniform
+`jitter_ms`, then with probability `error_rate` an HTTP 5xx, and with
+probability `throttle_rate` Bybit's rate-limit reply (retCode 10006 with the
+X-Bapi-Limit-* headers). They can be changed at runtime with
+`POST /fake/config`; `GET /fake/stats` counts requests and injected faults
+per endpoint.
+
+Usage:
+    python fake_bybit.py --port 9000 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+    BYBIT_BASE_URL=http://127.0.0.1:9000 BYBIT_API_KEY=fake BYBIT_SECRET_KEY=fake uvicorn main:app
+    # with the private stream:
+    BYBIT_PRIVATE_STREAM=true BYBIT_PRIVATE_WS_URL=ws://127.0.0.1:9000/v5/private ... uvicorn main:app
+"""
+
+import argparse, asyncio, json, random, threading, time, zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from synthetic_data import make_ohlcv_arrays
+
+INTERVAL_MS = {"1": 60_000, "3": 180_000, "5": 300_000, "15": 900_000, "30": 1_800_000, "60": 3_600_000,
+               "120": 7_200_000, "240": 14_400_000, "360": 21_600_000, "720": 43_200_000,
+               "D": 86_400_000, "W": 604_800_000, "M": 2_592_000_000}
+HISTORY_BARS = 5000  # bars generated behind the first requested bar
+SYMBOLS = ["HYPEUSDT", "BTCUSDT", "ETHUSDT", "SOLUSDT"]
+TICK_SIZE = "0.001"
+
+CONFIG: Dict[str, float] = {
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "error_rate": 0.0,
+    "error_status": 502,
+    "throttle_rate": 0.0,
+    "extra_symbols": 0,  # S0USDT, S1USDT, ... added to the universe
+}
+STATS: Dict[str, Dict[str, int]] = defaultdict(lambda: {"requests": 0, "errors": 0, "throttled": 0})
+
+app = FastAPI(title="Fake Bybit")
+_rng = random.Random(0)
+
+def seed_of(*parts: Any) -> int:
+    return zlib.crc32("|".join(str(p) for p in parts).encode("utf-8"))
+
+def universe() -> List[str]:
+    return SYMBOLS + [f"S{i}USDT" for i in range(int(CONFIG["extra_symbols"]))]
+
+# ---------- candles ----------
+
+_series: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_series_lock = threading.Lock()
+
+def series(symbol: str, interval: str) -> Dict[str, Any]:
+    """Candles of a (symbol, interval) up to the bar open now; older bars never change"""
+    step = INTERVAL_MS[interval]
+    current = int(time.time() * 1000) // step * step
+    with _series_lock:
+        s = _series.get((symbol, interval))
+        if s is None:
+            o, h, l, c, v = make_ohlcv_arrays(HISTORY_BARS, seed=seed_of(symbol, interval),
+                                              start_price=5 + seed_of(symbol) % 500)
+            s = _series[(symbol, interval)] = {
+                "start": current - step * (HISTORY_BARS - 1), "cols": np.column_stack((o, h, l, c, v))}
+        missing = (current - s["start"]) // step + 1 - len(s["cols"])
+        if missing > 0:
+            last_close = float(s["cols"][-1, 3])
+            o, h, l, c, v = make_ohlcv_arrays(missing, seed=seed_of(symbol, interval, len(s["cols"])),
+                                              start_price=last_close)
+            s["cols"] = np.vstack((s["cols"], np.column_stack((o, h, l, c, v))))
+        return s
+
+def kline_rows(symbol: str, interval: str, start: Optional[int], end: Optional[int], limit: int) -> List[List[str]]:
+    """Newest first, like Bybit: the last `limit` bars opened in [start, end]"""
+    step = INTERVAL_MS[interval]
+    s = series(symbol, interval)
+    starts = s["start"] + step * np.arange(len(s["cols"]), dtype=np.int64)
+    lo = np.searchsorted(starts, start if start is not None else starts[0], side="left")
+    hi = np.searchsorted(starts, end if end is not None else starts[-1], side="right")
+    lo = max(lo, hi - limit)
+    return [[str(int(starts[i])), *(repr(round(float(x), 6)) for x in s["cols"][i]), "0"]
+            for i in range(hi - 1, lo - 1, -1)]
+
+def last_price(symbol: str) -> float:
+    return float(series(symbol, "1")["cols"][-1, 3])
+
+# ---------- fault injection ----------
+
+def ok(result: Dict[str, Any]) -> JSONResponse:
+    return JSONResponse({"retCode": 0, "retMsg": "OK", "result": result, "retExtInfo": {}, "time": int(time.time() * 1000)})
+
+async def inject(request: Request) -> Optional[JSONResponse]:
+    """Sleep for the configured latency; return an injected error/throttle reply, or None"""
+    stats = STATS[request.url.path]
+    stats["requests"] += 1
+    delay = CONFIG["latency_ms"] + _rng.uniform(0, CONFIG["jitter_ms"])
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    roll = _rng.random()
+    if roll < CONFIG["error_rate"]:
+        stats["errors"] += 1
+        return PlainTextResponse("injected upstream error", status_code=int(CONFIG["error_status"]))
+    if roll < CONFIG["error_rate"] + CONFIG["throttle_rate"]:
+        stats["throttled"] += 1
+        reset = int(time.time() * 1000) + 1000
+        return JSONResponse({"retCode": 10006, "retMsg": "Too many visits!", "result": {}, "retExtInfo": {},
+                             "time": int(time.time() * 1000)},
+                            headers={"X-Bapi-Limit": "20", "X-Bapi-Limit-Status": "0",
+                                     "X-Bapi-Limit-Reset-Timestamp": str(reset)})
+    return None
+
+# ---------- market ----------
+
+@app.get("/v5/market/time")
+async def market_time(request: Request):
+    return await inject(request) or ok({"timeSecond": str(int(time.time())), "timeNano": str(time.time_ns())})
+
+@app.get("/v5/market/kline")
+async def kline(request: Request, symbol: str, interval: str, category: str = "linear", start: Optional[int] = None,
+                end: Optional[int] = None, limit: int = 200):
+    fault = await inject(request)
+    if fault:
+        return fault
+    if interval not in INTERVAL_MS:
+        return JSONResponse({"retCode": 10001, "retMsg": f"invalid interval {interval}", "result": {}})
+    rows = kline_rows(symbol, interval, start, end, max(1, min(limit, 1000)))
+    return ok({"category": category, "symbol": symbol, "list": rows})
+
+@app.get("/v5/market/tickers")
+async def tickers(request: Request, category: str = "linear", symbol: Optional[str] = None):
+    fault = await inject(request)
+    if fault:
+        return fault
+    items = []
+    for s in ([symbol] if symbol else universe()):
+        price = last_price(s)
+        item = {"symbol": s, "lastPrice": str(price), "bid1Price": str(round(price * 0.9999, 6)),
+                "ask1Price": str(round(price * 1.0001, 6)), "volume24h": "125000", "turnover24h": str(round(price * 125000, 2)),
+                "highPrice24h": str(round(price * 1.03, 6)), "lowPrice24h": str(round(price * 0.97, 6)),
+                "price24hPcnt": "0.0123"}
+        if category != "spot":
+            item.update({"markPrice": str(price), "indexPrice": str(price), "fundingRate": "0.0001",
+                         "nextFundingTime": str((int(time.time()) // 28800 + 1) * 28_800_000),
+                         "openInterest": "50000", "openInterestValue": str(round(price * 50000, 2))})
+        items.append(item)
+    return ok({"category": category, "list": items})
+
+@app.get("/v5/market/instruments-info")
+async def instruments(request: Request, category: str = "linear", symbol: Optional[str] = None,
+                      limit: int = 500, cursor: Optional[str] = None):
+    fault = await inject(request)
+    if fault:
+        return fault
+    symbols = [symbol] if symbol else universe()
+    offset = int(cursor or 0)
+    page = symbols[offset:offset + limit]
+    items = [{"symbol": s, "status": "Trading", "baseCoin": s[:-4], "quoteCoin": "USDT",
+              "contractType": "LinearPerpetual" if category != "spot" else "", "priceFilter": {"tickSize": TICK_SIZE}}
+             for s in page]
+    next_cursor = str(offset + limit) if offset + limit < len(symbols) else ""
+    return ok({"category": category, "list": items, "nextPageCursor": next_cursor})
+
+def history(step_ms: int, start: Optional[int], end: Optional[int], limit: int) -> List[int]:
+    """Newest-first sample times in [start, end]"""
+    newest = (end if end is not None else int(time.time() * 1000)) // step_ms * step_ms
+    out = []
+    t = newest
+    while len(out) < limit and (start is None or t >= start):
+        out.append(t)
+        t -= step_ms
+    return out
+
+@app.get("/v5/market/funding/history")
+async def funding_history(request: Request, symbol: str, category: str = "linear", startTime: Optional[int] = None,
+                          endTime: Optional[int] = None, limit: int = 200):
+    fault = await inject(request)
+    if fault:
+        return fault
+    rows = [{"symbol": symbol, "fundingRate": str(round((seed_of(symbol, t) % 200 - 100) / 1e6, 6)),
+             "fundingRateTimestamp": str(t)} for t in history(28_800_000, startTime, endTime, min(limit, 200))]
+    return ok({"category": category, "list": rows})
+
+@app.get("/v5/market/open-interest")
+async def open_interest(request: Request, symbol: str, intervalTime: str = "1h", category: str = "linear",
+                        startTime: Optional[int] = None, endTime: Optional[int] = None, limit: int = 50):
+    fault = await inject(request)
+    if fault:
+        return fault
+    step = {"5min": 300_000, "15min": 900_000, "30min": 1_800_000, "1h": 3_600_000, "4h": 14_400_000,
+            "1d": 86_400_000}.get(intervalTime, 3_600_000)
+    rows = [{"openInterest": str(40000 + seed_of(symbol, t) % 20000), "timestamp": str(t)}
+            for t in history(step, startTime, endTime, min(limit, 200))]
+    return ok({"category": category, "symbol": symbol, "list": rows, "nextPageCursor": ""})
+
+# ---------- private (signature is not checked) ----------
+
+@app.post("/v5/position/list")
+async def position_list(request: Request):
+    fault = await inject(request)
+    if fault:
+        return fault
+    body = await request.json()
+    category, symbol = body.get("category", "linear"), body.get("symbol")
+    items = []
+    if category != "spot" and symbol in (None, "HYPEUSDT") and body.get("settleCoin") in (None, "USDT"):
+        price = last_price("HYPEUSDT")
+        items.append({"symbol": "HYPEUSDT", "side": "Buy", "size": "10", "avgPrice": str(round(price * 0.98, 6)),
+                      "markPrice": str(price), "unrealisedPnl": str(round(price * 0.2, 4)), "realisedPnl": "0",
+                      "leverage": "5", "positionIdx": 0, "stopLoss": "", "takeProfit": "",
+                      "updatedTime": str(int(time.time() * 1000))})
+    return ok({"category": category, "list": items, "nextPageCursor": ""})
+
+@app.post("/v5/account/wallet-balance")
+async def wallet_balance(request: Request):
+    fault = await inject(request)
+    if fault:
+        return fault
+    body = await request.json()
+    return ok({"list": [{"accountType": body.get("accountType", "UNIFIED"), "totalEquity": "10000",
+                         "totalWalletBalance": "9950", "totalAvailableBalance": "8000",
+                         "coin": [{"coin": "USDT", "equity": "10000", "walletBalance": "9950"}]}]})
+
+# ---------- private stream (API key and signature are not checked, only their shape) ----------
+
+PRIVATE_TOPICS = ("position", "wallet")
+_private_clients: Dict[WebSocket, set] = {}  # connection -> subscribed topics
+
+def private_reply(op: str, success: bool = True, ret_msg: str = "") -> str:
+    return json.dumps({"success": success, "ret_msg": ret_msg, "op": op, "conn_id": "fake"})
+
+@app.websocket("/v5/private")
+async def private_ws(ws: WebSocket):
+    """Bybit's private stream: `auth` first, then `subscribe`; pushes go to subscribed topics"""
+    await ws.accept()
+    authed = False
+    try:
+        while True:
+            message = json.loads(await ws.receive_text())
+            op, args = message.get("op"), message.get("args") or []
+            STATS["/v5/private"]["requests"] += 1
+            if op == "auth":
+                authed = (len(args) == 3 and int(args[1]) > time.time() * 1000
+                          and len(str(args[2])) == 64)
+                await ws.send_text(private_reply("auth", authed, "" if authed else "Params Error"))
+            elif op == "subscribe":
+                topics = [t for t in args if t.split(".")[0] in PRIVATE_TOPICS]
+                if not authed or len(topics) != len(args):
+                    await ws.send_text(private_reply("subscribe", False, "not authorized" if not authed else "invalid topic"))
+                    continue
+                _private_clients.setdefault(ws, set()).update(topics)
+                await ws.send_text(private_reply("subscribe"))
+            elif op == "ping":
+                await ws.send_text(json.dumps({"op": "pong", "args": [str(int(time.time() * 1000))], "conn_id": "fake"}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _private_clients.pop(ws, None)
+
+@app.post("/fake/private/push")
+async def private_push(request: Request):
+    """Send {"topic": "position"|"wallet", "data": [...]} to every subscribed connection"""
+    body = await request.json()
+    topic = body.get("topic", "")
+    message = json.dumps({"id": f"fake-{time.time_ns()}", "topic": topic, "creationTime": int(time.time() * 1000),
+                          "data": body.get("data") or []})
+    sent = 0
+    for ws, topics in list(_private_clients.items()):
+        if topic in topics:
+            await ws.send_text(message)
+            sent += 1
+    return {"sent": sent}
+
+@app.post("/fake/private/drop")
+async def private_drop():
+    """Close every private connection, so clients reconnect and resync"""
+    clients = list(_private_clients)
+    for ws in clients:
+        _private_clients.pop(ws, None)
+        await ws.close(code=1011)
+    return {"dropped": len(clients)}
+
+# ---------- control ----------
+
+@app.post("/fake/config")
+async def set_config(request: Request):
+    """Update fault settings, e.g. {"latency_ms": 200, "error_rate": 0.05}"""
+    for key, value in (await request.json()).items():
+        if key in CONFIG:
+            CONFIG[key] = float(value)
+    return CONFIG
+
+@app.get("/fake/stats")
+def get_stats():
+    return {"config": CONFIG, "endpoints": dict(STATS)}
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Local fake Bybit v5 REST server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every reply")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform extra latency up to this")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of replies that are HTTP errors")
+    parser.add_argument("--error-status", type=int, default=502)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of replies that are retCode 10006")
+    parser.add_argument("--extra-symbols", type=int, default=0, help="synthetic symbols added to the universe")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the fault/jitter draws")
+    args = parser.parse_args(argv)
+    for key in CONFIG:
+        CONFIG[key] = float(getattr(args, key))
+    _rng.seed(args.seed)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,175 @@
+"""
+Response formats and content negotiation.
+
+JSON is always available. MessagePack (`msgpack`) and Arrow IPC (`pyarrow`)
+are optional dependencies, imported on first use; a format whose library is
+missing is simply not offered, and negotiation falls through to the next
+acceptable one (or 406).
+"""
+
+import importlib, io
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+CSV = "text/csv"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+
+# Short names accepted in a `format=` query parameter
+ALIASES = {"json": JSON, "ndjson": NDJSON, "csv": CSV, "msgpack": MSGPACK, "arrow": ARROW, "parquet": PARQUET}
+REQUIRES = {MSGPACK: "msgpack", ARROW: "pyarrow", PARQUET: "pyarrow.parquet"}
+
+_modules: Dict[str, Any] = {}
+
+def _optional(name: str):
+    if name not in _modules:
+        try:
+            _modules[name] = importlib.import_module(name)
+        except ImportError:
+            _modules[name] = None
+    return _modules[name]
+
+def available(media_type: str) -> bool:
+    return media_type not in REQUIRES or _optional(REQUIRES[media_type]) is not None
+
+def _parse_accept(accept: str) -> List[tuple]:
+    """[(media_type, q)] in header order"""
+    ranges = []
+    for part in accept.split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for f in fields[1:]:
+            if f.startswith("q="):
+                try:
+                    q = float(f[2:])
+                except ValueError:
+                    q = 0.0
+        ranges.append((fields[0].lower(), q))
+    return ranges
+
+def negotiate(offered: List[str], accept: Optional[str] = None, fmt: Optional[str] = None) -> Optional[str]:
+    """Pick a media type from `offered` (first is the default).
+
+    An explicit `fmt` (short name or media type) wins over the Accept header. Returns None when
+    nothing acceptable is both offered and installed.
+    """
+    offered = [m for m in offered if available(m)]
+    if fmt:
+        media_type = ALIASES.get(fmt.lower(), fmt.lower())
+        return media_type if media_type in offered else None
+    if not accept:
+        return offered[0] if offered else None
+    best, best_q = None, 0.0
+    for media_type, q in _parse_accept(accept):
+        if q <= best_q:
+            continue
+        if media_type in ("*/*", "application/*"):
+            match = next((m for m in offered if media_type == "*/*" or m.startswith("application/")), None)
+        else:
+            match = media_type if media_type in offered else None
+        if match:
+            best, best_q = match, q
+    return best
+
+def unavailable_detail(offered: List[str]) -> Dict[str, Any]:
+    """Body of a 406 response"""
+    return {
+        "error": "Not Acceptable",
+        "available": [m for m in offered if available(m)],
+        "not_installed": {m: REQUIRES[m] for m in offered if not available(m)},
+    }
+
+def to_msgpack(obj: Any) -> bytes:
+    return _optional("msgpack").packb(obj, use_bin_type=True)
+
+def arrow_table(df, schema=None):
+    pa = _optional("pyarrow")
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+def to_arrow(df) -> bytes:
+    """One frame as a complete Arrow IPC stream"""
+    return b"".join(arrow_stream([df]))
+
+class StreamSink:
+    """Write-only file object whose bytes are taken out as they are written.
+
+    `tell()` keeps counting from the start of the stream, so writers that record offsets
+    (the Parquet footer) stay correct while chunks are sent incrementally.
+    """
+    closed = False
+
+    def __init__(self):
+        self._buf = io.BytesIO()
+        self._pos = 0
+
+    def write(self, data) -> int:
+        n = self._buf.write(data)
+        self._pos += n
+        return n
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def drain(self) -> bytes:
+        return _drain(self._buf)
+
+def parquet_stream(frames: Iterable[Any], compression: str = "zstd") -> Iterator[bytes]:
+    """Parquet file written and sent one row group per frame; the first frame fixes the schema"""
+    pq = _optional("pyarrow.parquet")
+    sink = StreamSink()
+    writer = schema = None
+    for df in frames:
+        table = arrow_table(df, schema=schema)
+        if writer is None:
+            schema = table.schema
+            writer = pq.ParquetWriter(sink, schema, compression=compression)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+def arrow_stream(frames: Iterable[Any]) -> Iterator[bytes]:
+    """Arrow IPC stream, one record batch per frame; the first frame fixes the schema"""
+    pa = _optional("pyarrow")
+    sink = io.BytesIO()
+    writer = schema = None
+    for df in frames:
+        table = arrow_table(df, schema=schema)
+        if writer is None:
+            schema = table.schema
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_table(table)
+        yield _drain(sink)
+    if writer is not None:
+        writer.close()
+        yield _drain(sink)
+
+def csv_stream(frames: Iterable[Any]) -> Iterator[bytes]:
+    """CSV with the first frame's header, one chunk per frame; needs no optional package"""
+    header = True
+    for df in frames:
+        yield df.to_csv(index=False, header=header).encode("utf-8")
+        header = False
+
+def _drain(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
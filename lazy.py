@@ -0,0 +1,41 @@
+"""
+Deferred module imports.
+
+`pd = lazy_module("pandas")` behaves like `import pandas as pd`, but pandas is
+only imported on first attribute access. Keeps heavy libraries off the cold
+start path so the liveness endpoint answers as soon as FastAPI is up.
+"""
+
+import importlib, threading
+from types import ModuleType
+
+_lock = threading.Lock()
+
+class LazyModule(ModuleType):
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = None
+
+    def _load(self) -> ModuleType:
+        target = self.__dict__["_lazy_target"]
+        if target is None:
+            with _lock:
+                target = self.__dict__["_lazy_target"]
+                if target is None:
+                    target = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_target"] = target
+        return target
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    @property
+    def loaded(self) -> bool:
+        return self.__dict__["_lazy_target"] is not None
+
+def lazy_module(name: str) -> LazyModule:
+    """Return a proxy that imports `name` on first use"""
+    return LazyModule(name)
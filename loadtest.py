@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Closed-loop load generator for the TA Worker API
+
+Runs `--concurrency` workers that each send requests back to back for
+`--duration` seconds, cycling through the `--endpoint` list (each worker
+starts at a different offset, so the mix stays even). Reports requests,
+errors, throughput and p50/p95/p99/max latency per endpoint. Requests sent
+during `--warmup` seconds are not counted.
+
+With `--spawn` it starts fake_bybit.py and the app (uvicorn) on free local
+ports, points the app at the fake through BYBIT_BASE_URL, and passes the
+fault options through to the fake; no live Bybit or credentials needed.
+
+Usage:
+    python loadtest.py --spawn --concurrency 16 --duration 30
+    python loadtest.py --spawn --fake-latency-ms 80 --fake-jitter-ms 40 --fake-error-rate 0.02
+    python loadtest.py --url http://127.0.0.1:8000 --endpoint "/v1/run?symbol=BTCUSDT&tfs=1h" --json out.json
+
+Exit code is 1 when any endpoint's error rate is above --max-error-rate.
+"""
+
+import os, sys, json, time, socket, argparse, threading, subprocess
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+DEFAULT_ENDPOINTS = [
+    "/v1/run?symbol=HYPEUSDT&tfs=15m,1h,4h,1d&category=linear",
+    "/v1/positions",
+    "/v1/account",
+]
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, int(round(q / 100 * len(sorted_values) + 0.5 - 1e-9)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def worker(base_url: str, endpoints: List[str], offset: int, warmup_until: float, stop_at: float,
+           timeout: float, samples: List[Tuple[str, float, bool]], lock: threading.Lock):
+    session = requests.Session()
+    local: List[Tuple[str, float, bool]] = []
+    i = offset
+    while True:
+        t0 = time.time()
+        if t0 >= stop_at:
+            break
+        endpoint = endpoints[i % len(endpoints)]
+        i += 1
+        try:
+            ok = session.get(base_url + endpoint, timeout=timeout).status_code < 400
+        except requests.exceptions.RequestException:
+            ok = False
+        if t0 >= warmup_until:
+            local.append((endpoint, time.time() - t0, ok))
+    with lock:
+        samples.extend(local)
+
+def run_load(base_url: str, endpoints: List[str], concurrency: int, duration: float, warmup: float,
+             timeout: float) -> Dict[str, Any]:
+    samples: List[Tuple[str, float, bool]] = []
+    lock = threading.Lock()
+    start = time.time()
+    warmup_until, stop_at = start + warmup, start + warmup + duration
+    threads = [threading.Thread(target=worker, args=(base_url, endpoints, k, warmup_until, stop_at, timeout, samples, lock))
+               for k in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = max(time.time() - warmup_until, 1e-9)  # includes the tail of requests still in flight at stop_at
+
+    by_endpoint: Dict[str, List[Tuple[float, bool]]] = defaultdict(list)
+    for endpoint, latency, ok in samples:
+        by_endpoint[endpoint].append((latency, ok))
+    by_endpoint["all"] = [(latency, ok) for _, latency, ok in samples]
+    report: Dict[str, Any] = {}
+    for endpoint in endpoints + ["all"]:
+        rows = by_endpoint.get(endpoint, [])
+        lat = sorted(latency * 1000 for latency, _ in rows)
+        errors = sum(1 for _, ok in rows if not ok)
+        report[endpoint] = {
+            "requests": len(rows), "errors": errors,
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            "rps": round(len(rows) / elapsed, 2),
+            "p50_ms": round(percentile(lat, 50), 2), "p95_ms": round(percentile(lat, 95), 2),
+            "p99_ms": round(percentile(lat, 99), 2), "max_ms": round(lat[-1], 2) if lat else float("nan"),
+        }
+    return report
+
+def print_report(report: Dict[str, Any]):
+    print(f"{'endpoint':<60} {'reqs':>7} {'err':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    print("-" * 124)
+    for endpoint, r in report.items():
+        name = endpoint if len(endpoint) <= 60 else endpoint[:57] + "..."
+        print(f"{name:<60} {r['requests']:>7} {r['errors']:>6} {r['rps']:>8.2f} {r['p50_ms']:>9.2f} "
+              f"{r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['max_ms']:>9.2f}")
+
+# ---------- --spawn ----------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_http(url: str, timeout: float, proc: subprocess.Popen):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{proc.args} exited with code {proc.returncode}")
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not up after {timeout:.0f}s")
+
+def spawn(args) -> Tuple[str, str, List[subprocess.Popen]]:
+    """Start fake_bybit.py and the app; returns (app URL, fake URL, processes)"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    fake_port, app_port = free_port(), free_port()
+    fake_url, app_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+    procs = []
+    fake_cmd = [sys.executable, "fake_bybit.py", "--port", str(fake_port),
+                "--latency-ms", str(args.fake_latency_ms), "--jitter-ms", str(args.fake_jitter_ms),
+                "--error-rate", str(args.fake_error_rate), "--throttle-rate", str(args.fake_throttle_rate)]
+    procs.append(subprocess.Popen(fake_cmd, cwd=cwd))
+    wait_http(f"{fake_url}/v5/market/time", 30, procs[0])
+    env = dict(os.environ, BYBIT_BASE_URL=fake_url, BYBIT_API_KEY=os.getenv("BYBIT_API_KEY") or "fake",
+               BYBIT_SECRET_KEY=os.getenv("BYBIT_SECRET_KEY") or "fake", BYBIT_PRIVATE_STREAM="false",
+               WRITE_SNAPSHOT_JSON="false")
+    app_cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+               "--workers", str(args.app_workers), "--log-level", "warning"]
+    procs.append(subprocess.Popen(app_cmd, cwd=cwd, env=env))
+    wait_http(f"{app_url}/v1/readyz", 120, procs[1])
+    return app_url, fake_url, procs
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="TA Worker load test")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="app base URL (ignored with --spawn)")
+    parser.add_argument("--endpoint", action="append", default=[],
+                        help=f"path with query, repeatable (default: {', '.join(DEFAULT_ENDPOINTS)})")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of unmeasured load first")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout (s)")
+    parser.add_argument("--max-error-rate", type=float, default=1.0, help="fail above this per-endpoint error rate")
+    parser.add_argument("--json", default="", help="also write the report to this path")
+    parser.add_argument("--spawn", action="store_true", help="start fake_bybit.py and the app locally")
+    parser.add_argument("--app-workers", type=int, default=1, help="uvicorn workers with --spawn")
+    parser.add_argument("--fake-latency-ms", type=float, default=0.0)
+    parser.add_argument("--fake-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    parser.add_argument("--fake-throttle-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    endpoints = args.endpoint or DEFAULT_ENDPOINTS
+
+    procs: List[subprocess.Popen] = []
+    fake_url: Optional[str] = None
+    base_url = args.url.rstrip("/")
+    try:
+        if args.spawn:
+            base_url, fake_url, procs = spawn(args)
+        print(f"TA Worker load test — {base_url}, concurrency {args.concurrency}, {args.duration:.0f}s "
+              f"(+{args.warmup:.0f}s warmup)")
+        report = run_load(base_url, endpoints, args.concurrency, args.duration, args.warmup, args.timeout)
+        print_report(report)
+        if fake_url:
+            upstream = requests.get(f"{fake_url}/fake/stats", timeout=5).json()["endpoints"]
+            print("\nUpstream (fake Bybit) requests / injected errors / throttled:")
+            for path, s in sorted(upstream.items()):
+                print(f"  {path:<40} {s['requests']:>7} {s['errors']:>6} {s['throttled']:>6}")
+            report["upstream"] = upstream
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    failing = [e for e in endpoints if report[e]["error_rate"] > args.max_error_rate]
+    for e in failing:
+        print(f"FAIL {e}: error rate {report[e]['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    return 1 if failing else 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
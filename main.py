@@ -1,18 +1,26 @@
+from __future__ import annotations
 
-import os, math, json, uuid, datetime, requests, time, hmac, hashlib
-from typing import Dict, Any, List, Optional, Tuple
-import pandas as pd
-import numpy as np
-from fastapi import FastAPI, Query
-from fastapi.responses import JSONResponse
+import os, io, csv, math, json, uuid, asyncio, datetime, time, hmac, hashlib, fnmatch, threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple, Union
+from fastapi import FastAPI, Query, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 
-# Optional Supabase (not required)
+import candle_store, confluence, formats, metrics, private_stream, profiler, push, ratelimit, resilience, shared_cache, structure, volume_profile
+from lazy import lazy_module
+
+# Heavy modules load on first use (or during background warmup), not at import
+pd = lazy_module("pandas")
+np = lazy_module("numpy")
+requests = lazy_module("requests")
+
+# Optional Supabase (not required); the client is created lazily by get_supabase()
 SUPABASE = None
-try:
-    from supabase import create_client
-except Exception:
-    create_client = None
+_supabase_lock = threading.Lock()
+_supabase_tried = False
 
 load_dotenv()
 
@@ -22,27 +30,160 @@ ENV_TFS = [s.strip() for s in os.getenv("TF_LIST", "15m,1h,4h,1d").split(",") if
 ENV_LOOKBACK = int(os.getenv("LOOKBACK", "300"))
 ENV_CATEGORY = os.getenv("BYBIT_CATEGORY", "linear")  # Changed default to linear (futures)
 WRITE_SNAPSHOT_JSON = os.getenv("WRITE_SNAPSHOT_JSON", "true").lower() == "true"
+# When set (e.g. 0.001), fetch only the bars each TF needs instead of LOOKBACK (see plan_lookback)
+ENV_WARMUP_TOLERANCE = float(os.getenv("WARMUP_TOLERANCE", "0") or 0)
+# Planned lookbacks: scan structure analyses over at least this many bars (0 = only their warmup)
+STRUCTURE_LOOKBACK = int(os.getenv("STRUCTURE_LOOKBACK", "0"))
+STRUCTURE_CACHE_SIZE = int(os.getenv("STRUCTURE_CACHE_SIZE", "512"))  # incremental structure states kept, 0 = off
+# Volume profile: exchange ticks per price bin (0 = about VOLUME_PROFILE_BINS bins over the frame)
+VOLUME_PROFILE_TICKS = int(os.getenv("VOLUME_PROFILE_TICKS", "0"))
+VOLUME_PROFILE_BINS = int(os.getenv("VOLUME_PROFILE_BINS", "100"))
+VOLUME_PROFILE_VALUE_AREA = float(os.getenv("VOLUME_PROFILE_VALUE_AREA", "0.7"))
+# Confluence zones: levels within this many base-TF ATRs of each other are merged
+CONFLUENCE_ZONE_ATR = float(os.getenv("CONFLUENCE_ZONE_ATR", "0.25"))
+CONFLUENCE_MAX_ZONES = int(os.getenv("CONFLUENCE_MAX_ZONES", "5"))
 
 # Bybit API credentials
 BYBIT_API_KEY = os.getenv("BYBIT_API_KEY", "")
 BYBIT_SECRET_KEY = os.getenv("BYBIT_SECRET_KEY", "")
 BYBIT_TESTNET = os.getenv("BYBIT_TESTNET", "false").lower() == "true"
+# Overrides every Bybit REST URL (market and private), e.g. a local fake_bybit.py for load tests
+BYBIT_BASE_URL = os.getenv("BYBIT_BASE_URL", "").rstrip("/")
+BYBIT_MARKET_URL = BYBIT_BASE_URL or "https://api.bybit.com"  # public market data always comes from mainnet
+# live | record (append every Bybit REST call to BYBIT_CASSETTE) | replay (serve calls from it, no network)
+BYBIT_TRANSPORT = os.getenv("BYBIT_TRANSPORT", "live").lower()
+BYBIT_CASSETTE = os.getenv("BYBIT_CASSETTE", "bybit_cassette.jsonl.gz")
+BYBIT_REPLAY_SCALE = float(os.getenv("BYBIT_REPLAY_SCALE", "1"))  # x recorded latency, 0 = instant
+BYBIT_RATE_LIMIT = float(os.getenv("BYBIT_RATE_LIMIT", "20"))  # requests/s shared by all threads, 0 = off
+# Serve positions/wallet from an authenticated private WebSocket instead of signed REST calls
+BYBIT_PRIVATE_STREAM = os.getenv("BYBIT_PRIVATE_STREAM", "false").lower() == "true"
+BYBIT_PRIVATE_WS_URL = os.getenv("BYBIT_PRIVATE_WS_URL", "") or (
+    private_stream.TESTNET_URL if BYBIT_TESTNET else private_stream.MAINNET_URL)
+PRIVATE_STREAM_CATEGORIES = [s.strip() for s in os.getenv("PRIVATE_STREAM_CATEGORIES", "linear").split(",") if s.strip()]
+# Linear positions are listed per settle coin; resync every coin the stream serves
+PRIVATE_STREAM_SETTLE_COINS = [s.strip().upper() for s in os.getenv("PRIVATE_STREAM_SETTLE_COINS", "USDT,USDC").split(",") if s.strip()]
+
+# On-demand profiling (profile=true); disabled unless a token is configured
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Open a pooled connection to Bybit during startup warmup
+WARMUP_CONNECT = os.getenv("WARMUP_CONNECT", "true").lower() == "true"
+
+# Historical replay
+HISTORY_MAX_BARS = int(os.getenv("HISTORY_MAX_BARS", "100000"))
+
+# Bulk export
+EXPORT_CHUNK_BARS = int(os.getenv("EXPORT_CHUNK_BARS", "10000"))
+EXPORT_MAX_BARS = int(os.getenv("EXPORT_MAX_BARS", "5000000"))
+
+# Market scanner
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+SCAN_MAX_SYMBOLS = int(os.getenv("SCAN_MAX_SYMBOLS", "300"))
+SCAN_UNIVERSE_TTL = float(os.getenv("SCAN_UNIVERSE_TTL", "3600"))
+
+# Candle cache / correlation
+CANDLE_CACHE_MAX_BARS = int(os.getenv("CANDLE_CACHE_MAX_BARS", "1000"))  # ring capacity per series
+CANDLE_STORE_MB = float(os.getenv("CANDLE_STORE_MB", "64"))  # budget across all series
+CANDLE_STORE_FLOAT32 = os.getenv("CANDLE_STORE_FLOAT32", "false").lower() == "true"
+CORRELATION_BENCHMARKS = [s.strip() for s in os.getenv("CORRELATION_BENCHMARKS", "BTCUSDT,ETHUSDT").split(",") if s.strip()]
+CORRELATION_CACHE_SIZE = int(os.getenv("CORRELATION_CACHE_SIZE", "64"))  # rolling-moment states kept (LRU)
+
+# Market context (bulk tickers, optional funding/OI history)
+TICKERS_TTL_S = float(os.getenv("TICKERS_TTL_S", "5"))
+MARKET_HISTORY_TTL_S = float(os.getenv("MARKET_HISTORY_TTL_S", "60"))
+MARKET_HISTORY_POINTS = int(os.getenv("MARKET_HISTORY_POINTS", "24"))
+MARKET_OI_INTERVAL = os.getenv("MARKET_OI_INTERVAL", "1h")  # 5min|15min|30min|1h|4h|1d
+
+# Upstream resilience: a circuit breaker per Bybit endpoint group, stale-while-revalidate
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))  # consecutive failures that open a breaker, 0 = off
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))  # open time before one trial call
+STALE_WAIT_S = float(os.getenv("STALE_WAIT_S", "2"))  # wait this long for a refresh when a stale copy exists
+STALE_MAX_AGE_S = float(os.getenv("STALE_MAX_AGE_S", "3600"))  # older copies are never served
+STALE_SNAPSHOTS = int(os.getenv("STALE_SNAPSHOTS", "256"))  # last good /v1/run snapshots and TF blocks kept
+
+# Request deadline: default /v1/run budget (0 = none), split in order over fetch, compute and position
+RUN_DEADLINE_MS = float(os.getenv("RUN_DEADLINE_MS", "0"))
+RUN_DEADLINE_SPLIT = {k.strip(): float(v) for k, v in (
+    part.split("=", 1) for part in os.getenv("RUN_DEADLINE_SPLIT", "fetch=0.5,compute=0.35,position=0.15").split(",")
+    if part.strip())}
+
+# Cache shared by the worker processes (SQLite file), off when empty
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+SHARED_LEASE_S = float(os.getenv("SHARED_LEASE_S", "10"))  # longest wait on another process's refresh
+SHARED_POSITIONS_TTL_S = float(os.getenv("SHARED_POSITIONS_TTL_S", "2"))  # position lookups reused across processes, 0 = off
+SHARED_CANDLES_TTL_S = float(os.getenv("SHARED_CANDLES_TTL_S", "2"))  # max age of the shared forming bar
+
+# Push subscriptions
+PUSH_GRACE_S = float(os.getenv("PUSH_GRACE_S", "2"))  # wait after a close before asking Bybit for the bar
+PUSH_POLL_S = float(os.getenv("PUSH_POLL_S", "2"))
+PUSH_MAX_WAIT_S = float(os.getenv("PUSH_MAX_WAIT_S", "60"))
+PUSH_HEARTBEAT_S = float(os.getenv("PUSH_HEARTBEAT_S", "15"))
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 
 def supabase_init():
     global SUPABASE
-    if SUPABASE_URL and SUPABASE_KEY and create_client:
+    if SUPABASE_URL and SUPABASE_KEY:
+        try:
+            from supabase import create_client
+        except Exception:
+            return
         try:
             SUPABASE = create_client(SUPABASE_URL, SUPABASE_KEY)
             print("[supabase] connected")
         except Exception as e:
             print("[supabase] init failed:", e)
 
-supabase_init()
+def get_supabase():
+    """Supabase client, created on first use (None when not configured)"""
+    global _supabase_tried
+    if not _supabase_tried:
+        with _supabase_lock:
+            if not _supabase_tried:
+                supabase_init()
+                _supabase_tried = True
+    return SUPABASE
 
-app = FastAPI(title="TA Worker (FastAPI)", version="0.1.0")
+# ---------- Startup / readiness ----------
+
+STARTUP = {"started": time.time(), "ready": False, "ready_s": None, "steps": {}}
+READY = threading.Event()
+
+def warmup():
+    """Load heavy modules, exercise the indicator path once and open upstream connections"""
+    t0 = time.perf_counter()
+    def step(name, fn):
+        t = time.perf_counter()
+        try:
+            fn()
+            STARTUP["steps"][name] = round((time.perf_counter() - t) * 1000, 1)
+        except Exception as e:
+            STARTUP["steps"][name] = f"failed: {e}"
+    step("imports", lambda: (pd.DataFrame, np.ndarray))
+    step("indicators", lambda: compute_indicators(pd.DataFrame({
+        "open": np.ones(30), "high": np.ones(30), "low": np.ones(30), "close": np.ones(30), "volume": np.ones(30)})))
+    step("supabase", get_supabase)
+    if WARMUP_CONNECT:
+        step("bybit_pool", lambda: http_session().get(f"{BYBIT_MARKET_URL}/v5/market/time", timeout=5))
+    STARTUP["ready"] = True
+    STARTUP["ready_s"] = round(time.perf_counter() - t0, 3)
+    READY.set()
+
+@asynccontextmanager
+async def lifespan(app):
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    stream_task = start_private_stream()
+    yield
+    if stream_task is not None:
+        stream_task.cancel()
+    if BYBIT_TRANSPORT == "record" and _http is not None:
+        _http.close()
+        print(f"[transport] {_http.records} Bybit calls recorded to {_http.path}")
+
+app = FastAPI(title="TA Worker (FastAPI)", version="0.1.0", lifespan=lifespan)
 
 # ---------- Helpers ----------
 
@@ -78,19 +219,197 @@ def get_default_category(symbol: str) -> str:
     
     return "linear"  # Default to futures for all symbols
 
+def tf_to_ms(tf: str) -> int:
+    """Candle duration in milliseconds (a month counts as 30 days)"""
+    interval = map_tf_to_bybit(tf)
+    fixed = {"D": 86_400_000, "W": 604_800_000, "M": 30 * 86_400_000}
+    return fixed[interval] if interval in fixed else int(interval) * 60_000
+
 def ts_ms_to_iso(ts_ms: int) -> str:
     return datetime.datetime.utcfromtimestamp(ts_ms/1000).replace(tzinfo=datetime.timezone.utc).isoformat()
 
-def fetch_ohlcv_bybit(symbol: str, tf: str, limit: int = 300, category: str = "spot") -> pd.DataFrame:
-    url = "https://api.bybit.com/v5/market/kline"
+def next_candle_close(tf: str, now_s: float) -> float:
+    """Epoch seconds of the next candle close after `now_s` (weeks start Monday, months on the 1st, UTC)"""
     interval = map_tf_to_bybit(tf)
-    params = {"category": category, "symbol": symbol, "interval": interval, "limit": str(limit)}
-    r = requests.get(url, params=params, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("retCode") != 0:
-        raise RuntimeError(f"Bybit API error: {data}")
-    rows = data["result"]["list"]
+    if interval == "M":
+        now = datetime.datetime.fromtimestamp(now_s, datetime.timezone.utc)
+        year, month = (now.year + 1, 1) if now.month == 12 else (now.year, now.month + 1)
+        return datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc).timestamp()
+    step = tf_to_ms(tf) / 1000
+    offset = 4 * 86400 if interval == "W" else 0  # the epoch was a Thursday
+    return (math.floor((now_s - offset) / step) + 1) * step + offset
+
+# ---------- Instrumentation ----------
+
+STAGE_LATENCY = metrics.histogram(
+    "ta_worker_stage_seconds", "Latency of snapshot pipeline stages", ["symbol", "tf", "stage"])
+BYBIT_CALLS = metrics.counter(
+    "ta_worker_bybit_requests_total", "Upstream Bybit API calls by endpoint and result", ["endpoint", "result"])
+BYBIT_THROTTLED = metrics.counter(
+    "ta_worker_bybit_throttle_seconds_total", "Seconds spent waiting on the shared Bybit rate limiter")
+CANDLE_STORE_BYTES = metrics.gauge("ta_worker_candle_store_bytes", "Bytes held by the candle store ring buffers")
+CANDLE_STORE_SERIES = metrics.gauge("ta_worker_candle_store_series", "Candle series held in the candle store")
+CANDLE_STORE_EVICTIONS = metrics.gauge("ta_worker_candle_store_evictions", "Series evicted from the candle store since start")
+BYBIT_BREAKER_OPEN = metrics.gauge("ta_worker_bybit_breaker_open", "1 while the endpoint group's circuit breaker is open", ["group"])
+STALE_SERVED = metrics.counter("ta_worker_stale_served_total", "Responses served from a stale copy", ["kind"])
+SHARED_LOOKUPS = metrics.counter(
+    "ta_worker_shared_cache_total", "Shared cache lookups by kind and result (hit, built)", ["kind", "result"])
+
+# Request deadline of the current thread; pipeline stages map onto its budget stages (others are compute).
+# Tickers and position lookups give up (or fall back to their stale copy) at the end of compute,
+# which leaves the position share to build those blocks.
+_deadline = threading.local()
+DEADLINE_STAGES = {"fetch": "fetch", "market": "position", "position": "position"}
+
+@contextmanager
+def deadline_scope(deadline: Optional[resilience.Deadline]):
+    previous = getattr(_deadline, "value", None)
+    _deadline.value = deadline
+    try:
+        yield
+    finally:
+        _deadline.value = previous
+
+def current_deadline() -> Optional[resilience.Deadline]:
+    return getattr(_deadline, "value", None)
+
+def deadline_remaining(stage: Optional[str] = None) -> Optional[float]:
+    """Seconds left in the current thread's deadline (for `stage`), None without one"""
+    deadline = current_deadline()
+    return None if deadline is None else deadline.remaining(stage)
+
+@contextmanager
+def timed(stage: str, symbol: str = "", tf: str = "all", timings: Optional[Dict[str, Any]] = None):
+    """Observe a stage latency histogram and optionally record milliseconds in `timings[tf][stage]`.
+
+    Under a deadline, raises `resilience.DeadlineExceeded` instead of starting a stage once its
+    budget has run out or the request was cancelled."""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check(DEADLINE_STAGES.get(stage, "compute"))
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_LATENCY.observe(elapsed, symbol=symbol, tf=tf, stage=stage)
+        if timings is not None and not (deadline is not None and deadline.cancelled.is_set()):
+            timings.setdefault(tf, {})[stage] = round(elapsed * 1000, 3)
+
+# One pooled session keeps upstream connections alive between requests
+_http: Optional[requests.Session] = None
+_http_lock = threading.Lock()
+BYBIT_LIMITER = ratelimit.TokenBucket(BYBIT_RATE_LIMIT)
+
+def http_session() -> requests.Session:
+    """Shared upstream session, or the cassette transport selected by BYBIT_TRANSPORT"""
+    global _http
+    if _http is None:
+        with _http_lock:  # a second recorder would interleave writes to the same cassette
+            if _http is None:
+                _http = new_http_session()
+    return _http
+
+def new_http_session() -> requests.Session:
+    if BYBIT_TRANSPORT != "live":
+        import cassette  # imports requests, which stays lazy in live mode
+    if BYBIT_TRANSPORT == "record":
+        print(f"[transport] recording Bybit calls to {BYBIT_CASSETTE}")
+        return cassette.RecordingSession(BYBIT_CASSETTE)
+    if BYBIT_TRANSPORT == "replay":
+        print(f"[transport] replaying Bybit calls from {BYBIT_CASSETTE} (x{BYBIT_REPLAY_SCALE:g} latency)")
+        return cassette.ReplaySession(BYBIT_CASSETTE, BYBIT_REPLAY_SCALE)
+    return requests.Session()
+
+# Endpoint prefix -> breaker group (first match wins); one group failing does not block the others
+BYBIT_ENDPOINT_GROUPS = (("/v5/market/kline", "kline"), ("/v5/market/", "market"), ("/v5/", "private"))
+BYBIT_BREAKERS = {group: resilience.CircuitBreaker(group, BREAKER_FAILURES, BREAKER_RESET_S)
+                  for _, group in BYBIT_ENDPOINT_GROUPS}
+BYBIT_RATE_LIMIT_CODES = (10006, 10018)  # retCodes for too many requests
+
+def bybit_breaker(endpoint: str) -> resilience.CircuitBreaker:
+    return next((BYBIT_BREAKERS[g] for prefix, g in BYBIT_ENDPOINT_GROUPS if endpoint.startswith(prefix)),
+                BYBIT_BREAKERS["market"])
+
+def _breaker_outcome(breaker: resilience.CircuitBreaker, ok: bool):
+    breaker.success() if ok else breaker.failure()
+    BYBIT_BREAKER_OPEN.set(1 if breaker.state == "open" else 0, group=breaker.name)
+
+def bybit_request(method: str, endpoint: str, base_url: str = BYBIT_MARKET_URL, **kwargs) -> Tuple[requests.Response, Optional[Dict[str, Any]]]:
+    """Call a Bybit REST endpoint and count the outcome; returns (response, parsed JSON or None).
+
+    Raises `resilience.CircuitOpenError` without calling while the endpoint group's breaker is open.
+    Network errors, 5xx/403/429 replies, invalid JSON and rate-limit retCodes count as failures.
+    Under a request deadline the timeout is capped at the time left; running out of it is not
+    held against the breaker."""
+    remaining = deadline_remaining()
+    if remaining is not None:
+        if remaining <= 0:
+            raise resilience.DeadlineExceeded(f"no time left to call {endpoint}")
+        kwargs["timeout"] = min(kwargs.get("timeout") or remaining, remaining)
+    breaker = bybit_breaker(endpoint)
+    if not breaker.allow():
+        BYBIT_CALLS.inc(endpoint=endpoint, result="circuit_open")
+        raise resilience.CircuitOpenError(f"Bybit {breaker.name} circuit open, retry in {breaker.retry_in():.0f}s")
+    waited = BYBIT_LIMITER.acquire()
+    if waited:
+        BYBIT_THROTTLED.inc(waited)
+    try:
+        response = http_session().request(method, f"{base_url}{endpoint}", **kwargs)
+    except requests.exceptions.Timeout:
+        if remaining is not None and kwargs["timeout"] >= remaining:
+            BYBIT_CALLS.inc(endpoint=endpoint, result="deadline")
+            breaker.release()
+            raise resilience.DeadlineExceeded(f"{endpoint} did not answer before the deadline") from None
+        BYBIT_CALLS.inc(endpoint=endpoint, result="network_error")
+        _breaker_outcome(breaker, False)
+        raise
+    except requests.exceptions.RequestException:
+        BYBIT_CALLS.inc(endpoint=endpoint, result="network_error")
+        _breaker_outcome(breaker, False)
+        raise
+    except Exception:
+        _breaker_outcome(breaker, False)  # never leave a half-open trial reserved
+        raise
+    if response.status_code >= 400:
+        BYBIT_CALLS.inc(endpoint=endpoint, result="http_error")
+        _breaker_outcome(breaker, response.status_code < 500 and response.status_code not in (403, 429))
+        return response, None
+    try:
+        data = response.json()
+    except ValueError:
+        BYBIT_CALLS.inc(endpoint=endpoint, result="invalid_json")
+        _breaker_outcome(breaker, False)
+        raise
+    BYBIT_CALLS.inc(endpoint=endpoint, result="ok" if data.get("retCode") == 0 else "api_error")
+    _breaker_outcome(breaker, data.get("retCode") not in BYBIT_RATE_LIMIT_CODES)
+    return response, data
+
+BYBIT_KLINE_PAGE = 1000  # max candles per kline request
+
+def fetch_ohlcv_bybit(symbol: str, tf: str, limit: int = 300, category: str = "spot",
+                      start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> pd.DataFrame:
+    """Fetch up to `limit` candles ending at `end_ms` (default: latest) and not before `start_ms`,
+    paging backwards when more than one request is needed"""
+    interval = map_tf_to_bybit(tf)
+    rows: List[List[str]] = []
+    end: Optional[int] = end_ms
+    while len(rows) < limit:
+        page_limit = min(limit - len(rows), BYBIT_KLINE_PAGE)
+        params = {"category": category, "symbol": symbol, "interval": interval, "limit": str(page_limit)}
+        if start_ms is not None:
+            params["start"] = str(start_ms)
+        if end is not None:
+            params["end"] = str(end)
+        r, data = bybit_request("GET", "/v5/market/kline", params=params, timeout=20)
+        r.raise_for_status()
+        if data.get("retCode") != 0:
+            raise RuntimeError(f"Bybit API error: {data}")
+        page = data["result"]["list"]
+        rows.extend(page)
+        if len(page) < page_limit:
+            break  # no older history
+        end = min(int(x[0]) for x in page) - 1
     rows.sort(key=lambda x: int(x[0]))
     recs = []
     for start, o, h, l, c, v, _ in rows:
@@ -99,10 +418,161 @@ def fetch_ohlcv_bybit(symbol: str, tf: str, limit: int = 300, category: str = "s
                      "close": float(c), "volume": float(v)})
     return pd.DataFrame.from_records(recs)
 
+# ---------- Market context ----------
+
+_tickers_cache: Dict[str, Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+# Background refreshes shared by the candle store and the tickers cache
+UPSTREAM_REFRESH = resilience.Revalidator(STALE_WAIT_S, workers=max(SCAN_WORKERS, 16), wrap=profiler.propagate)
+# Candles, indicator frames, tickers, positions and last good snapshots shared with the other workers
+SHARED = shared_cache.SharedCache(SHARED_CACHE_PATH, SHARED_LEASE_S, max_age_s=max(STALE_MAX_AGE_S, 86400)) \
+    if SHARED_CACHE_PATH else None
+
+def shared_lookup(kind: str, key: str, current, build) -> Tuple[Any, bool]:
+    """`SHARED.get_or_build` counted in SHARED_LOOKUPS"""
+    value, built = SHARED.get_or_build(key, current, build)
+    SHARED_LOOKUPS.inc(kind=kind, result="built" if built else "hit")
+    return value, built
+
+def fetch_tickers(category: str = "linear") -> Tuple[float, Dict[str, Dict[str, Any]]]:
+    """(fetched at, {symbol: ticker}) for a whole category from one `/v5/market/tickers` call, cached for TICKERS_TTL_S.
+
+    Concurrent callers share a single refresh, so any number of symbols and snapshots cost at most
+    one upstream call per category per TTL. While the refresh is slow, failing or blocked by the
+    market breaker, the previous tickers (up to STALE_MAX_AGE_S old) are returned.
+    """
+    cached = _tickers_cache.get(category)
+    if cached and time.time() - cached[0] < TICKERS_TTL_S:
+        return cached
+    usable = cached if cached and time.time() - cached[0] <= STALE_MAX_AGE_S else None
+    if usable and not BYBIT_BREAKERS["market"].available():
+        STALE_SERVED.inc(kind="tickers")
+        return usable
+    value, fresh = UPSTREAM_REFRESH.get(("tickers", category), lambda: refresh_tickers(category),
+                                        (lambda: usable) if usable else None, deadline_remaining("compute"))
+    if not fresh:
+        STALE_SERVED.inc(kind="tickers")
+    return value
+
+def refresh_tickers(category: str) -> Tuple[float, Dict[str, Dict[str, Any]]]:
+    cached = _tickers_cache.get(category)
+    if cached and time.time() - cached[0] < TICKERS_TTL_S:
+        return cached  # refreshed by the previous caller
+    if SHARED is None:
+        cached = tickers_from_bybit(category)
+    else:  # one process per TTL calls Bybit
+        cached, _ = shared_lookup("tickers", f"tickers:{category}", lambda e: time.time() - e.value[0] < TICKERS_TTL_S,
+                                  lambda: ("", tickers_from_bybit(category)))
+    _tickers_cache[category] = cached
+    return cached
+
+def tickers_from_bybit(category: str) -> Tuple[float, Dict[str, Dict[str, Any]]]:
+    r, data = bybit_request("GET", "/v5/market/tickers", params={"category": category}, timeout=20)
+    r.raise_for_status()
+    if data.get("retCode") != 0:
+        raise RuntimeError(f"Bybit API error: {data}")
+    return time.time(), {t["symbol"]: t for t in data["result"]["list"]}
+
+def _num(value: Any) -> Optional[float]:
+    """Float from a Bybit string field; None when missing or empty"""
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+def market_block(symbol: str, category: str, history: bool = False) -> Dict[str, Any]:
+    """Snapshot `market` block from the cached tickers (spot has no mark/index/funding/OI fields)"""
+    try:
+        fetched, tickers = fetch_tickers(category)
+    except resilience.DeadlineExceeded:
+        raise
+    except Exception as e:
+        return {"error": str(e)}
+    t = tickers.get(symbol)
+    if t is None:
+        return {"error": f"{symbol} not found in {category} tickers"}
+    next_funding = _num(t.get("nextFundingTime"))
+    change = _num(t.get("price24hPcnt"))
+    out = {
+        "last_price": _num(t.get("lastPrice")),
+        "mark_price": _num(t.get("markPrice")),
+        "index_price": _num(t.get("indexPrice")),
+        "bid": _num(t.get("bid1Price")),
+        "ask": _num(t.get("ask1Price")),
+        "funding_rate": _num(t.get("fundingRate")),
+        "next_funding_time": ts_ms_to_iso(int(next_funding)) if next_funding else None,
+        "open_interest": _num(t.get("openInterest")),
+        "open_interest_value": _num(t.get("openInterestValue")),
+        "volume_24h": _num(t.get("volume24h")),
+        "turnover_24h": _num(t.get("turnover24h")),
+        "high_24h": _num(t.get("highPrice24h")),
+        "low_24h": _num(t.get("lowPrice24h")),
+        "change_24h_pct": None if change is None else change * 100,
+        "age_s": round(time.time() - fetched, 3),
+    }
+    if history and category != "spot":
+        try:
+            out["funding_history"] = [{"ts": ts_ms_to_iso(ts), "rate": v} for ts, v in funding_history(symbol, category)]
+            out["open_interest_history"] = [{"ts": ts_ms_to_iso(ts), "open_interest": v}
+                                            for ts, v in open_interest_history(symbol, category)]
+        except Exception as e:
+            out["history_error"] = str(e)
+    return out
+
+# Funding / open interest history: per (kind, symbol, category) series, topped up with only the
+# points newer than the last cached one at most every MARKET_HISTORY_TTL_S
+_history_cache: Dict[Tuple[str, str, str], Tuple[float, List[Tuple[int, float]]]] = {}
+_history_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+_history_guard = threading.Lock()
+MARKET_HISTORY_PAGE = 200  # max points per funding/OI history request
+
+def cached_history(key: Tuple[str, str, str], fetch_page) -> List[Tuple[int, float]]:
+    """`fetch_page(since_ms)` returns (ts, value) points after `since_ms` (None: the latest page), oldest first"""
+    with _history_guard:
+        lock = _history_locks.setdefault(key, threading.Lock())
+    with lock:
+        cached = _history_cache.get(key)
+        if cached and time.time() - cached[0] < MARKET_HISTORY_TTL_S:
+            return cached[1]
+        points = cached[1] if cached else []
+        since = points[-1][0] if points else None
+        new = fetch_page(since)
+        if since is None or len(new) >= MARKET_HISTORY_PAGE:
+            points = new  # first fill, or too far behind to stitch: start from the latest page
+        else:
+            points = points + [p for p in new if p[0] > since]
+        points = points[-MARKET_HISTORY_POINTS:]
+        _history_cache[key] = (time.time(), points)
+        return points
+
+def _history_page(endpoint: str, params: Dict[str, str], since: Optional[int], ts_key: str, value_key: str) -> List[Tuple[int, float]]:
+    params = dict(params, limit=str(MARKET_HISTORY_PAGE))
+    if since is not None:
+        params["startTime"] = str(since + 1)
+        params["endTime"] = str(int(time.time() * 1000))
+    r, data = bybit_request("GET", endpoint, params=params, timeout=20)
+    r.raise_for_status()
+    if data.get("retCode") != 0:
+        raise RuntimeError(f"Bybit API error: {data}")
+    return sorted((int(x[ts_key]), float(x[value_key])) for x in data["result"]["list"])
+
+def funding_history(symbol: str, category: str = "linear") -> List[Tuple[int, float]]:
+    """Recent funding rates [(settlement ms, rate)], oldest first"""
+    return cached_history(("funding", symbol, category), lambda since: _history_page(
+        "/v5/market/funding/history", {"category": category, "symbol": symbol}, since,
+        "fundingRateTimestamp", "fundingRate"))
+
+def open_interest_history(symbol: str, category: str = "linear") -> List[Tuple[int, float]]:
+    """Open interest sampled every MARKET_OI_INTERVAL [(ms, contracts)], oldest first"""
+    return cached_history(("open_interest", symbol, category), lambda since: _history_page(
+        "/v5/market/open-interest", {"category": category, "symbol": symbol, "intervalTime": MARKET_OI_INTERVAL},
+        since, "timestamp", "openInterest"))
+
 # ---------- Bybit API Authentication and Position Functions ----------
 
 def get_bybit_base_url() -> str:
-    """Get Bybit API base URL based on testnet setting"""
+    """Get Bybit API base URL based on testnet setting (BYBIT_BASE_URL wins)"""
+    if BYBIT_BASE_URL:
+        return BYBIT_BASE_URL
     if BYBIT_TESTNET:
         return "https://api-testnet.bybit.com"
     return "https://api.bybit.com"
@@ -118,6 +588,28 @@ def sign_bybit_request(api_key: str, secret_key: str, timestamp: str, recv_windo
     ).hexdigest()
     return signature
 
+def format_position(pos: Dict[str, Any]) -> Dict[str, Any]:
+    """Public shape of a Bybit position record (REST list or private stream push)"""
+    def num(key: str, alt: str = "") -> float:
+        return float(pos.get(key) or pos.get(alt) or "0")
+    return {
+        "symbol": pos.get("symbol"),
+        "side": pos.get("side"),  # Buy/Sell
+        "size": num("size"),
+        "entry_price": num("avgPrice", "entryPrice"),  # the stream calls it entryPrice
+        "mark_price": num("markPrice"),
+        "unrealized_pnl": num("unrealisedPnl"),
+        "realized_pnl": num("realisedPnl", "curRealisedPnl"),
+        "leverage": num("leverage"),
+        "margin_mode": pos.get("marginMode"),  # REGULAR_MARGIN/ISOLATED_MARGIN
+        "position_mode": pos.get("positionMode"),  # 0: Merged Single, 3: Both Sides
+        "stop_loss": num("stopLoss"),
+        "take_profit": num("takeProfit"),
+        "position_idx": pos.get("positionIdx"),  # 0: One-Way Mode, 1: Buy Side, 2: Sell Side
+        "category": pos.get("category"),
+        "updated_time": pos.get("updatedTime")
+    }
+
 def get_bybit_positions_with_fallback(symbol: str = None, category: str = "linear") -> Dict[str, Any]:
     """Get current open positions from Bybit with fallback to different account types"""
     
@@ -179,10 +671,9 @@ def get_bybit_positions_for_account_type(symbol: str = None, category: str = "li
         params["sign"] = signature
         
         # Make the request using POST for Bybit API v5
-        url = f"{base_url}{endpoint}"
         headers = {"Content-Type": "application/json"}
         
-        response = requests.post(url, json=params, headers=headers, timeout=30)
+        response, data = bybit_request("POST", endpoint, base_url=base_url, json=params, headers=headers, timeout=30)
         
         # Handle 404 and other errors gracefully
         if response.status_code == 404:
@@ -195,8 +686,6 @@ def get_bybit_positions_for_account_type(symbol: str = None, category: str = "li
         
         response.raise_for_status()
         
-        data = response.json()
-        
         if data.get("retCode") != 0:
             return {
                 "error": "Bybit API error",
@@ -213,23 +702,7 @@ def get_bybit_positions_for_account_type(symbol: str = None, category: str = "li
         for pos in positions:
             # Only include positions with size > 0 (open positions)
             if float(pos.get("size", "0")) > 0:
-                open_positions.append({
-                    "symbol": pos.get("symbol"),
-                    "side": pos.get("side"),  # Buy/Sell
-                    "size": float(pos.get("size", "0")),
-                    "entry_price": float(pos.get("avgPrice", "0")),
-                    "mark_price": float(pos.get("markPrice", "0")),
-                    "unrealized_pnl": float(pos.get("unrealisedPnl", "0")),
-                    "realized_pnl": float(pos.get("realisedPnl", "0")),
-                    "leverage": float(pos.get("leverage", "0")),
-                    "margin_mode": pos.get("marginMode"),  # REGULAR_MARGIN/ISOLATED_MARGIN
-                    "position_mode": pos.get("positionMode"),  # 0: Merged Single, 3: Both Sides
-                    "stop_loss": float(pos.get("stopLoss", "0")),
-                    "take_profit": float(pos.get("takeProfit", "0")),
-                    "position_idx": pos.get("positionIdx"),  # 0: One-Way Mode, 1: Buy Side, 2: Sell Side
-                    "category": pos.get("category"),
-                    "updated_time": pos.get("updatedTime")
-                })
+                open_positions.append(format_position(pos))
         
         return {
             "success": True,
@@ -290,10 +763,9 @@ def get_bybit_positions(symbol: str = None, category: str = "linear") -> Dict[st
         params["sign"] = signature
         
         # Make the request using POST for Bybit API v5
-        url = f"{base_url}{endpoint}"
         headers = {"Content-Type": "application/json"}
         
-        response = requests.post(url, json=params, headers=headers, timeout=30)
+        response, data = bybit_request("POST", endpoint, base_url=base_url, json=params, headers=headers, timeout=30)
         
         # Handle 404 and other errors gracefully
         if response.status_code == 404:
@@ -305,8 +777,6 @@ def get_bybit_positions(symbol: str = None, category: str = "linear") -> Dict[st
         
         response.raise_for_status()
         
-        data = response.json()
-        
         if data.get("retCode") != 0:
             return {
                 "error": "Bybit API error",
@@ -322,23 +792,7 @@ def get_bybit_positions(symbol: str = None, category: str = "linear") -> Dict[st
         for pos in positions:
             # Only include positions with size > 0 (open positions)
             if float(pos.get("size", "0")) > 0:
-                open_positions.append({
-                    "symbol": pos.get("symbol"),
-                    "side": pos.get("side"),  # Buy/Sell
-                    "size": float(pos.get("size", "0")),
-                    "entry_price": float(pos.get("avgPrice", "0")),
-                    "mark_price": float(pos.get("markPrice", "0")),
-                    "unrealized_pnl": float(pos.get("unrealisedPnl", "0")),
-                    "realized_pnl": float(pos.get("realisedPnl", "0")),
-                    "leverage": float(pos.get("leverage", "0")),
-                    "margin_mode": pos.get("marginMode"),  # REGULAR_MARGIN/ISOLATED_MARGIN
-                    "position_mode": pos.get("positionMode"),  # 0: Merged Single, 3: Both Sides
-                    "stop_loss": float(pos.get("stopLoss", "0")),
-                    "take_profit": float(pos.get("takeProfit", "0")),
-                    "position_idx": pos.get("positionIdx"),  # 0: One-Way Mode, 1: Buy Side, 2: Sell Side
-                    "category": pos.get("category"),
-                    "updated_time": pos.get("updatedTime")
-                })
+                open_positions.append(format_position(pos))
         
         return {
             "success": True,
@@ -392,10 +846,9 @@ def get_bybit_account_info() -> Dict[str, Any]:
         params["sign"] = signature
         
         # Make the request using POST for Bybit API v5
-        url = f"{base_url}{endpoint}"
         headers = {"Content-Type": "application/json"}
         
-        response = requests.post(url, json=params, headers=headers, timeout=30)
+        response, data = bybit_request("POST", endpoint, base_url=base_url, json=params, headers=headers, timeout=30)
         
         # Handle 404 and other errors gracefully
         if response.status_code == 404:
@@ -407,8 +860,6 @@ def get_bybit_account_info() -> Dict[str, Any]:
         
         response.raise_for_status()
         
-        data = response.json()
-        
         if data.get("retCode") != 0:
             return {
                 "error": "Bybit API error",
@@ -437,11 +888,113 @@ def get_bybit_account_info() -> Dict[str, Any]:
             "message": str(e)
         }
 
+# ---------- Private stream (positions / wallet) ----------
+
+PRIVATE_STATE = private_stream.AccountState()
+PRIVATE_STREAM: Optional[private_stream.PrivateStream] = None
+
+def signed_bybit_post(endpoint: str, params: Dict[str, str]) -> Dict[str, Any]:
+    """Signed private REST call; returns the `result` object or raises"""
+    timestamp = str(int(time.time() * 1000))
+    recv_window = "5000"
+    params = dict(params, api_key=BYBIT_API_KEY, recv_window=recv_window, timestamp=timestamp)
+    param_str = "&".join([f"{k}={v}" for k, v in sorted(params.items()) if k != "api_key"])
+    params["sign"] = sign_bybit_request(BYBIT_API_KEY, BYBIT_SECRET_KEY, timestamp, recv_window, param_str)
+    response, data = bybit_request("POST", endpoint, base_url=get_bybit_base_url(), json=params,
+                                   headers={"Content-Type": "application/json"}, timeout=30)
+    response.raise_for_status()
+    if data.get("retCode") != 0:
+        raise RuntimeError(f"Bybit API error: {data.get('retCode')} {data.get('retMsg')}")
+    return data.get("result", {})
+
+def list_private_positions(category: str) -> List[Dict[str, Any]]:
+    """Every position of a category from REST, all pages (each settle coin for linear)"""
+    items: List[Dict[str, Any]] = []
+    # listing every linear position needs a settle coin
+    for settle_coin in (PRIVATE_STREAM_SETTLE_COINS if category == "linear" else [None]):
+        cursor = ""
+        while True:
+            params = {"category": category, "limit": "200"}
+            if settle_coin:
+                params["settleCoin"] = settle_coin
+            if cursor:
+                params["cursor"] = cursor
+            result = signed_bybit_post("/v5/position/list", params)
+            items.extend(result.get("list", []))
+            cursor = result.get("nextPageCursor") or ""
+            if not cursor:
+                break
+    return items
+
+def resync_private_state(state: private_stream.AccountState):
+    """Reload positions (PRIVATE_STREAM_CATEGORIES) and wallet from REST after the private stream (re)connects"""
+    for category in PRIVATE_STREAM_CATEGORIES:
+        as_of = int(time.time() * 1000)
+        state.replace_positions(category, list_private_positions(category), as_of)
+    as_of = int(time.time() * 1000)
+    state.apply_wallet(signed_bybit_post("/v5/account/wallet-balance", {"accountType": "UNIFIED"}).get("list", []), as_of)
+
+def start_private_stream(connect=None) -> Optional[asyncio.Task]:
+    """Start the private stream consumer on the running loop when enabled and configured"""
+    global PRIVATE_STREAM
+    if not (BYBIT_PRIVATE_STREAM and BYBIT_API_KEY and BYBIT_SECRET_KEY):
+        return None
+    if BYBIT_TRANSPORT != "live":
+        print(f"[private_stream] not started with BYBIT_TRANSPORT={BYBIT_TRANSPORT}; using REST for positions")
+        return None
+    if connect is None:
+        try:
+            import websockets
+        except ImportError:
+            print("[private_stream] websockets is not installed; using REST for positions")
+            return None
+        connect = websockets.connect
+    PRIVATE_STREAM = private_stream.PrivateStream(BYBIT_PRIVATE_WS_URL, BYBIT_API_KEY, BYBIT_SECRET_KEY,
+                                                  PRIVATE_STATE, resync_private_state, connect)
+    return asyncio.create_task(PRIVATE_STREAM.run())
+
+def stream_state_age() -> float:
+    updated = PRIVATE_STATE.updated_at or PRIVATE_STATE.synced_at or time.time()
+    return round(time.time() - updated, 3)
+
+def get_positions_live(symbol: str = None, category: str = "linear", rest=get_bybit_positions) -> Dict[str, Any]:
+    """Open positions from the private stream state when it is connected and synced, else via `rest`.
+
+    Only PRIVATE_STREAM_CATEGORIES are resynced from REST; other categories hold only what was
+    pushed since connecting, so they always go to `rest`."""
+    if PRIVATE_STREAM is None or not PRIVATE_STATE.ready or category not in PRIVATE_STREAM_CATEGORIES:
+        return rest(symbol, category)
+    open_positions = [format_position(p) for p in PRIVATE_STATE.positions(symbol, category)
+                      if float(p.get("size") or "0") > 0]
+    return {
+        "success": True,
+        "total_open_positions": len(open_positions),
+        "positions": open_positions,
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "category": category,
+        "symbol_filter": symbol if symbol else "all",
+        "source": "stream",
+        "age_s": stream_state_age()
+    }
+
+def get_account_live() -> Dict[str, Any]:
+    """Wallet balance from the private stream state when it is connected and synced, else via REST"""
+    if PRIVATE_STREAM is None or not PRIVATE_STATE.ready:
+        return get_bybit_account_info()
+    return {
+        "success": True,
+        "account_info": PRIVATE_STATE.wallet(),
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "source": "stream",
+        "age_s": stream_state_age()
+    }
+
 # ---------- Advanced Technical Analysis Functions ----------
 
 def find_order_blocks(df: pd.DataFrame, lookback: int = 20) -> Dict[str, List[Dict]]:
     """Find order blocks (liquidity zones)"""
     order_blocks = {"bullish": [], "bearish": []}
+    vol_ma = df['volume'].rolling(10).mean()  # one pass instead of one per bar
     
     for i in range(lookback, len(df) - 1):
         current = df.iloc[i]
@@ -450,27 +1003,27 @@ def find_order_blocks(df: pd.DataFrame, lookback: int = 20) -> Dict[str, List[Di
         # Bullish order block (strong move up after consolidation)
         if (next_candle['close'] > next_candle['open'] and  # Next candle is bullish
             next_candle['close'] > current['high'] and      # Breaks above current high
-            current['volume'] > df['volume'].rolling(10).mean().iloc[i]):  # High volume
+            current['volume'] > vol_ma.iloc[i]):  # High volume
             
             order_blocks["bullish"].append({
                 "start_idx": i,
                 "high": current['high'],
                 "low": current['low'],
                 "strength": (next_candle['close'] - current['high']) / current['high'],
-                "volume_ratio": current['volume'] / df['volume'].rolling(10).mean().iloc[i]
+                "volume_ratio": current['volume'] / vol_ma.iloc[i]
             })
         
         # Bearish order block (strong move down after consolidation)
         elif (next_candle['close'] < next_candle['open'] and  # Next candle is bearish
               next_candle['close'] < current['low'] and       # Breaks below current low
-              current['volume'] > df['volume'].rolling(10).mean().iloc[i]):  # High volume
+              current['volume'] > vol_ma.iloc[i]):  # High volume
             
             order_blocks["bearish"].append({
                 "start_idx": i,
                 "high": current['high'],
                 "low": current['low'],
                 "strength": (current['low'] - next_candle['close']) / current['low'],
-                "volume_ratio": current['volume'] / df['volume'].rolling(10).mean().iloc[i]
+                "volume_ratio": current['volume'] / vol_ma.iloc[i]
             })
     
     return order_blocks
@@ -641,13 +1194,14 @@ def macd(series, fast=12, slow=26, signal=9):
     histogram = macd_line - signal_line
     return macd_line, signal_line, histogram
 
+def true_range(high, low, close):
+    """Calculate True Range (first bar falls back to high - low)"""
+    prev_close = close.shift()
+    return np.fmax(np.fmax(high - low, abs(high - prev_close)), abs(low - prev_close))
+
 def atr(high, low, close, length=14):
     """Calculate Average True Range"""
-    tr1 = high - low
-    tr2 = abs(high - close.shift())
-    tr3 = abs(low - close.shift())
-    tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-    return tr.rolling(window=length).mean()
+    return true_range(high, low, close).rolling(window=length).mean()
 
 def bollinger_bands(series, length=20, std_dev=2):
     """Calculate Bollinger Bands"""
@@ -659,23 +1213,25 @@ def bollinger_bands(series, length=20, std_dev=2):
 
 def adx(high, low, close, length=14):
     """Calculate Average Directional Index"""
-    # True Range
-    tr1 = high - low
-    tr2 = abs(high - close.shift())
-    tr3 = abs(low - close.shift())
-    tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-    
-    # Directional Movement
+    dm_plus, dm_minus = directional_movement(high, low)
+
+    # Smoothed values
+    tr_smooth = true_range(high, low, close).rolling(window=length).mean()
+    dm_plus_smooth = dm_plus.rolling(window=length).mean()
+    dm_minus_smooth = dm_minus.rolling(window=length).mean()
+
+    return adx_from_smoothed(tr_smooth, dm_plus_smooth, dm_minus_smooth, length)
+
+def directional_movement(high, low):
+    """Calculate +DM / -DM"""
     dm_plus = high - high.shift()
     dm_minus = low.shift() - low
     dm_plus = dm_plus.where((dm_plus > dm_minus) & (dm_plus > 0), 0)
     dm_minus = dm_minus.where((dm_minus > dm_plus) & (dm_minus > 0), 0)
-    
-    # Smoothed values
-    tr_smooth = tr.rolling(window=length).mean()
-    dm_plus_smooth = dm_plus.rolling(window=length).mean()
-    dm_minus_smooth = dm_minus.rolling(window=length).mean()
-    
+    return dm_plus, dm_minus
+
+def adx_from_smoothed(tr_smooth, dm_plus_smooth, dm_minus_smooth, length=14):
+    """ADX, DI+ and DI- from smoothed TR and directional movement"""
     # DI+ and DI-
     di_plus = 100 * (dm_plus_smooth / tr_smooth)
     di_minus = 100 * (dm_minus_smooth / tr_smooth)
@@ -688,83 +1244,252 @@ def adx(high, low, close, length=14):
 
 def obv(close, volume):
     """Calculate On Balance Volume"""
-    obv = pd.Series(index=close.index, dtype=float)
-    obv.iloc[0] = volume.iloc[0]
-    
-    for i in range(1, len(close)):
-        if close.iloc[i] > close.iloc[i-1]:
-            obv.iloc[i] = obv.iloc[i-1] + volume.iloc[i]
-        elif close.iloc[i] < close.iloc[i-1]:
-            obv.iloc[i] = obv.iloc[i-1] - volume.iloc[i]
-        else:
-            obv.iloc[i] = obv.iloc[i-1]
-    
-    return obv
+    # Signed volume, seeded with the first bar's volume, accumulated in one pass
+    signed = np.sign(close.diff()) * volume
+    if len(signed):
+        signed.iloc[0] = volume.iloc[0]
+    return signed.cumsum().astype(float)
 
 def vwap(high, low, close, volume):
     """Calculate Volume Weighted Average Price"""
     typical_price = (high + low + close) / 3
     return (typical_price * volume).cumsum() / volume.cumsum()
 
-def compute_indicators(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    
-    # EMAs
-    df["ema_20"] = ema(df["close"], 20)
-    df["ema_50"] = ema(df["close"], 50)
-    df["ema_200"] = ema(df["close"], 200)
-    
-    # RSI
-    df["rsi_14"] = rsi(df["close"], 14)
-    
-    # MACD
-    macd_line, signal_line, histogram = macd(df["close"], 12, 26, 9)
-    df["macd"] = macd_line
-    df["macd_signal"] = signal_line
-    df["macd_hist"] = histogram
-    
-    # ATR
-    df["atr_14"] = atr(df["high"], df["low"], df["close"], 14)
-    
-    # Bollinger Bands
-    bb_mid, bb_up, bb_dn = bollinger_bands(df["close"], 20, 2.0)
-    df["bb_mid"] = bb_mid
-    df["bb_up"] = bb_up
-    df["bb_dn"] = bb_dn
-    df["bb_bw"] = (df["bb_up"] - df["bb_dn"]) / df["bb_mid"]
-    
-    # ADX (+DI/-DI)
-    adx_val, di_plus, di_minus = adx(df["high"], df["low"], df["close"], 14)
-    df["adx_14"] = adx_val
-    df["di_plus"] = di_plus
-    df["di_minus"] = di_minus
-    
-    # OBV
-    df["obv"] = obv(df["close"], df["volume"])
-    
-    # VWAP
+# Snapshot field -> indicator columns it reads (structure analyses read the whole frame)
+SNAPSHOT_FIELDS: Dict[str, List[str]] = {
+    "price": ["close"],
+    "ema20": ["ema_20"], "ema50": ["ema_50"], "ema200": ["ema_200"],
+    "rsi14": ["rsi_14"],
+    "macd": ["macd", "macd_signal", "macd_hist"],
+    "atr14": ["atr_14"],
+    "bb": ["bb_mid", "bb_up", "bb_dn", "bb_bw"],
+    "adx14": ["adx_14"], "di_plus": ["di_plus"], "di_minus": ["di_minus"],
+    "obv": ["obv"],
+    "vwap": ["vwap"],
+    "structure": ["structure_hh", "structure_hl", "structure_lh", "structure_ll"],
+    "order_blocks": [], "support_resistance": [], "fibonacci": [], "elliott_waves": [], "volume_profile": [],
+    # Snapshot-level block across TFs; zones use whichever level fields are also requested
+    "confluence": ["close", "ema_20", "ema_50", "ema_200", "rsi_14", "macd_hist", "di_plus", "di_minus", "atr_14"],
+}
+STRUCTURE_FIELDS = ("order_blocks", "support_resistance", "fibonacci", "elliott_waves", "volume_profile")
+
+def parse_fields(spec: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma-separated `fields` spec (wildcards allowed, e.g. `rsi14,ema*`); None means everything"""
+    if not spec or not spec.strip():
+        return None
+    selected = ["price"]
+    for pattern in (p.strip() for p in spec.split(",")):
+        if not pattern:
+            continue
+        matches = fnmatch.filter(SNAPSHOT_FIELDS.keys(), pattern)
+        if not matches:
+            raise ValueError(f"Unknown field: {pattern}")
+        selected.extend(m for m in matches if m not in selected)
+    return selected
+
+def indicator_columns(fields: Optional[List[str]]) -> Optional[List[str]]:
+    """Indicator columns needed to serve `fields` (None means all)"""
+    if fields is None:
+        return None
+    return [c for f in fields for c in SNAPSHOT_FIELDS[f]]
+
+# ---------- Indicator registry ----------
+
+# Shared intermediates, addressed by key. Parametric keys look like "kind:source:param"
+# (e.g. "sma:tr:14" is the 14-bar mean of the true range); sources may themselves be keys.
+INTERMEDIATES: Dict[str, Any] = {
+    "tr": lambda ctx: true_range(ctx["high"], ctx["low"], ctx["close"]),
+    "typical_price": lambda ctx: (ctx["high"] + ctx["low"] + ctx["close"]) / 3,
+    "close_delta": lambda ctx: ctx["close"].diff(),
+    "gain": lambda ctx: ctx["close_delta"].where(ctx["close_delta"] > 0, 0),
+    "loss": lambda ctx: -ctx["close_delta"].where(ctx["close_delta"] < 0, 0),
+    "dm": lambda ctx: directional_movement(ctx["high"], ctx["low"]),
+    "dm_plus": lambda ctx: ctx["dm"][0],
+    "dm_minus": lambda ctx: ctx["dm"][1],
+    "ema": lambda ctx, src, span: ema(ctx[src], int(span)),
+    "sma": lambda ctx, src, window: ctx[src].rolling(window=int(window)).mean(),
+    "std": lambda ctx, src, window: ctx[src].rolling(window=int(window)).std(),
+}
+
+class FrameContext:
+    """Per-frame memo of shared intermediates; each key is computed at most once"""
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.computed: List[str] = []
+        self._cache: Dict[str, Any] = {}
+
+    def __getitem__(self, key: str):
+        if key in self._cache:
+            return self._cache[key]
+        if key in self.df:  # a column of a frame, or a field of a panel dict
+            return self.df[key]
+        kind, *args = key.split(":")
+        if kind not in INTERMEDIATES:
+            raise KeyError(f"Unknown intermediate: {key}")
+        value = INTERMEDIATES[kind](self, *args)
+        self._cache[key] = value
+        self.computed.append(key)
+        return value
+
+# Leading bars lost by non-parametric intermediates (they read the previous bar)
+INTERMEDIATE_WARMUP = {"tr": 1, "close_delta": 1, "gain": 1, "loss": 1, "dm": 1, "dm_plus": 1, "dm_minus": 1}
+
+def ema_warmup(span: int, tolerance: float) -> int:
+    """Bars until the seed value's weight in an adjust=False EMA falls below `tolerance`"""
+    alpha = 2.0 / (span + 1)
+    return int(math.ceil(math.log(tolerance) / math.log(1 - alpha)))
+
+def intermediate_warmup(key: str, tolerance: float) -> int:
+    """Leading bars of `key` that are NaN or not yet converged to within `tolerance`"""
+    kind, *args = key.split(":")
+    if kind == "ema":
+        return intermediate_warmup(args[0], tolerance) + ema_warmup(int(args[1]), tolerance)
+    if kind in ("sma", "std"):
+        return intermediate_warmup(args[0], tolerance) + int(args[1]) - 1
+    return INTERMEDIATE_WARMUP.get(kind, 0)
+
+class Indicator:
+    def __init__(self, name: str, outputs: Tuple[str, ...], inputs: Tuple[str, ...], compute, params: Dict[str, Any],
+                 extra_warmup=None):
+        self.name = name
+        self.outputs = outputs
+        self.inputs = inputs
+        self.compute = compute
+        self.params = params
+        self.extra_warmup = extra_warmup
+
+    def run(self, ctx: FrameContext) -> Dict[str, Any]:
+        return self.compute(ctx, **self.params)
+
+    def warmup(self, tolerance: float) -> int:
+        """Leading bars before every output is within `tolerance` of its converged value"""
+        need = max((intermediate_warmup(k, tolerance) for k in self.inputs), default=0)
+        if self.extra_warmup:
+            need += self.extra_warmup(tolerance, **self.params)
+        return need
+
+# Registration order is the column order of compute_indicators()
+INDICATORS: Dict[str, Indicator] = {}
+
+def register_indicator(name: str, outputs: List[str], inputs: List[str] = (), extra_warmup=None, **params):
+    """Register `fn(ctx, **params) -> {column: values}` as an indicator reading the `inputs` keys.
+
+    `extra_warmup(tolerance, **params)` adds bars needed on top of the inputs' own warmup
+    (e.g. a signal line smoothed after the inputs).
+    """
+    def deco(fn):
+        INDICATORS[name] = Indicator(name, tuple(outputs), tuple(inputs), fn, params, extra_warmup)
+        return fn
+    return deco
+
+def plan_indicators(columns: Optional[List[str]] = None) -> List[Indicator]:
+    """Indicators needed to produce `columns` (None means all), in registration order"""
+    if columns is None:
+        return list(INDICATORS.values())
+    wanted = set(columns)
+    return [ind for ind in INDICATORS.values() if wanted.intersection(ind.outputs)]
+
+def _ema_indicator(ctx, span):
+    return {f"ema_{span}": ctx[f"ema:close:{span}"]}
+
+for _span in (20, 50, 200):
+    register_indicator(f"ema_{_span}", [f"ema_{_span}"], [f"ema:close:{_span}"], span=_span)(_ema_indicator)
+
+@register_indicator("rsi_14", ["rsi_14"], ["sma:gain:14", "sma:loss:14"], length=14)
+def _rsi_indicator(ctx, length):
+    rs = ctx[f"sma:gain:{length}"] / ctx[f"sma:loss:{length}"]
+    return {"rsi_14": 100 - (100 / (1 + rs))}
+
+@register_indicator("macd", ["macd", "macd_signal", "macd_hist"], ["ema:close:12", "ema:close:26"],
+                    extra_warmup=lambda tol, signal, **_: ema_warmup(signal, tol), fast=12, slow=26, signal=9)
+def _macd_indicator(ctx, fast, slow, signal):
+    macd_line = ctx[f"ema:close:{fast}"] - ctx[f"ema:close:{slow}"]
+    signal_line = ema(macd_line, signal)
+    return {"macd": macd_line, "macd_signal": signal_line, "macd_hist": macd_line - signal_line}
+
+@register_indicator("atr_14", ["atr_14"], ["sma:tr:14"], length=14)
+def _atr_indicator(ctx, length):
+    return {"atr_14": ctx[f"sma:tr:{length}"]}
+
+@register_indicator("bb", ["bb_mid", "bb_up", "bb_dn", "bb_bw"], ["sma:close:20", "std:close:20"], length=20, std_dev=2.0)
+def _bb_indicator(ctx, length, std_dev):
+    mid = ctx[f"sma:close:{length}"]
+    std = ctx[f"std:close:{length}"]
+    up = mid + (std * std_dev)
+    dn = mid - (std * std_dev)
+    return {"bb_mid": mid, "bb_up": up, "bb_dn": dn, "bb_bw": (up - dn) / mid}
+
+@register_indicator("adx_14", ["adx_14", "di_plus", "di_minus"], ["sma:tr:14", "sma:dm_plus:14", "sma:dm_minus:14"],
+                    extra_warmup=lambda tol, length: length - 1, length=14)
+def _adx_indicator(ctx, length):
+    adx_val, di_plus, di_minus = adx_from_smoothed(
+        ctx[f"sma:tr:{length}"], ctx[f"sma:dm_plus:{length}"], ctx[f"sma:dm_minus:{length}"], length)
+    return {"adx_14": adx_val, "di_plus": di_plus, "di_minus": di_minus}
+
+@register_indicator("obv", ["obv"], ["close", "volume"])
+def _obv_indicator(ctx):
+    return {"obv": obv(ctx["close"], ctx["volume"])}
+
+@register_indicator("vwap", ["vwap"], ["typical_price", "volume"])
+def _vwap_indicator(ctx):
     try:
-        df["vwap"] = vwap(df["high"], df["low"], df["close"], df["volume"])
+        return {"vwap": (ctx["typical_price"] * ctx["volume"]).cumsum() / ctx["volume"].cumsum()}
     except Exception:
-        df["vwap"] = None
-    
+        return {"vwap": None}
+
+@register_indicator("structure", ["structure_hh", "structure_hl", "structure_lh", "structure_ll"], ["high", "low"],
+                    extra_warmup=lambda tol: 1)
+def _structure_indicator(ctx):
     # Simple structure flags based on last two closed candles
-    df["structure_hh"] = 0
-    df["structure_hl"] = 0
-    df["structure_lh"] = 0
-    df["structure_ll"] = 0
-    if len(df) >= 3:
-        last = df.iloc[-2]
-        prev = df.iloc[-3]
-        if last["high"] > prev["high"]:
-            df.loc[df.index[-2], "structure_hh"] = 1
-        else:
-            df.loc[df.index[-2], "structure_lh"] = 1
-        if last["low"] > prev["low"]:
-            df.loc[df.index[-2], "structure_hl"] = 1
-        else:
-            df.loc[df.index[-2], "structure_ll"] = 1
-    
+    flags = {k: np.zeros(len(ctx.df), dtype=np.int64) for k in ("structure_hh", "structure_hl", "structure_lh", "structure_ll")}
+    if len(ctx.df) >= 3:
+        high = ctx["high"].to_numpy()
+        low = ctx["low"].to_numpy()
+        flags["structure_hh" if high[-2] > high[-3] else "structure_lh"][-2] = 1
+        flags["structure_hl" if low[-2] > low[-3] else "structure_ll"][-2] = 1
+    return flags
+
+# Minimum bars each structure analysis reads: order blocks start at bar 20 and need the
+# breakout candle, S/R pivots are 2 bars wide on each side, Fibonacci spans the last 50 bars
+# and Elliott swings are 1 bar wide on each side.
+STRUCTURE_WARMUP = {"order_blocks": 21, "support_resistance": 4, "fibonacci": 49, "elliott_waves": 2, "volume_profile": 1}
+
+def indicator_warmup(fields: Optional[List[str]], tolerance: float) -> int:
+    """Leading bars before every requested indicator is within `tolerance`"""
+    return max((ind.warmup(tolerance) for ind in plan_indicators(indicator_columns(fields))), default=0)
+
+def plan_lookback(fields: Optional[List[str]], tolerance: float) -> int:
+    """Bars to fetch so every requested field is within `tolerance` on the last closed bar.
+
+    OBV and VWAP are cumulative from the first fetched bar and never converge, so they only
+    need the bar itself. Structure analyses need their STRUCTURE_WARMUP; STRUCTURE_LOOKBACK, when
+    set, is a separate policy that widens the window they scan (their levels depend on it).
+    """
+    structure_fields = [f for f in STRUCTURE_FIELDS if fields is None or f in fields]
+    need = max([indicator_warmup(fields, tolerance)] + [STRUCTURE_WARMUP[f] for f in structure_fields])
+    if structure_fields and STRUCTURE_LOOKBACK > 0:
+        need = max(need, STRUCTURE_LOOKBACK - 2)
+    return need + 2  # the last closed bar itself plus the forming bar
+
+def plan_lookbacks(tf_list: List[str], fields: Optional[List[str]], tolerance: float) -> Dict[str, int]:
+    """Per-TF bars to fetch (every TF shares the same bar-based indicator periods)"""
+    bars = plan_lookback(fields, tolerance)
+    return {tf: bars for tf in tf_list}
+
+def compute_indicators(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Add indicator columns to a copy of `df`; `columns` limits the work to what is requested.
+
+    Each planned indicator reads shared intermediates (true range, EMAs, rolling windows, ...)
+    from one FrameContext, so e.g. ATR and ADX share a single true-range pass.
+    """
+    df = df.copy()
+    ctx = FrameContext(df)
+    deadline = current_deadline()
+    for ind in plan_indicators(columns):
+        if deadline is not None:
+            deadline.check("compute")  # a cancelled request stops between indicators
+        for col, values in ind.run(ctx).items():
+            df[col] = values
     return df
 
 def last_closed_row(df: pd.DataFrame) -> pd.Series:
@@ -772,130 +1497,341 @@ def last_closed_row(df: pd.DataFrame) -> pd.Series:
         return df.iloc[-2]
     return df.iloc[-1]
 
-def build_snapshot(symbol: str, feature_map: Dict[str, pd.Series], dataframes: Dict[str, pd.DataFrame] = None, include_position: bool = True) -> Dict[str, Any]:
-    feat: Dict[str, Any] = {}
-    def n(x):
-        if x is None: return None
-        if isinstance(x, float) and math.isnan(x): return None
-        return float(x)
+def to_float(x):
+    """JSON-safe float (NaN/None -> None)"""
+    if x is None: return None
+    if isinstance(x, float) and math.isnan(x): return None
+    return float(x)
+
+# Incremental per-series states (structure, volume profile), least recently used dropped first
+_structure_states: "OrderedDict[Tuple, Any]" = OrderedDict()
+_structure_lock = threading.Lock()
+
+def incremental_view(key: Tuple, df: pd.DataFrame, factory, keep=None) -> Dict[str, Any]:
+    """View of `df` (closed bars plus the forming last row) from the state cached under `key`
+    (created with `factory()`, replaced when `keep(state)` is false); only bars closed since the
+    last call are pushed"""
+    with _structure_lock:
+        state = _structure_states.get(key)
+        if state is None or (keep is not None and not keep(state)):
+            state = _structure_states[key] = factory()
+        _structure_states.move_to_end(key)
+        while len(_structure_states) > STRUCTURE_CACHE_SIZE:
+            _structure_states.popitem(last=False)
+    ts = df["ts"].to_numpy()
+    bars = np.column_stack([df[c].to_numpy(dtype=float) for c in ("open", "high", "low", "close", "volume")])
+    with state.lock:
+        first = 0
+        if state.last_ts is not None:
+            pos = int(np.searchsorted(ts, state.last_ts))
+            if pos < len(ts) - 1 and ts[pos] == state.last_ts and tuple(bars[pos]) == state.last_bar:
+                first = pos + 1
+            else:
+                state.reset()  # gap or revised history: rebuild from this frame
+        for k in range(first, len(df) - 1):
+            state.push(ts[k], bars[k])
+        return state.view(bars[-1])
+
+def structure_view(symbol: str, tf: str, category: str, df: pd.DataFrame) -> Dict[str, Any]:
+    """Order blocks, S/R levels and Elliott summary from the state kept per (symbol, tf, category, frame length)"""
+    return incremental_view(("structure", symbol, tf, category, len(df)), df, lambda: structure.StructureState(len(df)))
+
+_tick_sizes: Dict[Tuple[str, str], Tuple[float, Optional[float]]] = {}  # (fetched at, tick; None: not listed)
+_tick_failed: Dict[Tuple[str, str], float] = {}  # last failed lookup; retried TICK_SIZE_RETRY_S later
+TICK_SIZE_RETRY_S = 30.0
+
+def instrument_tick_size(symbol: str, category: str) -> Optional[float]:
+    """The stored price tick (None when not loaded); never calls Bybit, so it is safe in the compute stage"""
+    cached = _tick_sizes.get((symbol, category))
+    return cached[1] if cached else None
+
+def load_tick_size(symbol: str, category: str) -> Optional[float]:
+    """Fetch stage: make sure the price tick is loaded, refreshing it after SCAN_UNIVERSE_TTL.
+
+    A failed or late lookup is not stored and does not fail the TF: it is retried TICK_SIZE_RETRY_S
+    later, and until then the stored tick is used, if any, else the profile bins by count."""
+    key = (symbol, category)
+    if not tick_size_due(key):
+        return instrument_tick_size(symbol, category)
+    cached = _tick_sizes.get(key)
+    try:
+        tick, _ = UPSTREAM_REFRESH.get(("tick_size", key), lambda: refresh_tick_size(symbol, category),
+                                       (lambda: cached[1]) if cached else None, deadline_remaining("fetch"))
+        return tick
+    except Exception as e:
+        print(f"[volume_profile] tick size lookup failed for {symbol}: {e}")
+        return instrument_tick_size(symbol, category)
+
+def tick_size_due(key: Tuple[str, str]) -> bool:
+    """The stored tick is older than SCAN_UNIVERSE_TTL (or missing) and no lookup failed just now"""
+    cached = _tick_sizes.get(key)
+    now = time.time()
+    return ((cached is None or now - cached[0] >= SCAN_UNIVERSE_TTL)
+            and now - _tick_failed.get(key, 0) >= TICK_SIZE_RETRY_S)
+
+def refresh_tick_size(symbol: str, category: str) -> Optional[float]:
+    key = (symbol, category)
+    try:
+        r, data = bybit_request("GET", "/v5/market/instruments-info", params={"category": category, "symbol": symbol}, timeout=20)
+        r.raise_for_status()
+        if data.get("retCode") != 0:
+            raise RuntimeError(f"Bybit API error: {data}")
+    except Exception:
+        _tick_failed[key] = time.time()
+        raise
+    items = data["result"]["list"]
+    tick = float(items[0]["priceFilter"]["tickSize"]) if items else None
+    _tick_sizes[key] = (time.time(), tick)
+    return tick
+
+def volume_profile_block(symbol: str, tf: str, df: pd.DataFrame, category: Optional[str] = None) -> Dict[str, Any]:
+    """POC / value area / volume nodes of `df`; incremental per (symbol, tf, category, frame length)
+    when a category is given and the state cache is on"""
+    low, high = df["low"].to_numpy(dtype=float), df["high"].to_numpy(dtype=float)
+    tick = instrument_tick_size(symbol, category) if category else None
+    bin_size = volume_profile.choose_bin_size(float(high.max() - low.min()), tick, VOLUME_PROFILE_TICKS, VOLUME_PROFILE_BINS)
+    if not category or STRUCTURE_CACHE_SIZE <= 0:
+        return volume_profile.profile(low, high, df["volume"].to_numpy(dtype=float), bin_size, VOLUME_PROFILE_VALUE_AREA)
+    return incremental_view(("volume_profile", symbol, tf, category, len(df)), df,
+                            lambda: volume_profile.ProfileState(len(df), bin_size, VOLUME_PROFILE_VALUE_AREA),
+                            keep=lambda state: 0.5 <= state.bin_size / bin_size <= 2)  # re-bin only on a large range change
+
+def build_tf_features(symbol: str, tf: str, s: pd.Series, df: Optional[pd.DataFrame] = None,
+                      fields: Optional[List[str]] = None, timings: Optional[Dict[str, Any]] = None,
+                      category: Optional[str] = None) -> Dict[str, Any]:
+    """Feature block for one timeframe; only `fields` are computed and included (None means all).
+
+    With a `category`, order blocks, S/R levels and Elliott waves come from the incremental
+    structure state of (symbol, tf, category) instead of a full rescan of `df`.
+    """
+    def want(field: str) -> bool:
+        return fields is None or field in fields
     
-    for tf, s in feature_map.items():
-        # Get the dataframe for this timeframe to calculate advanced indicators
-        df = dataframes.get(tf) if dataframes else None
-        
-        if df is not None and len(df) > 0:
-            # Calculate advanced indicators
-            order_blocks = find_order_blocks(df)
-            support_resistance = find_support_resistance_levels(df)
-            
-            # Find recent swing high and low for Fibonacci
+    out: Dict[str, Any] = {"price": to_float(s.get("close"))}
+    if want("ema20"): out["ema20"] = to_float(s.get("ema_20"))
+    if want("ema50"): out["ema50"] = to_float(s.get("ema_50"))
+    if want("ema200"): out["ema200"] = to_float(s.get("ema_200"))
+    if want("rsi14"): out["rsi14"] = to_float(s.get("rsi_14"))
+    if want("macd"): out["macd"] = {"val": to_float(s.get("macd")), "signal": to_float(s.get("macd_signal")), "hist": to_float(s.get("macd_hist"))}
+    if want("atr14"): out["atr14"] = to_float(s.get("atr_14"))
+    if want("bb"): out["bb"] = {"mid": to_float(s.get("bb_mid")), "up": to_float(s.get("bb_up")), "dn": to_float(s.get("bb_dn")), "bw": to_float(s.get("bb_bw"))}
+    if want("adx14"): out["adx14"] = to_float(s.get("adx_14"))
+    if want("di_plus"): out["di_plus"] = to_float(s.get("di_plus"))
+    if want("di_minus"): out["di_minus"] = to_float(s.get("di_minus"))
+    if want("obv"): out["obv"] = to_float(s.get("obv"))
+    if want("vwap"): out["vwap"] = to_float(s.get("vwap"))
+    if want("structure"):
+        out["structure"] = {
+            "hh": int(s.get("structure_hh") or 0),
+            "hl": int(s.get("structure_hl") or 0),
+            "lh": int(s.get("structure_lh") or 0),
+            "ll": int(s.get("structure_ll") or 0),
+        }
+    
+    # Advanced indicators need the full dataframe
+    if df is None or len(df) == 0:
+        return out
+    
+    incremental = None
+    if category and STRUCTURE_CACHE_SIZE > 0 and any(want(f) for f in ("order_blocks", "support_resistance", "elliott_waves")):
+        with timed("structure_state", symbol, tf, timings):
+            incremental = structure_view(symbol, tf, category, df)
+    if want("order_blocks"):
+        with timed("order_blocks", symbol, tf, timings):
+            order_blocks = incremental["order_blocks"] if incremental else find_order_blocks(df)
+        out["order_blocks"] = {
+            "bullish": order_blocks["bullish"][-3:] if order_blocks["bullish"] else [],  # Last 3
+            "bearish": order_blocks["bearish"][-3:] if order_blocks["bearish"] else []   # Last 3
+        }
+    if want("support_resistance"):
+        with timed("support_resistance", symbol, tf, timings):
+            support_resistance = incremental["support_resistance"] if incremental else find_support_resistance_levels(df)
+        out["support_resistance"] = {
+            "support": [float(x) for x in support_resistance["support"][:5]],  # Top 5 support levels
+            "resistance": [float(x) for x in support_resistance["resistance"][:5]]  # Top 5 resistance levels
+        }
+    if want("fibonacci"):
+        # Find recent swing high and low for Fibonacci
+        with timed("fibonacci", symbol, tf, timings):
             recent_high = df['high'].tail(50).max()
             recent_low = df['low'].tail(50).min()
             fib_retracements = fibonacci_retracements(recent_high, recent_low)
-            
-            # Elliott Wave analysis
+        out["fibonacci"] = {
+            "retracements": {k: float(v) for k, v in fib_retracements.items()},
+            "recent_high": float(recent_high),
+            "recent_low": float(recent_low)
+        }
+    if want("elliott_waves") and incremental:
+        out["elliott_waves"] = incremental["elliott_waves"]
+    elif want("elliott_waves"):
+        # Elliott Wave analysis
+        with timed("elliott_waves", symbol, tf, timings):
             elliott_waves = identify_elliott_waves(df)
-            
-            feat[tf] = {
-                "price": n(s.get("close")),
-                "ema20": n(s.get("ema_20")), "ema50": n(s.get("ema_50")), "ema200": n(s.get("ema_200")),
-                "rsi14": n(s.get("rsi_14")),
-                "macd": {"val": n(s.get("macd")), "signal": n(s.get("macd_signal")), "hist": n(s.get("macd_hist"))},
-                "atr14": n(s.get("atr_14")),
-                "bb": {"mid": n(s.get("bb_mid")), "up": n(s.get("bb_up")), "dn": n(s.get("bb_dn")), "bw": n(s.get("bb_bw"))},
-                "adx14": n(s.get("adx_14")),
-                "di_plus": n(s.get("di_plus")),
-                "di_minus": n(s.get("di_minus")),
-                "obv": n(s.get("obv")),
-                "vwap": n(s.get("vwap")),
-                "structure": {
-                    "hh": int(s.get("structure_hh") or 0),
-                    "hl": int(s.get("structure_hl") or 0),
-                    "lh": int(s.get("structure_lh") or 0),
-                    "ll": int(s.get("structure_ll") or 0),
-                },
-                # Advanced indicators
-                "order_blocks": {
-                    "bullish": order_blocks["bullish"][-3:] if order_blocks["bullish"] else [],  # Last 3
-                    "bearish": order_blocks["bearish"][-3:] if order_blocks["bearish"] else []   # Last 3
-                },
-                "support_resistance": {
-                    "support": [float(x) for x in support_resistance["support"][:5]],  # Top 5 support levels
-                    "resistance": [float(x) for x in support_resistance["resistance"][:5]]  # Top 5 resistance levels
-                },
-                "fibonacci": {
-                    "retracements": {k: float(v) for k, v in fib_retracements.items()},
-                    "recent_high": float(recent_high),
-                    "recent_low": float(recent_low)
-                },
-                "elliott_waves": {
-                    "pattern": elliott_waves["pattern"],
-                    "confidence": float(elliott_waves["confidence"]),
-                    "wave_count": len(elliott_waves["waves"]),
-                    "current_wave": elliott_waves["waves"][-1] if elliott_waves["waves"] else None
-                }
-            }
-        else:
-            # Fallback to basic indicators if dataframe not available
-            feat[tf] = {
-                "price": n(s.get("close")),
-                "ema20": n(s.get("ema_20")), "ema50": n(s.get("ema_50")), "ema200": n(s.get("ema_200")),
-                "rsi14": n(s.get("rsi_14")),
-                "macd": {"val": n(s.get("macd")), "signal": n(s.get("macd_signal")), "hist": n(s.get("macd_hist"))},
-                "atr14": n(s.get("atr_14")),
-                "bb": {"mid": n(s.get("bb_mid")), "up": n(s.get("bb_up")), "dn": n(s.get("bb_dn")), "bw": n(s.get("bb_bw"))},
-                "adx14": n(s.get("adx_14")),
-                "di_plus": n(s.get("di_plus")),
-                "di_minus": n(s.get("di_minus")),
-                "obv": n(s.get("obv")),
-                "vwap": n(s.get("vwap")),
-                "structure": {
-                    "hh": int(s.get("structure_hh") or 0),
-                    "hl": int(s.get("structure_hl") or 0),
-                    "lh": int(s.get("structure_lh") or 0),
-                    "ll": int(s.get("structure_ll") or 0),
-                }
-            }
+        out["elliott_waves"] = {
+            "pattern": elliott_waves["pattern"],
+            "confidence": float(elliott_waves["confidence"]),
+            "wave_count": len(elliott_waves["waves"]),
+            "current_wave": elliott_waves["waves"][-1] if elliott_waves["waves"] else None
+        }
+    if want("volume_profile"):
+        with timed("volume_profile", symbol, tf, timings):
+            out["volume_profile"] = volume_profile_block(symbol, tf, df, category)
+    return out
+
+CONFLUENCE_COLUMNS = SNAPSHOT_FIELDS["confluence"]
+
+def open_times_ms(df: pd.DataFrame) -> np.ndarray:
+    index = df.index if isinstance(df.index, pd.DatetimeIndex) else pd.DatetimeIndex(pd.to_datetime(df["ts"], utc=True))
+    return index.asi8 // 1_000_000
+
+def feature_levels(tf: str, block: Dict[str, Any]) -> List[Tuple[float, str]]:
+    """(price, source) of every level in a TF feature block: S/R, Fibonacci, volume profile"""
+    levels = []
+    for side in ("support", "resistance"):
+        levels += [(p, f"{tf}:{side}") for p in (block.get("support_resistance") or {}).get(side, [])]
+    for ratio, p in ((block.get("fibonacci") or {}).get("retracements") or {}).items():
+        levels.append((p, f"{tf}:fib_{ratio}"))
+    for key in ("poc", "vah", "val"):
+        p = (block.get("volume_profile") or {}).get(key)
+        if p is not None:
+            levels.append((p, f"{tf}:{key}"))
+    return levels
+
+def confluence_block(dataframes: Dict[str, pd.DataFrame], features: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Cross-TF trend/momentum alignment on the base (shortest) TF's closed bars, plus S/R/Fibonacci/
+    volume-profile zones backed by at least two TFs"""
+    tfs = [tf for tf in dataframes if len(dataframes[tf]) >= 2]
+    if not tfs:
+        return {}
+    tfs.sort(key=tf_to_ms)
+    base = tfs[0]
+    base_df = dataframes[base].iloc[:-1]  # closed bars only, like last_closed_row
+    base_close = open_times_ms(base_df) + tf_to_ms(base)
+    n = len(base_close)
+    trend, momentum = np.full((n, len(tfs)), np.nan), np.full((n, len(tfs)), np.nan)
+    for j, tf in enumerate(tfs):
+        df = dataframes[tf]
+        cols = {c: df[c].to_numpy(dtype=float) for c in CONFLUENCE_COLUMNS if c in df.columns}
+        idx = confluence.asof_index(base_close, open_times_ms(df), tf_to_ms(tf))
+        ok = idx >= 0
+        trend[ok, j] = confluence.trend_votes(cols, len(df))[idx[ok]]
+        momentum[ok, j] = confluence.momentum_votes(cols, len(df))[idx[ok]]
+
+    price = float(base_df["close"].iloc[-1])
+    atr = float(base_df["atr_14"].iloc[-1]) if "atr_14" in base_df.columns else float("nan")
+    tolerance = CONFLUENCE_ZONE_ATR * atr if atr > 0 else 0.002 * price  # no ATR: 0.2% of price
+    prices, tf_ids, sources = [], [], []
+    for j, tf in enumerate(tfs):
+        for p, source in feature_levels(tf, features.get(tf) or {}):
+            prices.append(p)
+            tf_ids.append(j)
+            sources.append(source)
+    return {
+        "base_tf": base,
+        "as_of": base_df["ts"].iloc[-1],
+        "trend": confluence.alignment(trend, tfs),
+        "momentum": confluence.alignment(momentum, tfs),
+        "zones": confluence.cluster_levels(prices, tf_ids, sources, tfs, tolerance, price, limit=CONFLUENCE_MAX_ZONES),
+    }
+
+def build_snapshot(symbol: str, feature_map: Dict[str, pd.Series], dataframes: Dict[str, pd.DataFrame] = None, include_position: bool = True,
+                   timings: Optional[Dict[str, Any]] = None, fields: Optional[List[str]] = None,
+                   category: Optional[str] = None, include_market: bool = False, market_history: bool = False) -> Dict[str, Any]:
+    """Assemble the snapshot; `category` enables the incremental structure state and the `market` block"""
+    feat: Dict[str, Any] = {}
+    for tf, s in feature_map.items():
+        # Get the dataframe for this timeframe to calculate advanced indicators
+        df = dataframes.get(tf) if dataframes else None
+        feat[tf] = build_tf_features(symbol, tf, s, df, fields, timings, category)
     
     snapshot = {
         "symbol": symbol,
         "now": datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat(),
         "features": feat
     }
-    
+    if dataframes and (fields is None or "confluence" in fields):
+        with timed("confluence", symbol, "all", timings):
+            snapshot["confluence"] = confluence_block(dataframes, feat)
+    if category and include_market:
+        with timed("market", symbol, "all", timings):
+            snapshot["market"] = market_block(symbol, category, market_history)
+    snapshot["position"] = build_position_block(symbol, include_position, timings)
+    return snapshot
+
+_positions_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}  # last successful lookup per symbol
+
+def positions_for_snapshot(symbol: str) -> Dict[str, Any]:
+    """Position lookup for the snapshot. While it is slow, failing or blocked by the private
+    breaker, the last successful lookup (up to STALE_MAX_AGE_S old) is returned with `stale_age_s`."""
+    cached = _positions_cache.get(symbol)
+    usable = cached if cached and time.time() - cached[0] <= STALE_MAX_AGE_S else None
+    stale = (lambda: dict(usable[1], stale_age_s=round(time.time() - usable[0], 3))) if usable else None
+    if stale is not None and not BYBIT_BREAKERS["private"].available():
+        data, fresh = stale(), False
+    else:
+        data, fresh = UPSTREAM_REFRESH.get(("positions", symbol), lambda: refresh_positions(symbol), stale,
+                                           deadline_remaining("compute"))
+    if fresh and data.get("success"):
+        _positions_cache[symbol] = (time.time(), data)
+    elif fresh and stale is not None:
+        data, fresh = stale(), False  # the lookup came back as an error dict
+    if not fresh:
+        STALE_SERVED.inc(kind="positions")
+    return data
+
+def refresh_positions(symbol: str) -> Dict[str, Any]:
+    """Position lookup for the snapshot; with the shared cache a successful one is reused by every
+    worker process for SHARED_POSITIONS_TTL_S"""
+    lookup = lambda: get_positions_live(symbol, "linear", get_bybit_positions_with_fallback)
+    if SHARED is None or SHARED_POSITIONS_TTL_S <= 0:
+        return lookup()
+
+    def build() -> Tuple[Optional[str], Dict[str, Any]]:
+        data = lookup()
+        return ("" if data.get("success") else None), data
+
+    data, _ = shared_lookup("positions", f"positions:{symbol}",
+                            lambda e: time.time() - e.stored_at < SHARED_POSITIONS_TTL_S, build)
+    return data
+
+def build_position_block(symbol: str, include_position: bool = True, timings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Snapshot `position` block; needs API credentials"""
     # Add position data if requested and API credentials are available
     if include_position and BYBIT_API_KEY and BYBIT_SECRET_KEY:
         try:
-            position_data = get_bybit_positions_with_fallback(symbol, "linear")
+            with timed("position", symbol, "all", timings):
+                position_data = positions_for_snapshot(symbol)
             if position_data.get("success"):
-                snapshot["position"] = {
+                block = {
                     "has_position": position_data["total_open_positions"] > 0,
                     "total_positions": position_data["total_open_positions"],
                     "positions": position_data["positions"],
                     "category": position_data["category"]
                 }
-            else:
-                snapshot["position"] = {
-                    "has_position": False,
-                    "error": position_data.get("error", "Unknown error"),
-                    "message": position_data.get("message", "Failed to fetch position data")
-                }
+                if "stale_age_s" in position_data:
+                    block["stale_age_s"] = position_data["stale_age_s"]
+                return block
+            return {
+                "has_position": False,
+                "error": position_data.get("error", "Unknown error"),
+                "message": position_data.get("message", "Failed to fetch position data")
+            }
+        except resilience.DeadlineExceeded:
+            raise
         except Exception as e:
-            snapshot["position"] = {
+            return {
                 "has_position": False,
                 "error": "Exception occurred",
                 "message": str(e)
             }
-    else:
-        snapshot["position"] = {
-            "has_position": False,
-            "message": "Position checking not enabled or API credentials not configured"
-        }
-    
-    return snapshot
+    return {
+        "has_position": False,
+        "message": "Position checking not enabled or API credentials not configured"
+    }
 
 def upsert_tables(symbol: str, tf: str, df_raw: pd.DataFrame, df_ind: pd.DataFrame):
-    if not SUPABASE:
+    supabase = get_supabase()
+    if not supabase:
         return
     # Create tables if you want (not part of service to run DDL)
     # Upserts (chunked)
@@ -908,11 +1844,12 @@ def upsert_tables(symbol: str, tf: str, df_raw: pd.DataFrame, df_ind: pd.DataFra
             "volume": float(r["volume"])
         })
     for i in range(0, len(rows_raw), 200):
-        SUPABASE.table("ohlcv").upsert(rows_raw[i:i+200], on_conflict="symbol,tf,ts").execute()
+        supabase.table("ohlcv").upsert(rows_raw[i:i+200], on_conflict="symbol,tf,ts").execute()
 
     cols = ["ema_20","ema_50","ema_200","rsi_14","macd","macd_signal","macd_hist",
             "atr_14","bb_mid","bb_up","bb_dn","bb_bw","adx_14","di_plus","di_minus",
             "obv","vwap","structure_hh","structure_hl","structure_lh","structure_ll"]
+    cols = [c for c in cols if c in df_ind.columns]  # only columns computed for this request
     rows_ta = []
     for _, r in df_ind.iterrows():
         rec = {"symbol": symbol, "tf": tf, "ts": r["ts"]}
@@ -925,22 +1862,986 @@ def upsert_tables(symbol: str, tf: str, df_raw: pd.DataFrame, df_ind: pd.DataFra
             rec[c] = val
         rows_ta.append(rec)
     for i in range(0, len(rows_ta), 200):
-        SUPABASE.table("ta_features").upsert(rows_ta[i:i+200], on_conflict="symbol,tf,ts").execute()
+        supabase.table("ta_features").upsert(rows_ta[i:i+200], on_conflict="symbol,tf,ts").execute()
+
+def run_snapshot(sym: str, tf_list: List[str], lb: Union[int, Dict[str, int]], cat: str, include_position: bool = True,
+                 timings: bool = False, fields: Optional[List[str]] = None,
+                 include_market: bool = True, market_history: bool = False,
+                 deadline_ms: float = 0) -> Dict[str, Any]:
+    """Fetch candles, compute indicators for every TF and assemble the snapshot; `lb` may be per TF.
+
+    With `deadline_ms`, the snapshot is assembled from `snapshot_events` within that budget."""
+    if deadline_ms:
+        snapshot: Dict[str, Any] = {}
+        for _ in snapshot_events(sym, tf_list, lb, cat, include_position, timings, fields, include_market,
+                                 market_history, snapshot, make_deadline(deadline_ms)):
+            pass
+        missed = snapshot["deadline"]["missed"]
+        if tf_list and all(tf in missed for tf in tf_list):  # nothing fresh: let the caller fall back
+            block = snapshot["features"][tf_list[0]]
+            raise RuntimeError(f"no timeframe finished: {block.get('stale_error') or block.get('error')}")
+        return snapshot
+    feature_map: Dict[str, Any] = {}
+    dataframes: Dict[str, pd.DataFrame] = {}
+    stage_ms: Optional[Dict[str, Any]] = {} if timings else None
+    t_start = time.perf_counter()
+
+    prefetch_upstream(sym, {tf: lb[tf] if isinstance(lb, dict) else lb for tf in tf_list}, cat,
+                      include_market, include_position)
+    for tf in tf_list:
+        df_ind = fetch_tf_frame(sym, tf, lb[tf] if isinstance(lb, dict) else lb, cat, fields, stage_ms)
+        # Store dataframe for advanced analysis
+        dataframes[tf] = df_ind
+        # last closed row for snapshot
+        feature_map[tf] = last_closed_row(df_ind)
+
+    snapshot = build_snapshot(sym, feature_map, dataframes, include_position, stage_ms, fields,
+                              cat, include_market, market_history)
+    for tf in tf_list:
+        remember_last_good(tf_block_key(sym, tf, lb, cat, fields), snapshot["features"][tf])
+    finish_snapshot(snapshot, sym, lb, t_start, stage_ms, dataframes)
+    return snapshot
+
+def fetch_tf_frame(sym: str, tf: str, limit: int, cat: str, fields: Optional[List[str]] = None,
+                   stage_ms: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """Fetch one TF, compute its indicators and upsert it (best effort)"""
+    with timed("fetch", sym, tf, stage_ms):
+        df = get_candles(sym, tf, limit, cat)
+        if fields is None or "volume_profile" in fields:
+            load_tick_size(sym, cat)
+    # compute indicators
+    with timed("indicators", sym, tf, stage_ms):
+        df_ind = indicator_frame(sym, tf, cat, df, indicator_columns(fields))
+    if "stale_age_s" in df.attrs:
+        df_ind.attrs["stale_age_s"] = df.attrs["stale_age_s"]
+
+    # optional upsert to Supabase
+    try:
+        with timed("upsert", sym, tf, stage_ms):
+            upsert_tables(sym, tf, df, df_ind)
+    except resilience.DeadlineExceeded:
+        raise
+    except Exception as e:
+        print("[supabase] upsert failed:", e)
+    return df_ind
+
+def indicator_frame(sym: str, tf: str, cat: str, df: pd.DataFrame, columns: Optional[List[str]]) -> pd.DataFrame:
+    """`df` indexed by open time with `columns` computed; with the shared cache, computed by one
+    worker process per last bar (open time, close, volume) and loaded by the others"""
+    def compute() -> pd.DataFrame:
+        df_ind = df.copy()
+        df_ind.attrs.clear()  # the stale marker belongs to this request, not the cached frame
+        df_ind.index = pd.to_datetime(df_ind["ts"])
+        return compute_indicators(df_ind, columns)
+
+    if SHARED is None or not len(df):
+        return compute()
+    last = df.iloc[-1]
+    version = f"{last['ts']}:{float(last['close'])!r}:{float(last['volume'])!r}"
+    key = f"indicators:{sym}:{tf}:{cat}:{len(df)}:{'*' if columns is None else ','.join(columns)}"
+    df_ind, _ = shared_lookup("indicators", key, lambda e: e.version == version, lambda: (version, compute()))
+    return df_ind
+
+def finish_snapshot(snapshot: Dict[str, Any], sym: str, lb: Union[int, Dict[str, int]], t_start: float,
+                    stage_ms: Optional[Dict[str, Any]], dataframes: Optional[Dict[str, pd.DataFrame]] = None):
+    """Add the stale marker, the lookback plan and timings, and record the total latency"""
+    stale = [df.attrs["stale_age_s"] for df in (dataframes or {}).values() if "stale_age_s" in df.attrs]
+    if stale:
+        snapshot["stale_age_s"] = max(stale)  # oldest candles any TF was served from
+    if isinstance(lb, dict):
+        snapshot["lookback"] = dict(lb)
+    total_s = time.perf_counter() - t_start
+    STAGE_LATENCY.observe(total_s, symbol=sym, tf="all", stage="total")
+    if stage_ms is not None:
+        stage_ms.setdefault("all", {})["total"] = round(total_s * 1000, 3)
+        snapshot["timings"] = stage_ms
+
+def make_deadline(deadline_ms: float) -> Optional[resilience.Deadline]:
+    return resilience.Deadline(deadline_ms / 1000, RUN_DEADLINE_SPLIT) if deadline_ms else None
+
+def tf_block_key(sym: str, tf: str, lb: Union[int, Dict[str, int]], cat: str, fields: Optional[List[str]]) -> Tuple:
+    return ("tf", sym, tf, cat, tuple(fields or ()), lb[tf] if isinstance(lb, dict) else lb)
+
+def snapshot_events(sym: str, tf_list: List[str], lb: Union[int, Dict[str, int]], cat: str, include_position: bool = True,
+                    timings: bool = False, fields: Optional[List[str]] = None,
+                    include_market: bool = True, market_history: bool = False,
+                    snapshot: Optional[Dict[str, Any]] = None, deadline: Optional[resilience.Deadline] = None):
+    """Yield the snapshot events: `meta`, one `tf` per timeframe in completion order, `confluence`
+    (once every TF is in), `market` (when included), `position`, then `done`; `snapshot` is filled
+    with the merged document, the same as `run_snapshot`'s. TFs, market and position calls run
+    concurrently.
+
+    With a `deadline`, TFs that fail or are not done when the compute budget runs out get their
+    last good block (marked with `stale_age_s` and `stale_error`) or `{"error": "timeout"}` (or the
+    error), instead of an `error` event, and market and position get a timeout
+    placeholder at the end of the budget; they are listed in `deadline.missed`. The request is then
+    cancelled: queued work never starts and running work stops at its next stage."""
+    stage_ms: Optional[Dict[str, Any]] = {} if timings else None
+    if stage_ms is not None and deadline is not None:
+        stage_ms.update({key: {} for key in tf_list + ["all"]})  # late workers only write inside these
+    t_start = time.perf_counter()
+    snapshot = {} if snapshot is None else snapshot
+    snapshot.update({
+        "symbol": sym,
+        "now": datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat(),
+        "features": {}
+    })
+    yield {"type": "meta", "symbol": sym, "now": snapshot["now"], "tfs": tf_list}
+
+    frames: Dict[str, pd.DataFrame] = {}
+    settled = set()  # TFs that have had their event
+    missed: List[str] = []
+    fallback_ages: List[float] = []
+
+    @profiler.propagate
+    def scoped(fn, *args):
+        with deadline_scope(deadline):
+            return fn(*args)
+
+    def tf_features(tf: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        df_ind = fetch_tf_frame(sym, tf, lb[tf] if isinstance(lb, dict) else lb, cat, fields, stage_ms)
+        return df_ind, build_tf_features(sym, tf, last_closed_row(df_ind), df_ind, fields, stage_ms, cat)
+
+    def market() -> Dict[str, Any]:
+        with timed("market", sym, "all", stage_ms):
+            return market_block(sym, cat, market_history)
+
+    def fall_back(tf: str, error: str = "timeout") -> Dict[str, Any]:
+        missed.append(tf)
+        block = last_good(tf_block_key(sym, tf, lb, cat, fields), "tf")
+        if block is not None:
+            fallback_ages.append(block["stale_age_s"])
+            block["stale_error"] = error
+        snapshot["features"][tf] = {"error": error} if block is None else block
+        return {"type": "tf", "tf": tf, "features": snapshot["features"][tf]}
+
+    def settle(future, name: str, placeholder: Dict[str, Any]) -> Dict[str, Any]:
+        if deadline is None:
+            return future.result()
+        try:
+            return future.result(timeout=deadline.remaining())
+        except (FutureTimeout, resilience.DeadlineExceeded):
+            missed.append(name)
+            return placeholder
+
+    pool = ThreadPoolExecutor(max_workers=len(tf_list) + 2, thread_name_prefix="snapshot")
+    try:
+        market_future = pool.submit(scoped, market) if include_market else None
+        position = pool.submit(scoped, build_position_block, sym, include_position, stage_ms)
+        pending = {pool.submit(scoped, tf_features, tf): tf for tf in tf_list}
+        try:
+            for future in as_completed(pending, None if deadline is None else deadline.remaining("compute")):
+                tf = pending[future]
+                settled.add(tf)
+                try:
+                    frames[tf], snapshot["features"][tf] = future.result()
+                except resilience.DeadlineExceeded:
+                    yield fall_back(tf)
+                    continue
+                except Exception as e:
+                    yield {"type": "error", "tf": tf, "error": str(e)} if deadline is None else fall_back(tf, str(e))
+                    continue
+                remember_last_good(tf_block_key(sym, tf, lb, cat, fields), snapshot["features"][tf])
+                event = {"type": "tf", "tf": tf, "features": snapshot["features"][tf]}
+                if "stale_age_s" in frames[tf].attrs:
+                    event["stale_age_s"] = frames[tf].attrs["stale_age_s"]
+                yield event
+        except FutureTimeout:
+            for future, tf in pending.items():
+                if tf not in settled:
+                    future.cancel()
+                    yield fall_back(tf)
+        if frames and (fields is None or "confluence" in fields):
+            done_tfs = [tf for tf in tf_list if tf in frames]
+            with timed("confluence", sym, "all", stage_ms):
+                snapshot["confluence"] = confluence_block({tf: frames[tf] for tf in done_tfs}, snapshot["features"])
+            yield {"type": "confluence", "confluence": snapshot["confluence"]}
+        if market_future is not None:
+            snapshot["market"] = settle(market_future, "market", {"error": "timeout"})
+        snapshot["position"] = settle(position, "position", {
+            "has_position": False, "error": "timeout", "message": "Position lookup did not finish before the deadline"})
+    finally:
+        if deadline is None:
+            pool.shutdown(wait=True)
+        else:
+            deadline.cancel()
+            pool.shutdown(wait=False, cancel_futures=True)
+    if "market" in snapshot:
+        yield {"type": "market", "market": snapshot["market"]}
+    yield {"type": "position", "position": snapshot["position"]}
+
+    snapshot["features"] = {tf: snapshot["features"][tf] for tf in tf_list if tf in snapshot["features"]}
+    if deadline is not None:
+        snapshot["deadline"] = {"budget_ms": round(deadline.total_s * 1000, 3), "missed": missed}
+        if stage_ms is not None:
+            stage_ms = {key: dict(stages) for key, stages in stage_ms.items() if stages}
+    finish_snapshot(snapshot, sym, lb, t_start, stage_ms, frames)
+    if fallback_ages:
+        snapshot["stale_age_s"] = max(fallback_ages + [snapshot.get("stale_age_s", 0)])
+    done = {"type": "done"}
+    for key in ("stale_age_s", "lookback", "deadline", "timings"):
+        if key in snapshot:
+            done[key] = snapshot[key]
+    yield done
+
+def stream_snapshot(sym: str, tf_list: List[str], lb: Union[int, Dict[str, int]], cat: str, include_position: bool = True,
+                    timings: bool = False, fields: Optional[List[str]] = None,
+                    include_market: bool = True, market_history: bool = False, deadline_ms: float = 0):
+    """`snapshot_events` as NDJSON; merging the events gives the same document as `run_snapshot`"""
+    snapshot: Dict[str, Any] = {}
+    for event in snapshot_events(sym, tf_list, lb, cat, include_position, timings, fields, include_market,
+                                 market_history, snapshot, make_deadline(deadline_ms)):
+        yield json.dumps(event) + "\n"
+    write_snapshot_json(snapshot)
+
+_last_good: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_last_good_lock = threading.Lock()
+
+def remember_last_good(key: Tuple, value: Dict[str, Any]):
+    """Keep the last good snapshot or TF block per key (LRU, STALE_SNAPSHOTS entries)"""
+    if STALE_SNAPSHOTS <= 0:
+        return
+    with _last_good_lock:
+        _last_good[key] = (time.time(), value)
+        _last_good.move_to_end(key)
+        while len(_last_good) > STALE_SNAPSHOTS:
+            _last_good.popitem(last=False)
+    if SHARED is not None:
+        try:
+            SHARED.put("last_good:" + json.dumps(key), "", value)
+        except Exception as e:
+            print("[shared] storing the last good copy failed:", e)
+
+def last_good(key: Tuple, kind: str = "snapshot") -> Optional[Dict[str, Any]]:
+    """The remembered value for `key` with `stale_age_s` added, or None when there is none recent enough"""
+    with _last_good_lock:
+        entry = _last_good.get(key)
+    if SHARED is not None:  # another worker process may have a newer one
+        shared = SHARED.get("last_good:" + json.dumps(key))
+        if shared is not None and (entry is None or shared.stored_at > entry[0]):
+            entry = (shared.stored_at, shared.value)
+    if entry is None or time.time() - entry[0] > STALE_MAX_AGE_S:
+        return None
+    saved_at, value = entry
+    STALE_SERVED.inc(kind=kind)
+    return dict(value, stale_age_s=round(time.time() - saved_at + (value.get("stale_age_s") or 0), 3))
+
+def remember_snapshot(key: Tuple, snapshot: Dict[str, Any]):
+    remember_last_good(key, {k: v for k, v in snapshot.items() if k not in ("timings", "profile")})
+
+def last_good_snapshot(key: Tuple, error: Exception) -> Optional[Dict[str, Any]]:
+    """The remembered snapshot for `key` marked with its age and the error, or None"""
+    snapshot = last_good(key)
+    return None if snapshot is None else dict(snapshot, stale_error=str(error))
+
+def write_snapshot_json(snapshot: Dict[str, Any]):
+    """Keep the last snapshot on disk when WRITE_SNAPSHOT_JSON is set"""
+    if WRITE_SNAPSHOT_JSON:
+        try:
+            with open("snapshot.json", "w") as f:
+                json.dump(snapshot, f, indent=2)
+        except Exception:
+            pass
+
+# ---------- Historical replay ----------
+
+HISTORY_WARMUP_TOLERANCE = 1e-3  # indicator accuracy at the first replayed bar
+HISTORY_CHUNK_ROWS = 500
+
+def parse_time_ms(value: str) -> int:
+    """Epoch milliseconds from an epoch-ms string or an ISO date/datetime (UTC when naive)"""
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def pivot_mask(values: np.ndarray, highs: bool, width: int = 2) -> np.ndarray:
+    """True at bars strictly above (highs) / below (lows) `width` neighbours on each side"""
+    n = len(values)
+    mask = np.zeros(n, dtype=bool)
+    if n < 2 * width + 1:
+        return mask
+    center = values[width:n - width]
+    inner = np.ones(len(center), dtype=bool)
+    for k in range(1, width + 1):
+        for other in (values[width - k:n - width - k], values[width + k:n - width + k]):
+            inner &= center > other if highs else center < other
+    mask[width:n - width] = inner
+    return mask
+
+def rolling_levels(values: np.ndarray, pivots: np.ndarray, window: int, sensitivity: float = 0.02,
+                   top: int = 5, descending: bool = False, width: int = 2) -> List[List[float]]:
+    """Per bar, the S/R levels `find_support_resistance_levels` would report on the last `window` bars.
+
+    A pivot at bar p is confirmed at bar p + width. Levels are deduplicated greedily in bar order,
+    so a new pivot only has to be checked against the accepted levels; the accepted set is rebuilt
+    only when a pivot leaves the window.
+    """
+    out: List[List[float]] = []
+    live: deque = deque()  # (bar, price) of pivots inside the window, oldest first
+    accepted: List[float] = []
+    current: List[float] = []
+
+    def significant(price: float, levels: List[float]) -> bool:
+        return all(abs(price - level) / level >= sensitivity for level in levels)
+
+    for t in range(len(values)):
+        changed = False
+        oldest = t - window + 1 + width  # a pivot needs `width` bars on each side inside the window
+        if live and live[0][0] < oldest:
+            while live and live[0][0] < oldest:
+                live.popleft()
+            accepted = []
+            for _, price in live:
+                if significant(price, accepted):
+                    accepted.append(price)
+            changed = True
+        p = t - width
+        if p >= oldest and pivots[p]:
+            price = float(values[p])
+            live.append((p, price))
+            if significant(price, accepted):
+                accepted.append(price)
+                changed = True
+        if changed:
+            current = sorted(accepted, reverse=descending)[:top]
+        out.append(current)
+    return out
+
+def recent_order_blocks(df: pd.DataFrame, window: int, lookback: int = 20, keep: int = 3) -> Dict[str, List[List[Dict[str, Any]]]]:
+    """Per bar, the last `keep` confirmed order blocks of each side within the last `window` bars.
+
+    Same detection rule as `find_order_blocks`, vectorized; a block is known once its breakout
+    candle has closed.
+    """
+    o, h, l, c, v = (df[k].to_numpy(dtype=float) for k in ("open", "high", "low", "close", "volume"))
+    vol_ma = df["volume"].rolling(10).mean().to_numpy()
+    ts = df["ts"].to_numpy()
+    n = len(df)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        nc, no = np.append(c[1:], np.nan), np.append(o[1:], np.nan)
+        heavy = v > vol_ma
+        bull = (nc > no) & (nc > h) & heavy
+        bear = ~bull & (nc < no) & (nc < l) & heavy
+        ratio = v / vol_ma
+    strength = {"bullish": (nc - h) / h, "bearish": (l - nc) / l}
+    out: Dict[str, List[List[Dict[str, Any]]]] = {}
+    for side, mask in (("bullish", bull), ("bearish", bear)):
+        idx = np.flatnonzero(mask)
+        blocks = [{"ts": ts[i], "high": float(h[i]), "low": float(l[i]),
+                   "strength": float(strength[side][i]), "volume_ratio": float(ratio[i])} for i in idx]
+        confirmed = np.searchsorted(idx, np.arange(n) - 1, side="right")  # blocks with i + 1 <= t
+        first = np.searchsorted(idx, np.arange(n) - window + 1 + lookback, side="left")
+        series, cache = [], {}
+        for t in range(n):
+            key = (max(first[t], confirmed[t] - keep), confirmed[t])
+            if key not in cache:
+                cache.clear()
+                cache[key] = blocks[key[0]:key[1]]
+            series.append(cache[key])
+        out[side] = series
+    return out
+
+def build_history(df: pd.DataFrame, fields: Optional[List[str]], window: int, first_ts: Optional[str] = None):
+    """Yield the snapshot feature block as of every closed bar in `df` from `first_ts` on.
+
+    Indicators are computed once over the whole frame; structure analyses see the last `window`
+    bars (what a snapshot fetched with `lookback=window` would scan). Elliott waves and the volume
+    profile are not replayed.
+    """
+    def want(field: str) -> bool:
+        return fields is None or field in fields
+
+    df = df.reset_index(drop=True)
+    df_ind = compute_indicators(df, indicator_columns(fields))
+    high = df["high"].to_numpy(dtype=float)
+    low = df["low"].to_numpy(dtype=float)
+    prev_high, prev_low = np.roll(high, 1), np.roll(low, 1)
+
+    if want("support_resistance"):
+        support = rolling_levels(low, pivot_mask(low, highs=False), window, descending=True)
+        resistance = rolling_levels(high, pivot_mask(high, highs=True), window)
+    if want("order_blocks"):
+        blocks = recent_order_blocks(df, window)
+    if want("fibonacci"):
+        span = min(50, window)
+        fib_high = df["high"].rolling(span, min_periods=1).max().to_numpy()
+        fib_low = df["low"].rolling(span, min_periods=1).min().to_numpy()
+
+    start = 0 if first_ts is None else int(df["ts"].searchsorted(first_ts, side="left"))
+    records = df_ind.to_dict("records")
+    for t in range(max(start, 1), len(df)):
+        s = records[t]
+        s["structure_hh"], s["structure_lh"] = (1, 0) if high[t] > prev_high[t] else (0, 1)
+        s["structure_hl"], s["structure_ll"] = (1, 0) if low[t] > prev_low[t] else (0, 1)
+        row = {"ts": s["ts"], **build_tf_features("", "", s, None, fields)}
+        if want("order_blocks"):
+            row["order_blocks"] = {"bullish": blocks["bullish"][t], "bearish": blocks["bearish"][t]}
+        if want("support_resistance"):
+            row["support_resistance"] = {"support": support[t], "resistance": resistance[t]}
+        if want("fibonacci"):
+            row["fibonacci"] = {
+                "retracements": {k: float(v) for k, v in fibonacci_retracements(fib_high[t], fib_low[t]).items()},
+                "recent_high": float(fib_high[t]),
+                "recent_low": float(fib_low[t])
+            }
+        yield row
+
+def flatten_history_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """One CSV record per bar: nested blocks become prefixed columns, lists become numbered columns"""
+    flat: Dict[str, Any] = {}
+    for key, value in row.items():
+        if key == "order_blocks":
+            for side in ("bullish", "bearish"):
+                last = value[side][-1] if value[side] else {}
+                for k in ("ts", "high", "low", "strength", "volume_ratio"):
+                    flat[f"ob_{side}_{k}"] = last.get(k)
+        elif key == "support_resistance":
+            for side, levels in value.items():
+                for i in range(5):
+                    flat[f"{side}_{i + 1}"] = levels[i] if i < len(levels) else None
+        elif key == "fibonacci":
+            flat["fib_high"], flat["fib_low"] = value["recent_high"], value["recent_low"]
+            for level, price in value["retracements"].items():
+                flat[f"fib_{level}"] = price
+        elif isinstance(value, dict):
+            for k, v in value.items():
+                flat[f"{key}_{k}"] = v
+        else:
+            flat[key] = value
+    return flat
+
+def history_frame(flat_rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Flattened history rows as a typed frame (same dtypes for every chunk of one replay)"""
+    df = pd.DataFrame.from_records(flat_rows)
+    for col in df.columns:
+        if col == "ts" or col.endswith("_ts"):
+            df[col] = df[col].astype("string")
+        else:
+            df[col] = pd.to_numeric(df[col])
+    return df
+
+def fetch_history(symbol: str, tf: str, start_ms: int, end_ms: int, category: str, warmup_bars: int) -> pd.DataFrame:
+    """Closed candles from `warmup_bars` before `start_ms` up to `end_ms`"""
+    step = tf_to_ms(tf)
+    now_ms = int(time.time() * 1000)
+    end_ms = min(end_ms, now_ms)
+    first_ms = start_ms - warmup_bars * step
+    df = fetch_ohlcv_bybit(symbol, tf, max((end_ms - first_ms) // step + 1, 1), category, start_ms=first_ms, end_ms=end_ms)
+    if len(df) == 0:
+        return df
+    opened_ms = pd.to_datetime(df["ts"]).astype("int64") // 1_000_000
+    return df[(opened_ms + step <= now_ms).to_numpy()].reset_index(drop=True)  # closed bars only
+
+# ---------- Bulk export ----------
+
+EXPORT_TOLERANCE = 1e-9  # EMA seed weight left after the carried warmup bars
+CUMULATIVE_COLUMNS = ("obv", "vwap")
+
+def export_columns(fields: Optional[List[str]]) -> List[str]:
+    """Indicator columns exported for `fields` (per-bar structure flags are snapshot-only)"""
+    columns = indicator_columns(fields)
+    if columns is None:
+        columns = [c for ind in INDICATORS.values() for c in ind.outputs]
+    return [c for c in columns if not c.startswith("structure_")]
+
+def iter_export_frames(symbol: str, tf: str, start_ms: int, end_ms: int, category: str,
+                       fields: Optional[List[str]] = None, chunk_bars: int = EXPORT_CHUNK_BARS):
+    """Yield OHLCV + indicator frames for closed bars in [start_ms, end_ms], one chunk at a time.
+
+    Each chunk is computed together with the last warmup bars of the previous one, so rolling
+    windows are exact and EMAs agree with a single pass to EXPORT_TOLERANCE. OBV and VWAP are
+    cumulative from `start_ms` and continued across chunks from carried totals. Memory stays at
+    one chunk whatever the range.
+    """
+    step = tf_to_ms(tf)
+    columns = export_columns(fields)
+    warm = max(indicator_warmup(fields, EXPORT_TOLERANCE), 1)
+    first_iso = ts_ms_to_iso(start_ms)
+    carry: Optional[pd.DataFrame] = None
+    obv_last: Optional[float] = None
+    cum_pv = cum_v = 0.0
+    chunk_start = start_ms - warm * step  # the first chunk also fetches the warmup before `start`
+    now_ms = int(time.time() * 1000)
+    while chunk_start <= end_ms:
+        chunk_end = min(end_ms, chunk_start + chunk_bars * step - 1)
+        with timed("fetch", symbol, tf):
+            raw = fetch_ohlcv_bybit(symbol, tf, (chunk_end - chunk_start) // step + 1, category,
+                                    start_ms=chunk_start, end_ms=chunk_end)
+        chunk_start = chunk_end + 1
+        if len(raw):
+            opened_ms = pd.to_datetime(raw["ts"]).astype("int64") // 1_000_000
+            raw = raw[(opened_ms + step <= now_ms).to_numpy()]  # closed bars only
+        if len(raw) == 0:
+            continue
+        frame = raw if carry is None else pd.concat([carry, raw], ignore_index=True)
+        with timed("indicators", symbol, tf):
+            ind = compute_indicators(frame, columns)
+        keep = (ind["ts"] >= first_iso).to_numpy()
+        if carry is not None:
+            keep[:len(carry)] = False
+        carry = frame.tail(warm).reset_index(drop=True)
+        out = ind[keep].reset_index(drop=True)
+        if len(out) == 0:
+            continue
+
+        close, volume = frame["close"].to_numpy(), frame["volume"].to_numpy()
+        if "obv" in out:
+            signed = (np.sign(np.diff(close, prepend=np.nan)) * volume)[keep]
+            if obv_last is None:
+                signed[0] = volume[keep][0]  # same seed as obv()
+            out["obv"] = (obv_last or 0.0) + np.cumsum(signed)
+            obv_last = float(out["obv"].iloc[-1])
+        if "vwap" in out:
+            pv = np.cumsum(((out["high"] + out["low"] + out["close"]) / 3 * out["volume"]).to_numpy()) + cum_pv
+            vv = np.cumsum(out["volume"].to_numpy()) + cum_v
+            out["vwap"] = pv / vv
+            cum_pv, cum_v = float(pv[-1]), float(vv[-1])
+        yield out
+
+# ---------- Market scanner ----------
+
+_universe_cache: Dict[Tuple[str, str], Tuple[float, List[str]]] = {}
+
+def fetch_universe(category: str = "linear", quote: str = "USDT") -> List[str]:
+    """Trading symbols of a category quoted in `quote` (perpetuals only for linear/inverse), cached for SCAN_UNIVERSE_TTL"""
+    key = (category, quote)
+    cached = _universe_cache.get(key)
+    if cached and time.time() - cached[0] < SCAN_UNIVERSE_TTL:
+        return cached[1]
+    symbols: List[str] = []
+    cursor = ""
+    while True:
+        params = {"category": category, "limit": "1000"}
+        if cursor:
+            params["cursor"] = cursor
+        r, data = bybit_request("GET", "/v5/market/instruments-info", params=params, timeout=20)
+        r.raise_for_status()
+        if data.get("retCode") != 0:
+            raise RuntimeError(f"Bybit API error: {data}")
+        for item in data["result"]["list"]:
+            if item.get("status") != "Trading" or item.get("quoteCoin") != quote:
+                continue
+            if category != "spot" and not str(item.get("contractType", "")).endswith("Perpetual"):
+                continue
+            symbols.append(item["symbol"])
+        cursor = data["result"].get("nextPageCursor") or ""
+        if not cursor:
+            break
+    _universe_cache[key] = (time.time(), symbols)
+    return symbols
+
+def fetch_ohlcv_many(symbols: List[str], tf: str, limit: int, category: str, workers: int = SCAN_WORKERS,
+                     fetch=fetch_ohlcv_bybit) -> Tuple[Dict[str, pd.DataFrame], Dict[str, str]]:
+    """Fetch candles for many symbols in parallel (paced by the shared rate limiter); returns (frames, errors)"""
+    frames: Dict[str, pd.DataFrame] = {}
+    errors: Dict[str, str] = {}
+
+    def fetch_one(sym: str):
+        try:
+            return sym, fetch(sym, tf, limit, category), None
+        except Exception as e:
+            return sym, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for sym, df, err in pool.map(fetch_one, symbols):
+            if err is not None:
+                errors[sym] = err
+            elif len(df):
+                frames[sym] = df
+            else:
+                errors[sym] = "no candles"
+    return frames, errors
+
+def stack_ohlcv(frames: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """Align per-symbol candles on a common ts index: field -> (bars x symbols) frame"""
+    indexed = {sym: df.set_index("ts") for sym, df in frames.items()}
+    return {field: pd.DataFrame({sym: df[field] for sym, df in indexed.items()}).sort_index()
+            for field in ("open", "high", "low", "close", "volume")}
+
+def compute_panel(panel: Dict[str, pd.DataFrame], columns: List[str]) -> Dict[str, pd.DataFrame]:
+    """Run registered indicators over every symbol at once; each output is a (bars x symbols) frame"""
+    ctx = FrameContext(panel)
+    out: Dict[str, pd.DataFrame] = {}
+    for ind in plan_indicators(columns):
+        out.update(ind.run(ctx))
+    return {col: out[col] for col in columns if col in out}
+
+SCAN_COLUMNS = ["ema_20", "ema_50", "ema_200", "rsi_14", "atr_14", "bb_bw", "adx_14", "di_plus", "di_minus"]
+SCAN_SORT_KEYS = ("rsi14", "adx14", "bb_bw", "atr_pct", "change_pct")
+
+def ema_alignment(price: float, e20: float, e50: float, e200: float) -> str:
+    if price > e20 > e50 > e200:
+        return "bullish"
+    if price < e20 < e50 < e200:
+        return "bearish"
+    return "mixed"
+
+def scan_market(symbols: List[str], tf: str, lookback: int, category: str) -> Tuple[List[Dict[str, Any]], Dict[str, str], Optional[str]]:
+    """Indicator summary of the last closed bar for every symbol; returns (rows, errors, bar ts)"""
+    frames, errors = fetch_ohlcv_many(symbols, tf, lookback, category)
+    if not frames:
+        return [], errors, None
+    with timed("indicators", "scan", tf):
+        panel = stack_ohlcv(frames)
+        ind = compute_panel(panel, SCAN_COLUMNS)
+    # Last closed bar of the aligned index; symbols without it (halted, delisted) drop out
+    t = -2 if len(panel["close"]) >= 2 else -1
+    last = {col: frame.iloc[t] for col, frame in ind.items()}
+    close = panel["close"].iloc[t]
+    prev_close = panel["close"].iloc[t - 1] if len(panel["close"]) > 1 else close
+    rows = []
+    for sym in panel["close"].columns:
+        price = to_float(close[sym])
+        if price is None:
+            errors[sym] = "no closed bar at the latest timestamp"
+            continue
+        e20, e50, e200 = (to_float(last[c][sym]) for c in ("ema_20", "ema_50", "ema_200"))
+        atr_val = to_float(last["atr_14"][sym])
+        prev = to_float(prev_close[sym])
+        rows.append({
+            "symbol": sym,
+            "price": price,
+            "rsi14": to_float(last["rsi_14"][sym]),
+            "adx14": to_float(last["adx_14"][sym]),
+            "di_plus": to_float(last["di_plus"][sym]),
+            "di_minus": to_float(last["di_minus"][sym]),
+            "bb_bw": to_float(last["bb_bw"][sym]),
+            "atr_pct": atr_val / price * 100 if atr_val is not None and price else None,
+            "ema20": e20, "ema50": e50, "ema200": e200,
+            "ema_alignment": ema_alignment(price, e20, e50, e200) if None not in (e20, e50, e200) else None,
+            "change_pct": (price / prev - 1) * 100 if prev else None,
+        })
+    return rows, errors, panel["close"].index[t]
+
+def filter_scan(rows: List[Dict[str, Any]], rsi_min: Optional[float] = None, rsi_max: Optional[float] = None,
+                adx_min: Optional[float] = None, bbw_max: Optional[float] = None,
+                alignment: Optional[str] = None) -> List[Dict[str, Any]]:
+    def within(value, lo=None, hi=None):
+        if lo is None and hi is None:
+            return True
+        return value is not None and (lo is None or value >= lo) and (hi is None or value <= hi)
+    return [r for r in rows
+            if within(r["rsi14"], rsi_min, rsi_max) and within(r["adx14"], adx_min) and within(r["bb_bw"], None, bbw_max)
+            and (alignment is None or r["ema_alignment"] == alignment)]
+
+# ---------- Candle cache and cross-symbol statistics ----------
+
+CANDLES = candle_store.CandleStore(int(CANDLE_STORE_MB * 1024 * 1024), CANDLE_CACHE_MAX_BARS,
+                                   "float32" if CANDLE_STORE_FLOAT32 else "float64")
+
+_candles_refreshed: Dict[Tuple[str, str, str], float] = {}  # last successful refresh per series
+
+def get_candles(symbol: str, tf: str, limit: int = 300, category: str = "linear") -> pd.DataFrame:
+    """Latest `limit` candles like `fetch_ohlcv_bybit`, served from the candle store, which
+    only fetches the bars that opened since the last call.
+
+    When the store already holds `limit` bars refreshed within STALE_MAX_AGE_S, a refresh that is
+    slower than STALE_WAIT_S, fails, or is blocked by the kline breaker returns those instead, with
+    their age in `attrs["stale_age_s"]`; the refresh carries on in the background."""
+    if limit > CANDLES.capacity:
+        return fetch_ohlcv_bybit(symbol, tf, limit, category)
+    key = (symbol, tf, category)
+    refreshed = _candles_refreshed.get(key)
+    stale = None
+    if refreshed is not None and time.time() - refreshed <= STALE_MAX_AGE_S and CANDLES.size(key) >= limit:
+        stale = lambda: CANDLES.frame(key, limit)
+    if stale is not None and not BYBIT_BREAKERS["kline"].available():
+        df, fresh = stale(), False
+    else:
+        df, fresh = UPSTREAM_REFRESH.get((key, limit), lambda: refresh_candles(symbol, tf, limit, category), stale,
+                                         deadline_remaining("fetch"))
+    if df is None:  # evicted since the size check
+        return refresh_candles(symbol, tf, limit, category)
+    if not fresh:
+        df.attrs["stale_age_s"] = round(time.time() - refreshed, 3)
+        STALE_SERVED.inc(kind="candles")
+    return df
+
+def prefetch_upstream(symbol: str, limits: Dict[str, int], category: str, include_market: bool, include_position: bool):
+    """Start every upstream refresh a snapshot needs at once, so their stale-while-revalidate
+    waits overlap instead of adding up"""
+    if BYBIT_BREAKERS["kline"].available():
+        for tf, limit in limits.items():
+            if limit <= CANDLES.capacity:
+                UPSTREAM_REFRESH.refresh(((symbol, tf, category), limit),
+                                         lambda tf=tf, limit=limit: refresh_candles(symbol, tf, limit, category))
+    if include_market and BYBIT_BREAKERS["market"].available():
+        UPSTREAM_REFRESH.refresh(("tickers", category), lambda: refresh_tickers(category))
+    if tick_size_due((symbol, category)) and BYBIT_BREAKERS["market"].available():
+        UPSTREAM_REFRESH.refresh(("tick_size", (symbol, category)), lambda: refresh_tick_size(symbol, category))
+    if include_position and BYBIT_API_KEY and BYBIT_SECRET_KEY and BYBIT_BREAKERS["private"].available():
+        UPSTREAM_REFRESH.refresh(("positions", symbol), lambda: refresh_positions(symbol))
+
+def refresh_candles(symbol: str, tf: str, limit: int, category: str) -> pd.DataFrame:
+    """Bring the stored series up to date and return its newest `limit` bars"""
+    key = (symbol, tf, category)
+    if SHARED is None:
+        update_candles(symbol, tf, limit, category)
+    else:
+        shared_candles(symbol, tf, limit, category)
+    _candles_refreshed[key] = time.time()
+    report_candle_store()
+    df = CANDLES.frame(key, limit)
+    return df if df is not None else fetch_ohlcv_bybit(symbol, tf, limit, category)  # evicted by a concurrent put
+
+def update_candles(symbol: str, tf: str, limit: int, category: str):
+    """Fetch the bars that opened since the stored forming bar (the whole series when it is short)"""
+    key = (symbol, tf, category)
+    last_ms = CANDLES.last_ts(key)
+    missing = None
+    if last_ms is not None and CANDLES.size(key) >= limit:
+        missing = (int(time.time() * 1000) - last_ms) // tf_to_ms(tf) + 1  # the stored forming bar plus newer ones
+    if missing is not None and missing < limit:
+        CANDLES.put_frame(key, fetch_ohlcv_bybit(symbol, tf, missing, category, start_ms=last_ms))
+    else:
+        CANDLES.put_frame(key, fetch_ohlcv_bybit(symbol, tf, max(limit, min(CANDLES.capacity, ENV_LOOKBACK)), category),
+                          replace=True)
+
+_candles_fetched: Dict[Tuple[str, str, str], float] = {}  # when the stored bars were fetched (shared cache)
+
+def shared_candles(symbol: str, tf: str, limit: int, category: str):
+    """Update the stored series through the shared cache: one worker process fetches from Bybit and
+    publishes its bars, the others load them. A copy is current while it holds the bar opened at the
+    last close and is younger than SHARED_CANDLES_TTL_S, so closed bars are fetched right after each
+    close and the forming bar is at most that old."""
+    key = (symbol, tf, category)
+    tf_ms = tf_to_ms(tf)
+    now = time.time()
+    forming = int(now * 1000) // tf_ms * tf_ms  # open time of the bar forming now
+    last_ms = CANDLES.last_ts(key)
+    if (last_ms is not None and last_ms >= forming and CANDLES.size(key) >= limit
+            and now - _candles_fetched.get(key, 0) < SHARED_CANDLES_TTL_S):
+        return  # this process has a current copy
+
+    def current(entry: shared_cache.Entry) -> bool:
+        last, bars = map(int, entry.version.split(":"))
+        return last >= forming and bars >= limit and time.time() - entry.value[0] < SHARED_CANDLES_TTL_S
+
+    def build() -> Tuple[Optional[str], Any]:
+        update_candles(symbol, tf, limit, category)
+        bars = CANDLES.tail(key, CANDLES.capacity)
+        if bars is None or not len(bars[0]):
+            return None, (time.time(), None, None)
+        return f"{int(bars[0][-1])}:{len(bars[0])}", (time.time(), bars[0], bars[1])
+
+    (fetched, ts, values), built = shared_lookup("candles", f"candles:{symbol}:{tf}:{category}", current, build)
+    if ts is None:
+        return
+    if not built:
+        CANDLES.put(key, ts, values, replace=True)
+    _candles_fetched[key] = fetched
+
+def report_candle_store():
+    usage = CANDLES.usage()
+    CANDLE_STORE_BYTES.set(usage["bytes"])
+    CANDLE_STORE_SERIES.set(usage["series"])
+    CANDLE_STORE_EVICTIONS.set(usage["evictions"])
+
+class RollingMoments:
+    """Sliding-window sums of return vectors and their cross products.
+
+    Adding a bar is one outer product, so the covariance of n symbols is refreshed in O(n²)
+    per closed bar instead of O(window·n²); sums are rebuilt every `window` updates to keep
+    rounding drift out.
+    """
+    def __init__(self, window: int, returns: np.ndarray):
+        self.window = window
+        self.rows = deque(returns[-window:], maxlen=window)
+        self.updates = 0
+        self._resync()
+
+    def _resync(self):
+        x = np.array(self.rows)
+        self.sum = x.sum(axis=0)
+        self.cross = x.T @ x
+
+    def push(self, r: np.ndarray):
+        if len(self.rows) == self.window:
+            old = self.rows[0]
+            self.sum -= old
+            self.cross -= np.outer(old, old)
+        self.rows.append(r)
+        self.sum += r
+        self.cross += np.outer(r, r)
+        self.updates += 1
+        if self.updates % self.window == 0:
+            self._resync()
+
+    def covariance(self) -> np.ndarray:
+        w = len(self.rows)
+        return (self.cross - np.outer(self.sum, self.sum) / w) / (w - 1)
+
+# (sorted symbols, tf, category, window) -> (moments, ts of the last return pushed), least recently used first
+_moments_cache: "OrderedDict[Tuple, Tuple[RollingMoments, str]]" = OrderedDict()
+_moments_lock = threading.Lock()
+
+def aligned_log_returns(symbols: List[str], tf: str, bars: int, category: str) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """Log returns of closed bars on the timestamps every symbol has: (returns x symbols) frame, errors"""
+    frames, errors = fetch_ohlcv_many(symbols, tf, bars, category, fetch=get_candles)
+    if not frames:
+        return pd.DataFrame(), errors
+    close = stack_ohlcv(frames)["close"].dropna()
+    opened_ms = pd.to_datetime(close.index).astype("int64") // 1_000_000
+    close = close[opened_ms + tf_to_ms(tf) <= int(time.time() * 1000)]  # closed bars only
+    return np.log(close).diff().iloc[1:], errors
+
+def correlation_matrices(symbols: List[str], tf: str, window: int, category: str) -> Dict[str, Any]:
+    """Correlation, covariance and beta of log returns over the last `window` closed bars"""
+    returns, errors = aligned_log_returns(symbols, tf, window + 2, category)
+    symbols = [s for s in symbols if s in returns.columns]
+    returns = returns[symbols]
+    if len(returns) < 2:
+        return {"symbols": symbols, "bars": len(returns), "errors": errors, "error": "not enough overlapping bars"}
+
+    order = sorted(symbols)  # the same set in any order shares one state
+    key = (tuple(order), tf, category, window)
+    values = returns[order].to_numpy()
+    with _moments_lock:
+        state = _moments_cache.get(key)
+        if state and state[1] in returns.index:
+            moments = state[0]
+            for r in values[returns.index.get_loc(state[1]) + 1:]:
+                moments.push(r)
+        else:
+            moments = RollingMoments(window, values)
+        _moments_cache[key] = (moments, returns.index[-1])
+        _moments_cache.move_to_end(key)
+        while len(_moments_cache) > CORRELATION_CACHE_SIZE:
+            _moments_cache.popitem(last=False)
+        cov = moments.covariance()
+        bars = len(moments.rows)
+    pos = [order.index(s) for s in symbols]
+    cov = cov[np.ix_(pos, pos)]  # back to the requested order
+
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = cov / np.outer(std, std)
+        beta = cov / np.diag(cov)[None, :]  # beta[i][j]: sensitivity of symbol i to symbol j
+
+    def matrix(m: np.ndarray) -> Dict[str, Dict[str, Optional[float]]]:
+        return {a: {b: to_float(m[i, j]) for j, b in enumerate(symbols)} for i, a in enumerate(symbols)}
+
+    return {
+        "symbols": symbols,
+        "ts": returns.index[-1],
+        "bars": bars,
+        "volatility": {s: to_float(std[i]) for i, s in enumerate(symbols)},
+        "correlation": matrix(corr),
+        "covariance": matrix(cov),
+        "beta": matrix(beta),
+        "errors": errors,
+    }
+
+# ---------- Push subscriptions ----------
+
+def latest_closed_open(symbol: str, tf: str, category: str) -> Optional[str]:
+    """Open time of the latest closed candle (changes once Bybit has published the close)"""
+    df = fetch_ohlcv_bybit(symbol, tf, 2, category)
+    return df["ts"].iloc[-2] if len(df) >= 2 else None
+
+def push_snapshot(symbol: str, tfs: List[str], category: str, closed: List[str]) -> Dict[str, Any]:
+    """Snapshot pushed to subscribers; `closed` lists the TFs whose candle close triggered it"""
+    tol = ENV_WARMUP_TOLERANCE
+    lb = plan_lookbacks(tfs, None, tol) if tol else ENV_LOOKBACK
+    snapshot = run_snapshot(symbol, tfs, lb, category)
+    snapshot["closed"] = closed
+    return snapshot
+
+HUB = push.SubscriptionHub(push_snapshot, latest_closed_open, next_candle_close,
+                           grace=PUSH_GRACE_S, poll_interval=PUSH_POLL_S, max_wait=PUSH_MAX_WAIT_S)
+
+def subscription_key(symbol: Optional[str], tfs: Optional[str], category: Optional[str]) -> Tuple[str, List[str], str]:
+    sym = (symbol or ENV_SYMBOL).upper()
+    tf_list = [s.strip() for s in (tfs or ",".join(ENV_TFS)).split(",") if s.strip()]
+    for tf in tf_list:
+        map_tf_to_bybit(tf)  # raises ValueError on unsupported TFs
+    return sym, tf_list, category.lower() if category else get_default_category(sym)
+
+# ---------- Profiling ----------
+
+def check_profile_token(profile: bool, token: Optional[str]) -> Optional[JSONResponse]:
+    """Return a 403 response when profiling is requested without the configured token"""
+    if not profile:
+        return None
+    if not PROFILE_TOKEN:
+        return JSONResponse({"error": "Profiling disabled", "message": "Set PROFILE_TOKEN to enable profile=true"}, status_code=403)
+    if not token or not hmac.compare_digest(token, PROFILE_TOKEN):
+        return JSONResponse({"error": "Invalid profile token"}, status_code=403)
+    return None
+
+def run_profiled(endpoint: str, fn, *args, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+    """Run `fn` under the sampling profiler; returns (result, profile report)"""
+    prof = profiler.SamplingProfiler(PROFILE_INTERVAL_MS / 1000.0)
+    result = prof.run(fn, *args, **kwargs)
+    report = prof.report()
+    collapsed = prof.collapsed()
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+            path = os.path.join(PROFILE_DIR, f"{endpoint}-{stamp}-{uuid.uuid4().hex[:8]}.collapsed")
+            with open(path, "w") as f:
+                f.write(collapsed)
+            report["collapsed_file"] = path
+        except Exception as e:
+            print("[profile] save failed:", e)
+            report["collapsed"] = collapsed
+    else:
+        report["collapsed"] = collapsed
+    return result, report
 
 # ---------- API ----------
 
 @app.get("/v1/healthz")
 def health():
+    """Liveness: the process is up and serving"""
     return {"ok": True, "ts": datetime.datetime.utcnow().isoformat() + "Z"}
 
+@app.get("/v1/readyz")
+def ready():
+    """Readiness: 503 until the background warmup has finished"""
+    body = {"ready": READY.is_set(), "uptime_s": round(time.time() - STARTUP["started"], 3),
+            "warmup_s": STARTUP["ready_s"], "steps": STARTUP["steps"], "candle_store": CANDLES.usage(),
+            "bybit_breakers": {g: b.stats() for g, b in BYBIT_BREAKERS.items()}, "revalidate": UPSTREAM_REFRESH.stats()}
+    if SHARED is not None:
+        body["shared_cache"] = SHARED.stats()
+    if PRIVATE_STREAM is not None:
+        body["private_stream"] = PRIVATE_STREAM.stats()
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/v1/metrics")
+def get_metrics():
+    """Prometheus text exposition of stage latencies and upstream call counters"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/v1/run")
 def run(
     symbol: Optional[str] = Query(default=None),
     tfs: Optional[str] = Query(default=None, description="comma-separated TFs, e.g. 5m,15m,1h,1d"),
     lookback: Optional[int] = Query(default=None),
     category: Optional[str] = Query(default=None, description="bybit category: linear (futures)|spot|inverse"),
-    include_position: Optional[bool] = Query(default=True, description="include current position data in snapshot")
+    include_position: Optional[bool] = Query(default=True, description="include current position data in snapshot"),
+    include_market: Optional[bool] = Query(default=True, description="include funding/OI/24h/mark price from the cached tickers"),
+    market_history: Optional[bool] = Query(default=False, description="add recent funding and open interest history to the market block"),
+    timings: Optional[bool] = Query(default=False, description="include per-stage timings (ms) in the response"),
+    fields: Optional[str] = Query(default=None, description="comma-separated snapshot fields to compute, wildcards allowed (e.g. rsi14,ema*)"),
+    warmup_tol: Optional[float] = Query(default=None, gt=0, lt=1, description="fetch only the bars needed for this indicator accuracy (ignored when lookback is set)"),
+    stream: Optional[bool] = Query(default=False, description="stream NDJSON events, one per TF as it completes"),
+    deadline_ms: Optional[float] = Query(default=None, ge=0, description="answer within this many ms; late TFs come back cached or as a timeout (default RUN_DEADLINE_MS, 0 = none)"),
+    format: Optional[str] = Query(default=None, description="json|msgpack (default: from Accept, else json)"),
+    profile: Optional[bool] = Query(default=False, description="profile this request (requires PROFILE_TOKEN)"),
+    profile_token: Optional[str] = Query(default=None),
+    x_profile_token: Optional[str] = Header(default=None),
+    accept: Optional[str] = Header(default=None)
 ):
+    offered = [formats.JSON, formats.MSGPACK]
+    media_type = formats.negotiate(offered, None if stream else accept, format)
+    if media_type is None:
+        return JSONResponse(formats.unavailable_detail(offered), status_code=406)
     sym = symbol or ENV_SYMBOL
     tf_list = [s.strip() for s in (tfs or ",".join(ENV_TFS)).split(",") if s.strip()]
     lb = lookback or ENV_LOOKBACK
@@ -951,44 +2852,336 @@ def run(
     else:
         cat = get_default_category(sym)  # Auto-detect based on symbol
 
-    feature_map: Dict[str, Any] = {}
-    dataframes: Dict[str, pd.DataFrame] = {}
+    try:
+        field_list = parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse({"error": str(e), "valid_fields": list(SNAPSHOT_FIELDS)}, status_code=400)
 
-    for tf in tf_list:
-        df = fetch_ohlcv_bybit(sym, tf, lb, cat)
-        # compute indicators
-        df_ind = df.copy()
-        df_ind.index = pd.to_datetime(df_ind["ts"])
-        df_ind = compute_indicators(df_ind)
+    # Without an explicit lookback, fetch only the warmup the requested fields need
+    tol = warmup_tol or ENV_WARMUP_TOLERANCE
+    if not lookback and tol:
+        lb = plan_lookbacks(tf_list, field_list, tol)
 
-        # Store dataframe for advanced analysis
-        dataframes[tf] = df_ind
+    denied = check_profile_token(profile, profile_token or x_profile_token)
+    if denied:
+        return denied
+    budget_ms = RUN_DEADLINE_MS if deadline_ms is None else deadline_ms
+
+    if stream and not profile:
+        return StreamingResponse(stream_snapshot(sym, tf_list, lb, cat, include_position, timings, field_list,
+                                                 include_market, market_history, budget_ms),
+                                 media_type="application/x-ndjson")
 
-        # optional upsert to Supabase
+    if profile:
+        snapshot, report = run_profiled("run", run_snapshot, sym, tf_list, lb, cat, include_position, timings, field_list,
+                                        include_market, market_history, budget_ms)
+        snapshot["profile"] = report
+    else:
+        key = (sym, tuple(tf_list), json.dumps(lb, sort_keys=True), cat, tuple(field_list or ()),
+               include_position, include_market, market_history)
         try:
-            upsert_tables(sym, tf, df, df_ind)
+            snapshot = run_snapshot(sym, tf_list, lb, cat, include_position, timings, field_list,
+                                    include_market, market_history, budget_ms)
         except Exception as e:
-            print("[supabase] upsert failed:", e)
+            snapshot = last_good_snapshot(key, e)
+            if snapshot is None:
+                raise
+            print(f"[run] serving the last good {sym} snapshot: {e}")
+        else:
+            if not snapshot.get("deadline", {}).get("missed"):
+                remember_snapshot(key, snapshot)
 
-        # last closed row for snapshot
-        s = df_ind.iloc[-2] if len(df_ind) >= 2 else df_ind.iloc[-1]
-        feature_map[tf] = s
+    write_snapshot_json(snapshot)
+    if media_type == formats.MSGPACK:
+        return Response(formats.to_msgpack(snapshot), media_type=media_type)
+    return JSONResponse(snapshot)
 
-    snapshot = build_snapshot(sym, feature_map, dataframes, include_position)
+@app.get("/v1/candles")
+def candles(
+    symbol: Optional[str] = Query(default=None),
+    tf: str = Query(default="1h"),
+    lookback: Optional[int] = Query(default=None, ge=1),
+    category: Optional[str] = Query(default=None, description="bybit category: linear (futures)|spot|inverse"),
+    indicators: Optional[bool] = Query(default=True, description="add the compute_indicators columns"),
+    fields: Optional[str] = Query(default=None, description="snapshot fields whose indicator columns to add, wildcards allowed"),
+    format: Optional[str] = Query(default=None, description="json|arrow|msgpack (default: from Accept, else json)"),
+    accept: Optional[str] = Header(default=None)
+):
+    """OHLCV (the forming bar is last) and indicator columns as one columnar frame"""
+    offered = [formats.JSON, formats.ARROW, formats.MSGPACK]
+    media_type = formats.negotiate(offered, accept, format)
+    if media_type is None:
+        return JSONResponse(formats.unavailable_detail(offered), status_code=406)
+    sym = symbol or ENV_SYMBOL
+    cat = category.lower() if category else get_default_category(sym)
+    try:
+        field_list = parse_fields(fields)
+        map_tf_to_bybit(tf)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
-    if WRITE_SNAPSHOT_JSON:
+    with timed("fetch", sym, tf):
+        df = get_candles(sym, tf, lookback or ENV_LOOKBACK, cat)
+    if indicators:
+        with timed("indicators", sym, tf):
+            df = compute_indicators(df, indicator_columns(field_list))
+
+    if media_type == formats.ARROW:
+        return Response(formats.to_arrow(df), media_type=media_type)
+    columns = {"symbol": sym, "tf": tf, "category": cat, "rows": len(df),
+               "columns": {c: [to_float(v) if c != "ts" else v for v in df[c].tolist()] for c in df.columns}}
+    if media_type == formats.MSGPACK:
+        return Response(formats.to_msgpack(columns), media_type=media_type)
+    return JSONResponse(columns)
+
+@app.get("/v1/history")
+def history(
+    start: str = Query(description="first bar to replay: ISO date/datetime (UTC) or epoch ms"),
+    end: Optional[str] = Query(default=None, description="last bar to replay (default: latest closed bar)"),
+    symbol: Optional[str] = Query(default=None),
+    tf: str = Query(default="1h"),
+    category: Optional[str] = Query(default=None, description="bybit category: linear (futures)|spot|inverse"),
+    fields: Optional[str] = Query(default=None, description="comma-separated snapshot fields, wildcards allowed"),
+    window: int = Query(default=ENV_LOOKBACK, ge=5, description="bars the structure analyses see at each step"),
+    format: Optional[str] = Query(default=None, description="ndjson|csv|arrow (default: from Accept, else ndjson)"),
+    accept: Optional[str] = Header(default=None)
+):
+    """Snapshot features as of the close of every bar in [start, end], streamed as NDJSON, CSV or Arrow IPC"""
+    offered = [formats.NDJSON, formats.CSV, formats.ARROW]
+    media_type = formats.negotiate(offered, accept, format)
+    if media_type is None:
+        return JSONResponse(formats.unavailable_detail(offered), status_code=406)
+    sym = symbol or ENV_SYMBOL
+    cat = category.lower() if category else get_default_category(sym)
+    try:
+        field_list = parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse({"error": str(e), "valid_fields": list(SNAPSHOT_FIELDS)}, status_code=400)
+    try:
+        start_ms = parse_time_ms(start)
+        end_ms = parse_time_ms(end) if end else int(time.time() * 1000)
+        step = tf_to_ms(tf)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if end_ms < start_ms:
+        return JSONResponse({"error": "end is before start"}, status_code=400)
+    if (end_ms - start_ms) // step + 1 > HISTORY_MAX_BARS:
+        return JSONResponse({"error": f"range exceeds HISTORY_MAX_BARS ({HISTORY_MAX_BARS} bars)"}, status_code=400)
+
+    warmup_bars = max(indicator_warmup(field_list, HISTORY_WARMUP_TOLERANCE), window)
+    with timed("fetch", sym, tf):
+        df = fetch_history(sym, tf, start_ms, end_ms, cat, warmup_bars)
+    rows = build_history(df, field_list, window, ts_ms_to_iso(start_ms))
+
+    def ndjson():
+        chunk = []
+        for row in rows:
+            chunk.append(json.dumps(row))
+            if len(chunk) >= HISTORY_CHUNK_ROWS:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    def csv_rows():
+        buf = io.StringIO()
+        writer = None
+        for i, row in enumerate(rows):
+            flat = flatten_history_row(row)
+            if writer is None:
+                writer = csv.DictWriter(buf, fieldnames=list(flat))
+                writer.writeheader()
+            writer.writerow(flat)
+            if (i + 1) % HISTORY_CHUNK_ROWS == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def frames():
+        chunk = []
+        for row in rows:
+            chunk.append(flatten_history_row(row))
+            if len(chunk) >= HISTORY_CHUNK_ROWS:
+                yield history_frame(chunk)
+                chunk = []
+        if chunk:
+            yield history_frame(chunk)
+
+    if media_type == formats.CSV:
+        return StreamingResponse(csv_rows(), media_type=media_type,
+                                 headers={"Content-Disposition": f'attachment; filename="{sym}_{tf}_history.csv"'})
+    if media_type == formats.ARROW:
+        return StreamingResponse(formats.arrow_stream(frames()), media_type=media_type)
+    return StreamingResponse(ndjson(), media_type=media_type)
+
+@app.get("/v1/export")
+def export(
+    start: str = Query(description="first bar: ISO date/datetime (UTC) or epoch ms"),
+    end: Optional[str] = Query(default=None, description="last bar (default: latest closed bar)"),
+    symbol: Optional[str] = Query(default=None),
+    tf: str = Query(default="1h"),
+    category: Optional[str] = Query(default=None, description="bybit category: linear (futures)|spot|inverse"),
+    fields: Optional[str] = Query(default=None, description="snapshot fields whose indicator columns to export, wildcards allowed"),
+    format: Optional[str] = Query(default=None, description="parquet|arrow|csv (default: from Accept, else parquet, or csv without pyarrow)"),
+    accept: Optional[str] = Header(default=None)
+):
+    """OHLCV + indicator frame for a range, streamed chunk by chunk as Parquet row groups, Arrow record batches or CSV"""
+    offered = [formats.PARQUET, formats.ARROW, formats.CSV]
+    media_type = formats.negotiate(offered, accept, format)
+    if media_type is None:
+        return JSONResponse(formats.unavailable_detail(offered), status_code=406)
+    sym = symbol or ENV_SYMBOL
+    cat = category.lower() if category else get_default_category(sym)
+    try:
+        field_list = parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse({"error": str(e), "valid_fields": list(SNAPSHOT_FIELDS)}, status_code=400)
+    try:
+        start_ms = parse_time_ms(start)
+        end_ms = parse_time_ms(end) if end else int(time.time() * 1000)
+        step = tf_to_ms(tf)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if end_ms < start_ms:
+        return JSONResponse({"error": "end is before start"}, status_code=400)
+    if (end_ms - start_ms) // step + 1 > EXPORT_MAX_BARS:
+        return JSONResponse({"error": f"range exceeds EXPORT_MAX_BARS ({EXPORT_MAX_BARS} bars)"}, status_code=400)
+
+    frames = iter_export_frames(sym, tf, start_ms, end_ms, cat, field_list)
+    if media_type == formats.ARROW:
+        return StreamingResponse(formats.arrow_stream(frames), media_type=media_type)
+    if media_type == formats.CSV:
+        return StreamingResponse(formats.csv_stream(frames), media_type=media_type,
+                                 headers={"Content-Disposition": f'attachment; filename="{sym}_{tf}.csv"'})
+    return StreamingResponse(formats.parquet_stream(frames), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{sym}_{tf}.parquet"'})
+
+@app.get("/v1/scan")
+def scan(
+    tf: str = Query(default="1h"),
+    category: str = Query(default="linear", description="bybit category: linear (futures)|spot|inverse"),
+    symbols: Optional[str] = Query(default=None, description="comma-separated symbols (default: every trading perpetual)"),
+    quote: str = Query(default="USDT", description="quote coin of the default universe"),
+    lookback: int = Query(default=ENV_LOOKBACK, ge=30, le=BYBIT_KLINE_PAGE),
+    rsi_min: Optional[float] = Query(default=None),
+    rsi_max: Optional[float] = Query(default=None),
+    adx_min: Optional[float] = Query(default=None),
+    bbw_max: Optional[float] = Query(default=None, description="max Bollinger bandwidth (squeeze filter)"),
+    alignment: Optional[str] = Query(default=None, pattern="^(bullish|bearish|mixed)$", description="EMA20/50/200 alignment"),
+    sort: str = Query(default="adx14", description="|".join(SCAN_SORT_KEYS)),
+    order: str = Query(default="desc", pattern="^(asc|desc)$"),
+    top: int = Query(default=50, ge=1)
+):
+    """Screen a symbol universe by RSI, ADX, Bollinger bandwidth and EMA alignment on the last closed bar"""
+    if sort not in SCAN_SORT_KEYS:
+        return JSONResponse({"error": f"Unknown sort key: {sort}", "valid_sort": list(SCAN_SORT_KEYS)}, status_code=400)
+    t0 = time.perf_counter()
+    cat = category.lower()
+    if symbols:
+        universe = [s.strip().upper() for s in symbols.split(",") if s.strip()]
+    else:
         try:
-            with open("snapshot.json", "w") as f:
-                json.dump(snapshot, f, indent=2)
-        except Exception:
-            pass
+            universe = fetch_universe(cat, quote.upper())
+        except Exception as e:
+            return JSONResponse({"error": f"universe fetch failed: {e}"}, status_code=502)
+    universe = universe[:SCAN_MAX_SYMBOLS]
 
-    return JSONResponse(snapshot)
+    rows, errors, bar_ts = scan_market(universe, tf, lookback, cat)
+    matched = filter_scan(rows, rsi_min, rsi_max, adx_min, bbw_max, alignment)
+    present = [r for r in matched if r[sort] is not None]
+    present.sort(key=lambda r: r[sort], reverse=order == "desc")
+    ranked = present + [r for r in matched if r[sort] is None]
+    elapsed = time.perf_counter() - t0
+    STAGE_LATENCY.observe(elapsed, symbol="scan", tf=tf, stage="total")
+    return JSONResponse({
+        "tf": tf, "category": cat, "ts": bar_ts,
+        "scanned": len(universe), "computed": len(rows), "matched": len(matched),
+        "results": ranked[:top], "errors": errors, "elapsed_ms": round(elapsed * 1000, 3)
+    })
+
+@app.get("/v1/correlation")
+def correlation(
+    symbols: Optional[str] = Query(default=None, description="comma-separated symbols (default: SYMBOL)"),
+    benchmarks: Optional[str] = Query(default=None, description="comma-separated benchmarks added to the matrix (default: BTCUSDT,ETHUSDT)"),
+    tfs: Optional[str] = Query(default=None, description="comma-separated TFs (default: TF_LIST)"),
+    window: int = Query(default=100, ge=2, le=BYBIT_KLINE_PAGE - 2, description="closed-bar returns per estimate"),
+    category: str = Query(default="linear", description="bybit category: linear (futures)|spot|inverse")
+):
+    """Rolling log-return correlation, covariance and beta matrices per TF"""
+    names = [s.strip().upper() for s in (symbols or ENV_SYMBOL).split(",") if s.strip()]
+    bench = CORRELATION_BENCHMARKS if benchmarks is None else [s.strip().upper() for s in benchmarks.split(",") if s.strip()]
+    universe = list(dict.fromkeys(bench + names))
+    tf_list = [s.strip() for s in (tfs or ",".join(ENV_TFS)).split(",") if s.strip()]
+    cat = category.lower()
+    out: Dict[str, Any] = {"window": window, "benchmarks": bench, "timeframes": {}}
+    for tf in tf_list:
+        with timed("correlation", "multi", tf):
+            out["timeframes"][tf] = correlation_matrices(universe, tf, window, cat)
+    return JSONResponse(out)
+
+@app.get("/v1/subscribe")
+async def subscribe(
+    symbol: Optional[str] = Query(default=None),
+    tfs: Optional[str] = Query(default=None, description="comma-separated TFs, e.g. 5m,15m,1h"),
+    category: Optional[str] = Query(default=None, description="bybit category: linear (futures)|spot|inverse")
+):
+    """Server-Sent Events: the current snapshot, then a new one whenever a candle of `tfs` closes"""
+    try:
+        key = subscription_key(symbol, tfs, category)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    async def events():
+        async with HUB.subscribe(*key) as queue:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), PUSH_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/v1/ws")
+async def subscribe_ws(websocket: WebSocket, symbol: Optional[str] = None, tfs: Optional[str] = None,
+                       category: Optional[str] = None):
+    """WebSocket variant of /v1/subscribe; each message is `{"event": ..., "data": ...}`"""
+    await websocket.accept()
+    try:
+        key = subscription_key(symbol, tfs, category)
+    except ValueError as e:
+        await websocket.send_json({"event": "error", "data": {"error": str(e)}})
+        await websocket.close(code=1008)
+        return
+    async with HUB.subscribe(*key) as queue:
+        # Incoming messages are ignored; reading them is how a disconnect is noticed between pushes
+        receiver = asyncio.ensure_future(websocket.receive_text())
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if receiver in done:
+                    getter.cancel()
+                    if receiver.exception() is not None:
+                        break
+                    receiver = asyncio.ensure_future(websocket.receive_text())
+                    continue
+                await websocket.send_json(getter.result())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
 
 @app.get("/v1/positions")
 def get_positions(
     symbol: Optional[str] = Query(default=None, description="Filter by specific symbol (e.g., HYPEUSDT)"),
-    category: Optional[str] = Query(default="linear", description="Bybit category: linear (futures)|spot|inverse")
+    category: Optional[str] = Query(default="linear", description="Bybit category: linear (futures)|spot|inverse"),
+    profile: Optional[bool] = Query(default=False, description="profile this request (requires PROFILE_TOKEN)"),
+    profile_token: Optional[str] = Query(default=None),
+    x_profile_token: Optional[str] = Header(default=None)
 ):
     """
     Get current open positions from Bybit
@@ -1000,24 +3193,45 @@ def get_positions(
     Returns:
     - JSON with open positions information
     """
-    result = get_bybit_positions(symbol, category)
+    denied = check_profile_token(profile, profile_token or x_profile_token)
+    if denied:
+        return denied
+    if profile:
+        result, report = run_profiled("positions", get_positions_live, symbol, category)
+        result["profile"] = report
+    else:
+        result = get_positions_live(symbol, category)
     return JSONResponse(result)
 
 @app.get("/v1/account")
-def get_account():
+def get_account(
+    profile: Optional[bool] = Query(default=False, description="profile this request (requires PROFILE_TOKEN)"),
+    profile_token: Optional[str] = Query(default=None),
+    x_profile_token: Optional[str] = Header(default=None)
+):
     """
     Get Bybit account information and wallet balance
     
     Returns:
     - JSON with account information
     """
-    result = get_bybit_account_info()
+    denied = check_profile_token(profile, profile_token or x_profile_token)
+    if denied:
+        return denied
+    if profile:
+        result, report = run_profiled("account", get_account_live)
+        result["profile"] = report
+    else:
+        result = get_account_live()
     return JSONResponse(result)
 
 @app.get("/v1/positions/{symbol}")
 def get_position_by_symbol(
     symbol: str,
-    category: Optional[str] = Query(default="linear", description="Bybit category: linear (futures)|spot|inverse")
+    category: Optional[str] = Query(default="linear", description="Bybit category: linear (futures)|spot|inverse"),
+    profile: Optional[bool] = Query(default=False, description="profile this request (requires PROFILE_TOKEN)"),
+    profile_token: Optional[str] = Query(default=None),
+    x_profile_token: Optional[str] = Header(default=None)
 ):
     """
     Get current open positions for a specific symbol
@@ -1029,5 +3243,12 @@ def get_position_by_symbol(
     Returns:
     - JSON with open positions for the specified symbol
     """
-    result = get_bybit_positions(symbol, category)
+    denied = check_profile_token(profile, profile_token or x_profile_token)
+    if denied:
+        return denied
+    if profile:
+        result, report = run_profiled("positions", get_positions_live, symbol, category)
+        result["profile"] = report
+    else:
+        result = get_positions_live(symbol, category)
     return JSONResponse(result)
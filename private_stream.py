@@ -0,0 +1,207 @@
+"""
+Bybit private WebSocket consumer for positions and wallet balance.
+
+One authenticated connection subscribes to the `position` and `wallet`
+topics and keeps the latest state in memory, so position/account reads need
+no upstream round trip. After every (re)connect the state is resynced from
+REST; a push newer than the REST snapshot always wins, so events that arrive
+while the resync is in flight are not lost.
+
+State is only served while the stream is connected and synced; callers fall
+back to REST otherwise. The URL and the connect function are injectable, so
+the consumer runs against a local stand-in stream in tests. The `websockets`
+package is an optional dependency, imported when the stream starts.
+"""
+
+import asyncio, hashlib, hmac, inspect, json, threading, time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+MAINNET_URL = "wss://stream.bybit.com/v5/private"
+TESTNET_URL = "wss://stream-testnet.bybit.com/v5/private"
+TOPICS = ("position", "wallet")
+
+PositionKey = Tuple[str, str, int]  # (category, symbol, positionIdx)
+
+def auth_message(api_key: str, secret: str, expires_ms: int) -> Dict[str, Any]:
+    """`auth` op: HMAC-SHA256 of "GET/realtime{expires}" with the API secret"""
+    signature = hmac.new(secret.encode("utf-8"), f"GET/realtime{expires_ms}".encode("utf-8"), hashlib.sha256).hexdigest()
+    return {"op": "auth", "args": [api_key, expires_ms, signature]}
+
+def _ms(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+class AccountState:
+    """Latest raw Bybit position and wallet records, safe to read from any thread"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.connected = False
+        self.synced = False
+        self.synced_at: Optional[float] = None
+        self.updated_at: Optional[float] = None
+        self.events = 0
+        self._positions: Dict[PositionKey, Dict[str, Any]] = {}
+        self._wallet: Dict[str, Tuple[int, Dict[str, Any]]] = {}  # accountType -> (ms, record)
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.connected and self.synced
+
+    @staticmethod
+    def _key(pos: Dict[str, Any], category: Optional[str] = None) -> PositionKey:
+        return (pos.get("category") or category or "", pos.get("symbol", ""), int(pos.get("positionIdx") or 0))
+
+    def apply_positions(self, items: Iterable[Dict[str, Any]]):
+        """Merge pushed position records; an older `updatedTime` never overwrites a newer one"""
+        with self._lock:
+            for pos in items:
+                key = self._key(pos)
+                current = self._positions.get(key)
+                if current is None or _ms(pos.get("updatedTime")) >= _ms(current.get("updatedTime")):
+                    self._positions[key] = dict(pos, category=key[0])
+            self.events += 1
+            self.updated_at = self.clock()
+
+    def replace_positions(self, category: str, items: Iterable[Dict[str, Any]], as_of_ms: int):
+        """Replace a category with a REST snapshot taken at `as_of_ms`, keeping newer pushed records"""
+        with self._lock:
+            fresh = {self._key(pos, category): dict(pos, category=category) for pos in items}
+            for key, current in list(self._positions.items()):
+                if key[0] != category:
+                    continue
+                pushed = _ms(current.get("updatedTime"))
+                if key in fresh:
+                    if pushed > _ms(fresh[key].get("updatedTime")):
+                        fresh[key] = current
+                elif pushed >= as_of_ms:
+                    fresh[key] = current  # opened while the snapshot was being fetched
+                del self._positions[key]
+            self._positions.update(fresh)
+
+    def apply_wallet(self, items: Iterable[Dict[str, Any]], ts_ms: int):
+        """Store wallet records (one per accountType) stamped `ts_ms`, unless a newer one is held"""
+        with self._lock:
+            for record in items:
+                account_type = record.get("accountType", "")
+                current = self._wallet.get(account_type)
+                if current is None or ts_ms >= current[0]:
+                    self._wallet[account_type] = (ts_ms, record)
+            self.events += 1
+            self.updated_at = self.clock()
+
+    def positions(self, symbol: Optional[str] = None, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(p) for (cat, sym, _), p in sorted(self._positions.items())
+                    if (category is None or cat == category) and (symbol is None or sym == symbol)]
+
+    def wallet(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(record) for _, record in self._wallet.values()]
+
+    def stats(self) -> Dict[str, Any]:
+        now = self.clock()
+        return {
+            "connected": self.connected,
+            "synced": self.synced,
+            "positions": len(self._positions),
+            "events": self.events,
+            "synced_age_s": None if self.synced_at is None else round(now - self.synced_at, 3),
+            "updated_age_s": None if self.updated_at is None else round(now - self.updated_at, 3),
+        }
+
+class PrivateStream:
+    def __init__(self, url: str, api_key: str, secret: str, state: AccountState,
+                 resync: Callable[[AccountState], Any], connect: Optional[Callable[[str], Any]] = None,
+                 ping_interval: float = 20.0, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0,
+                 clock: Callable[[], float] = time.time):
+        """
+        resync(state) reloads positions and wallet from REST (blocking calls run in a worker thread)
+        connect(url) -> async context manager yielding an object with async send(str) / recv() -> str
+        (default: `websockets.connect`)
+        """
+        self.url = url
+        self.api_key = api_key
+        self.secret = secret
+        self.state = state
+        self.resync = resync
+        self.connect = connect
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.clock = clock
+        self.connects = 0
+        self.last_error: Optional[str] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.state.stats(), connects=self.connects, last_error=self.last_error)
+
+    async def run(self):
+        """Connect, authenticate, subscribe, resync and consume; reconnect with backoff until cancelled"""
+        connect = self.connect
+        if connect is None:
+            import websockets
+            connect = websockets.connect
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with connect(self.url) as ws:
+                    await self._handshake(ws)
+                    self.connects += 1
+                    self.state.connected = True
+                    await self._resync()
+                    delay = self.reconnect_delay
+                    await self._consume(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                print(f"[private_stream] {self.last_error}; reconnecting in {delay:.0f}s")
+            finally:
+                self.state.connected = False
+                self.state.synced = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _request(self, ws, message: Dict[str, Any]):
+        """Send an op and wait for its acknowledgement"""
+        await ws.send(json.dumps(message))
+        while True:
+            reply = json.loads(await asyncio.wait_for(ws.recv(), timeout=10))
+            if reply.get("op") == message["op"]:
+                if not reply.get("success"):
+                    raise RuntimeError(f"{message['op']} rejected: {reply.get('ret_msg')}")
+                return
+
+    async def _handshake(self, ws):
+        expires = int((self.clock() + 10) * 1000)
+        await self._request(ws, auth_message(self.api_key, self.secret, expires))
+        await self._request(ws, {"op": "subscribe", "args": list(TOPICS)})
+
+    async def _resync(self):
+        if inspect.iscoroutinefunction(self.resync):
+            await self.resync(self.state)
+        else:
+            await asyncio.to_thread(self.resync, self.state)
+        self.state.synced = True
+        self.state.synced_at = self.clock()
+
+    async def _consume(self, ws):
+        while True:
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=self.ping_interval)
+            except asyncio.TimeoutError:
+                await ws.send(json.dumps({"op": "ping"}))  # Bybit drops idle connections
+                continue
+            self.handle(json.loads(raw))
+
+    def handle(self, message: Dict[str, Any]):
+        topic = message.get("topic", "")
+        if topic.startswith("position"):
+            self.state.apply_positions(message.get("data") or [])
+        elif topic.startswith("wallet"):
+            # Stamped on receipt, so it compares with the local time a REST resync started
+            self.state.apply_wallet(message.get("data") or [], int(self.clock() * 1000))
@@ -0,0 +1,129 @@
+"""
+Lightweight sampling profiler for on-demand request profiling.
+
+A background thread periodically samples the call stack of the thread that
+runs the request (via `sys._current_frames`) and aggregates the samples into
+collapsed stacks (`frame;frame;frame count`, the input format of
+flamegraph.pl / speedscope / inferno) and a table of hot functions.
+Only the stack below the profiled call is recorded.
+
+Work the request hands to pool threads is sampled too when it is submitted
+through `propagate(fn)`: while the wrapped call runs, its thread is sampled
+as well, under a `[thread name]` root frame.
+"""
+
+import os, sys, threading, time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_local = threading.local()
+
+def current() -> Optional["SamplingProfiler"]:
+    """The profiler sampling this thread, if any"""
+    return getattr(_local, "profiler", None)
+
+def propagate(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """`fn` wrapped so that, run on another thread, it is sampled by this thread's profiler"""
+    prof = current()
+    if prof is None:
+        return fn
+    return lambda *args, **kwargs: prof.traced(fn, *args, **kwargs)
+
+def _thread_label() -> str:
+    """Thread name without its pool index (revalidate_3 -> revalidate)"""
+    return threading.current_thread().name.rstrip("0123456789").rstrip("_-")
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._targets: Dict[int, Tuple[Any, Optional[str]]] = {}  # thread ident -> (root frame, label)
+        self._lock = threading.Lock()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                targets = list(self._targets.items())
+            for ident, (root, label) in targets:
+                frame = frames.get(ident)
+                stack: List[str] = []
+                while frame is not None and frame is not root:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    if label:
+                        stack.append(f"[{label}]")
+                    stack.reverse()
+                    self.stacks[";".join(stack)] += 1
+                    self.samples += 1
+
+    def _call(self, label: Optional[str], fn: Callable[..., Any], *args, **kwargs) -> Any:
+        ident = threading.get_ident()
+        previous = current()
+        with self._lock:
+            self._targets[ident] = (sys._getframe(), label)
+        _local.profiler = self
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.profiler = previous
+            with self._lock:
+                self._targets.pop(ident, None)
+
+    def traced(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call `fn`, sampling this (pool) thread while the profiler runs"""
+        if self._stop.is_set():
+            return fn(*args, **kwargs)
+        return self._call(_thread_label(), fn, *args, **kwargs)
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call `fn` while sampling the current thread (and the calls it hands out via `propagate`)"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        t0 = time.perf_counter()
+        self._thread.start()
+        try:
+            return self._call(None, fn, *args, **kwargs)
+        finally:
+            self._stop.set()
+            self._thread.join()
+            self.duration = time.perf_counter() - t0
+
+    def collapsed(self) -> str:
+        """Flamegraph-compatible collapsed stacks"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top(self, limit: int = 25) -> List[Dict[str, Any]]:
+        """Hot functions by self samples, with inclusive (total) samples"""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for f in set(frames):
+                total_counts[f] += count
+        n = self.samples or 1
+        ranked: List[Tuple[str, int]] = sorted(total_counts.items(), key=lambda kv: (self_counts[kv[0]], kv[1]), reverse=True)
+        return [{
+            "function": f,
+            "self_samples": self_counts[f],
+            "total_samples": total,
+            "self_pct": round(100.0 * self_counts[f] / n, 2),
+            "total_pct": round(100.0 * total / n, 2),
+        } for f, total in ranked[:limit]]
+
+    def report(self, top: int = 25) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "duration_ms": round(self.duration * 1000, 3),
+            "top": self.top(top),
+        }
@@ -0,0 +1,134 @@
+"""
+Candle-close push hub for snapshot subscriptions.
+
+Clients subscribe to a key (symbol, timeframes, category). Each key has one
+topic task that sleeps until the next candle close of any of its timeframes,
+confirms with the candle source that the bar has actually closed (the
+exchange publishes it with some lag), computes one snapshot and fans it out
+to every subscriber queue. The first subscriber starts the task, the last one
+to leave stops it.
+
+Clock, sleep, candle source and snapshot computation are injected so the hub
+runs against a fake clock and stand-in candles in tests.
+"""
+
+import asyncio, inspect, time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+Key = Tuple[str, Tuple[str, ...], str]
+
+async def _call(fn: Callable, *args) -> Any:
+    """Await coroutine functions, run blocking ones in a worker thread"""
+    if inspect.iscoroutinefunction(fn):
+        return await fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+class Topic:
+    def __init__(self, key: Key):
+        self.key = key
+        self.queues: List[asyncio.Queue] = []
+        self.task: Optional[asyncio.Task] = None
+        self.latest: Optional[Dict[str, Any]] = None
+        self.computations = 0
+
+class SubscriptionHub:
+    def __init__(self, compute: Callable[[str, List[str], str, List[str]], Any],
+                 last_closed: Callable[[str, str, str], Any],
+                 next_close: Callable[[str, float], float],
+                 clock: Callable[[], float] = time.time,
+                 sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+                 grace: float = 1.0, poll_interval: float = 2.0, max_wait: float = 60.0, queue_size: int = 4):
+        """
+        compute(symbol, tfs, category, closed_tfs) -> snapshot
+        last_closed(symbol, tf, category) -> id (e.g. open time) of the latest closed candle
+        next_close(tf, now) -> time (clock units) of the next candle close after `now`
+        """
+        self.compute = compute
+        self.last_closed = last_closed
+        self.next_close = next_close
+        self.clock = clock
+        self.sleep = sleep
+        self.grace = grace
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.queue_size = queue_size
+        self.topics: Dict[Key, Topic] = {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"topics": len(self.topics), "subscribers": sum(len(t.queues) for t in self.topics.values())}
+
+    @asynccontextmanager
+    async def subscribe(self, symbol: str, tfs: List[str], category: str):
+        """Yield a queue of `{"event": ..., "data": ...}` messages for this key"""
+        key: Key = (symbol, tuple(tfs), category)
+        topic = self.topics.get(key)
+        if topic is None:
+            topic = self.topics[key] = Topic(key)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        topic.queues.append(queue)
+        if topic.latest is not None:
+            queue.put_nowait(topic.latest)  # late joiners start from the current snapshot
+        if topic.task is None:
+            topic.task = asyncio.create_task(self._run(topic))
+        try:
+            yield queue
+        finally:
+            topic.queues.remove(queue)
+            if not topic.queues:
+                topic.task.cancel()
+                self.topics.pop(key, None)
+
+    def _publish(self, topic: Topic, message: Dict[str, Any]):
+        if message["event"] == "snapshot":
+            topic.latest = message
+        for queue in topic.queues:
+            if queue.full():
+                queue.get_nowait()  # a slow client skips stale snapshots instead of blocking the rest
+            queue.put_nowait(message)
+
+    async def _emit(self, topic: Topic, closed: List[str]):
+        symbol, tfs, category = topic.key
+        try:
+            snapshot = await _call(self.compute, symbol, list(tfs), category, closed)
+            topic.computations += 1
+            self._publish(topic, {"event": "snapshot", "data": snapshot})
+        except Exception as e:
+            self._publish(topic, {"event": "error", "data": {"error": str(e), "closed": closed}})
+
+    async def _last_closed(self, topic: Topic, tf: str) -> Any:
+        symbol, _, category = topic.key
+        try:
+            return await _call(self.last_closed, symbol, tf, category)
+        except Exception as e:
+            print(f"[push] candle check failed for {symbol} {tf}: {e}")
+            return None
+
+    async def _run(self, topic: Topic):
+        symbol, tfs, category = topic.key
+        last: Dict[str, Any] = {}
+        for tf in tfs:
+            last[tf] = await self._last_closed(topic, tf)
+        await self._emit(topic, [])
+        while topic.queues:
+            now = self.clock()
+            closes = {tf: self.next_close(tf, now) for tf in tfs}
+            boundary = min(closes.values())
+            await self.sleep(max(0.0, boundary - now) + self.grace)
+
+            # Every TF closing at this boundary must show a new closed bar before we compute
+            due = [tf for tf in tfs if closes[tf] <= boundary]
+            closed: List[str] = []
+            deadline = self.clock() + self.max_wait
+            while due:
+                for tf in list(due):
+                    current = await self._last_closed(topic, tf)
+                    if current is not None and current != last[tf]:
+                        last[tf] = current
+                        closed.append(tf)
+                        due.remove(tf)
+                if not due or self.clock() >= deadline:
+                    break
+                await self.sleep(self.poll_interval)
+            if closed:
+                await self._emit(topic, closed)
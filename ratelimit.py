@@ -0,0 +1,41 @@
+"""
+Token-bucket rate limiting for outbound API calls.
+
+One bucket is shared by every thread that talks to Bybit, so fan-out
+(scanner, multi-symbol fetches) stays under the exchange's per-IP limit
+no matter how many workers are running. Clock and sleep are injectable
+for tests.
+"""
+
+import threading, time
+from typing import Callable, Optional
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        """`rate` tokens per second (<= 0 disables limiting), up to `burst` saved tokens (default: one second's worth)"""
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """Take `tokens` now (possibly going negative) and return how long the caller must wait"""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until `tokens` are available; returns the seconds waited"""
+        if self.rate <= 0:
+            return 0.0
+        wait = self._reserve(tokens)
+        if wait > 0:
+            self.sleep(wait)
+        return wait
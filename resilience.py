@@ -0,0 +1,173 @@
+"""
+Upstream resilience: circuit breakers and stale-while-revalidate.
+
+A `CircuitBreaker` opens after `failures` consecutive failed calls and then
+rejects calls for `reset_s` seconds, so an outage costs one fast error per
+call instead of a timeout each. After that one trial call is let through
+(half-open): success closes the breaker, failure opens it again.
+
+`Revalidator` runs refreshes in a small pool, one at a time per key. When the
+caller has a stale value to fall back on, it waits until `wait_s` after the
+refresh started, so refreshes started together (prefetched) time out
+together rather than one after another. A slow or failing refresh then
+returns the stale value and keeps going in the background for the next
+caller.
+
+A `Deadline` is a request budget split into consecutive stages (e.g. fetch,
+compute, position); workers check it between steps and stop once it has
+passed or the request has been cancelled.
+
+Clocks are injectable for tests, like `ratelimit.TokenBucket`.
+"""
+
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class Deadline:
+    def __init__(self, total_s: float, shares: Dict[str, float], clock: Callable[[], float] = time.monotonic):
+        """`shares` splits `total_s` over the stages in order (normalized to sum to 1)"""
+        self.clock = clock
+        self.total_s = total_s
+        self.start = clock()
+        self.end = self.start + total_s
+        self.cancelled = threading.Event()
+        self.ends: Dict[str, float] = {}
+        weight, total = 0.0, sum(shares.values()) or 1.0
+        for stage, share in shares.items():
+            weight += share
+            self.ends[stage] = self.start + total_s * weight / total
+
+    def remaining(self, stage: Optional[str] = None) -> float:
+        """Seconds left for `stage` (default: the whole request)"""
+        return max(0.0, self.ends.get(stage, self.end) - self.clock())
+
+    def check(self, stage: Optional[str] = None):
+        if self.cancelled.is_set():
+            raise DeadlineExceeded("request cancelled")
+        if self.clock() >= self.ends.get(stage, self.end):
+            raise DeadlineExceeded(f"{stage or 'request'} budget exceeded")
+
+    def cancel(self):
+        self.cancelled.set()
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = 5, reset_s: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        """`failures` <= 0 disables the breaker"""
+        self.name = name
+        self.failures = failures
+        self.reset_s = reset_s
+        self.clock = clock
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether a call would be let through now (without reserving the half-open trial)"""
+        with self._lock:
+            return self.state == "closed" or (not self._trial and self.clock() - self._opened_at >= self.reset_s)
+
+    def allow(self) -> bool:
+        """Reserve a call; False while open (or while the half-open trial is in flight)"""
+        if self.failures <= 0:
+            return True
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self._trial or self.clock() - self._opened_at < self.reset_s:
+                return False
+            self.state, self._trial = "half_open", True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.state, self.consecutive, self._trial = "closed", 0, False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.state == "half_open" or (self.failures > 0 and self.consecutive >= self.failures):
+                if self.state != "open":
+                    self.opened += 1
+                self.state, self._opened_at, self._trial = "open", self.clock(), False
+
+    def release(self):
+        """Give back a reserved half-open trial without counting an outcome"""
+        with self._lock:
+            if self.state == "half_open":
+                self.state, self._trial = "open", False
+
+    def retry_in(self) -> float:
+        with self._lock:
+            return max(0.0, self.reset_s - (self.clock() - self._opened_at)) if self.state == "open" else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.consecutive, "opened": self.opened,
+                "retry_in_s": round(self.retry_in(), 3)}
+
+class Revalidator:
+    def __init__(self, wait_s: float, workers: int = 8, clock: Callable[[], float] = time.monotonic,
+                 wrap: Optional[Callable[[Callable[[], Any]], Callable[[], Any]]] = None):
+        """`wrap(fn)` is applied in the caller's thread to every refresh it starts (e.g. `profiler.propagate`)"""
+        self.wait_s = wait_s
+        self.clock = clock
+        self.wrap = wrap
+        self.served_stale = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="revalidate")
+        self._inflight: Dict[Hashable, Tuple[Future, float]] = {}  # key -> (refresh, started at)
+        self._lock = threading.RLock()  # a done callback may run in the submitting thread
+
+    def _done(self, key: Hashable, future: Future):
+        with self._lock:
+            if key in self._inflight and self._inflight[key][0] is future:
+                del self._inflight[key]
+
+    def refresh(self, key: Hashable, fn: Callable[[], Any]) -> Future:
+        """The in-flight refresh of `key`, started with `fn` if there is none"""
+        return self._refresh(key, fn)[0]
+
+    def _refresh(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Future, float]:
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is None:
+                entry = self._inflight[key] = (self._pool.submit(self.wrap(fn) if self.wrap else fn), self.clock())
+                entry[0].add_done_callback(lambda f, key=key: self._done(key, f))
+            return entry
+
+    def get(self, key: Hashable, fn: Callable[[], Any], stale: Optional[Callable[[], Any]] = None,
+            timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """(value, fresh). `stale()` builds the fallback; it is only called when the refresh is not
+        done `wait_s` after it started (or within `timeout`), or fails. Without one (or when it
+        returns None) this waits for the refresh up to `timeout` and raises its error, or
+        `DeadlineExceeded` when it is still running."""
+        future, started = self._refresh(key, fn)
+        if stale is not None:
+            wait = max(0.0, started + self.wait_s - self.clock())
+            try:
+                return future.result(timeout=wait if timeout is None else min(wait, timeout)), True
+            except FutureTimeout:
+                pass
+            except Exception as e:
+                print(f"[revalidate] {key}: {e}")
+            value = stale()
+            if value is not None:
+                with self._lock:
+                    self.served_stale += 1
+                return value, False
+        try:
+            return future.result(timeout=timeout), True
+        except FutureTimeout:
+            raise DeadlineExceeded(f"refresh of {key} still running") from None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"in_flight": len(self._inflight), "served_stale": self.served_stale}
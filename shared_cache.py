@@ -0,0 +1,133 @@
+"""
+Cache shared by the worker processes on one host, in a local SQLite file.
+
+Every uvicorn/gunicorn worker opens the same file (WAL mode, so readers do
+not block the writer). An entry is a pickled value stored under a key with a
+`version` string and the time it was stored; the caller decides whether an
+entry is still current from those two (e.g. "includes the bar that opened at
+the last close", or "younger than 5 s").
+
+`get_or_build` coordinates refreshes across processes: the first process to
+find a key out of date takes a lease on it and builds the value while the
+others poll for the new entry, so a key is fetched once per change rather
+than once per process. A lease expires after `lease_s`, so a process that
+dies while building does not block the key; waiters that see no new entry by
+then build the value themselves.
+
+Values are pickled, so the file must only be writable by the service.
+"""
+
+import os, pickle, sqlite3, threading, time
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, version TEXT NOT NULL, "
+    "stored_at REAL NOT NULL, value BLOB NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)",
+)
+
+class Entry(NamedTuple):
+    version: str
+    stored_at: float
+    value: Any
+
+class SharedCache:
+    def __init__(self, path: str, lease_s: float = 10.0, poll_s: float = 0.05, max_age_s: float = 86400.0,
+                 clock: Callable[[], float] = time.time, sleep=time.sleep):
+        """`max_age_s`: entries not rewritten for this long are pruned now and then"""
+        self.path = path
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+        self.max_age_s = max_age_s
+        self.clock = clock
+        self.sleep = sleep
+        self.hits = 0
+        self.builds = 0
+        self.waits = 0
+        self._puts = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        """This thread's connection; reopened after a fork (gunicorn --preload)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _owner(self) -> str:
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def get(self, key: str) -> Optional[Entry]:
+        row = self._conn().execute("SELECT version, stored_at, value FROM entries WHERE key = ?", (key,)).fetchone()
+        return None if row is None else Entry(row[0], row[1], pickle.loads(row[2]))
+
+    def put(self, key: str, version: str, value: Any):
+        conn = self._conn()
+        now = self.clock()
+        conn.execute("INSERT OR REPLACE INTO entries (key, version, stored_at, value) VALUES (?, ?, ?, ?)",
+                     (key, version, now, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % 1000 == 0
+        if prune:
+            conn.execute("DELETE FROM entries WHERE stored_at < ?", (now - self.max_age_s,))
+            conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+
+    def acquire(self, key: str) -> bool:
+        """Take the lease on `key` unless another live one holds it"""
+        now = self.clock()
+        cursor = self._conn().execute(
+            "INSERT INTO leases (key, owner, expires) VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE "
+            "SET owner = excluded.owner, expires = excluded.expires WHERE leases.expires < ?",
+            (key, self._owner(), now + self.lease_s, now))
+        return cursor.rowcount == 1
+
+    def release(self, key: str):
+        self._conn().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self._owner()))
+
+    def get_or_build(self, key: str, current: Callable[[Entry], bool],
+                     build: Callable[[], Tuple[Optional[str], Any]]) -> Tuple[Any, bool]:
+        """(value, built here). Returns the stored value while `current(entry)` holds; otherwise one
+        process builds `(version, value)` under the lease and stores it (a None version is returned
+        but not stored) while the others wait for it, up to `lease_s`."""
+        give_up = self.clock() + self.lease_s
+        waited = False
+        while True:
+            entry = self.get(key)
+            if entry is not None and current(entry):
+                with self._lock:
+                    self.hits += 1
+                    self.waits += waited
+                return entry.value, False
+            if self.acquire(key):
+                try:
+                    entry = self.get(key)  # stored by the previous holder since our last look
+                    if entry is not None and current(entry):
+                        with self._lock:
+                            self.hits += 1
+                        return entry.value, False
+                    return self._build(key, build), True
+                finally:
+                    self.release(key)
+            if self.clock() >= give_up:
+                return self._build(key, build), True
+            waited = True
+            self.sleep(self.poll_s)
+
+    def _build(self, key: str, build: Callable[[], Tuple[Optional[str], Any]]) -> Any:
+        version, value = build()
+        if version is not None:
+            self.put(key, version, value)
+        with self._lock:
+            self.builds += 1
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"path": self.path, "hits": self.hits, "builds": self.builds, "waited": self.waits}
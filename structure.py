@@ -0,0 +1,202 @@
+"""
+Incremental structure analysis: order blocks, S/R pivots and swing points.
+
+`StructureState` consumes closed bars one at a time and keeps only what the
+next snapshot can still use, with bars numbered absolutely from the first
+one pushed:
+
+- a pivot (S/R level) is confirmed once the bars to its right have closed;
+- an order block is appended when its breakout candle closes;
+- a swing point is appended when the bar after it closes, and waves are
+  extended in place.
+
+`view()` answers for a frame of the last `window - 1` closed bars plus the
+still-forming bar, exactly like `find_order_blocks`,
+`find_support_resistance_levels` and `identify_elliott_waves` on that frame.
+Anything that depends on the forming bar is evaluated provisionally and never
+stored. Pushing a bar and viewing are both O(1) apart from rebuilding the
+deduplicated level list when a pivot leaves the window.
+"""
+
+import threading
+from collections import deque
+from itertools import islice
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+Bar = Sequence[float]  # open, high, low, close, volume
+
+class StructureState:
+    def __init__(self, window: int, ob_lookback: int = 20, vol_span: int = 10, sensitivity: float = 0.02,
+                 pivot_width: int = 2, keep_blocks: int = 3, top_levels: int = 5, min_waves: int = 5):
+        self.window = window
+        self.ob_lookback = ob_lookback
+        self.vol_span = vol_span
+        self.sensitivity = sensitivity
+        self.pivot_width = pivot_width
+        self.keep_blocks = keep_blocks
+        self.top_levels = top_levels
+        self.min_waves = min_waves
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0  # closed bars pushed; the forming bar is bar `count`
+        self.last_ts: Any = None
+        self.last_bar: Optional[Tuple[float, ...]] = None
+        self._bars: deque = deque(maxlen=2 * self.pivot_width + 1)  # newest closed bars
+        self._volumes: deque = deque(maxlen=self.vol_span)
+        self._prev_vol_ma: Optional[float] = None  # volume MA at the newest closed bar
+        self._blocks = {"bullish": deque(maxlen=self.keep_blocks), "bearish": deque(maxlen=self.keep_blocks)}
+        self._pivots = {"resistance": deque(), "support": deque()}  # (bar, price) inside the window
+        self._accepted: Dict[str, List[float]] = {"resistance": [], "support": []}
+        self._swings: deque = deque()  # (bar, "high"|"low", price) inside the window
+
+    @property
+    def start(self) -> int:
+        """Absolute bar number of the first frame row"""
+        return max(0, self.count - (self.window - 1))
+
+    # ---- closed bars ----
+
+    def push(self, ts: Any, bar: Bar):
+        """Add the next closed bar"""
+        bar = tuple(float(x) for x in bar)
+        j = self.count
+        if self._bars:
+            block = self._order_block(j - 1, self._bars[-1], self._prev_vol_ma, bar)
+            if block is not None:
+                self._blocks[block[0]].append(block[1])
+        self._bars.append(bar)
+        self._volumes.append(bar[4])
+        self._prev_vol_ma = sum(self._volumes) / self.vol_span if len(self._volumes) == self.vol_span else None
+        self.count += 1
+        self.last_ts, self.last_bar = ts, bar
+
+        start = self.start
+        for side in ("resistance", "support"):
+            live = self._pivots[side]
+            if live and live[0][0] < start + self.pivot_width:
+                while live and live[0][0] < start + self.pivot_width:
+                    live.popleft()
+                accepted: List[float] = []
+                for _, price in live:
+                    if self._significant(price, accepted):
+                        accepted.append(price)
+                self._accepted[side] = accepted
+        while self._swings and self._swings[0][0] < start + 1:
+            self._swings.popleft()
+
+        if len(self._bars) == self._bars.maxlen and j - 2 * self.pivot_width >= start:
+            for side, price in self._pivot(list(self._bars)):
+                self._pivots[side].append((j - self.pivot_width, price))
+                if self._significant(price, self._accepted[side]):
+                    self._accepted[side].append(price)
+        if len(self._bars) >= 3:
+            swing = self._swing(self._bars[-3], self._bars[-2], self._bars[-1])
+            if swing is not None and j - 1 >= start + 1:
+                self._swings.append((j - 1, swing[0], swing[1]))
+
+    # ---- detection rules (same as the full-frame functions) ----
+
+    def _order_block(self, i: int, current: Tuple[float, ...], vol_ma: Optional[float],
+                     nxt: Tuple[float, ...]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if vol_ma is None or not current[4] > vol_ma:
+            return None
+        o, h, l, _, v = current
+        if nxt[3] > nxt[0] and nxt[3] > h:
+            return "bullish", {"start_idx": i, "high": h, "low": l, "strength": (nxt[3] - h) / h, "volume_ratio": v / vol_ma}
+        if nxt[3] < nxt[0] and nxt[3] < l:
+            return "bearish", {"start_idx": i, "high": h, "low": l, "strength": (l - nxt[3]) / l, "volume_ratio": v / vol_ma}
+        return None
+
+    def _pivot(self, bars: List[Tuple[float, ...]]) -> List[Tuple[str, float]]:
+        """Pivots at the centre of `2 * pivot_width + 1` consecutive bars"""
+        w = self.pivot_width
+        centre, others = bars[w], bars[:w] + bars[w + 1:]
+        found = []
+        if all(centre[1] > b[1] for b in others):
+            found.append(("resistance", centre[1]))
+        if all(centre[2] < b[2] for b in others):
+            found.append(("support", centre[2]))
+        return found
+
+    @staticmethod
+    def _swing(prev: Tuple[float, ...], bar: Tuple[float, ...], nxt: Tuple[float, ...]) -> Optional[Tuple[str, float]]:
+        if bar[1] > prev[1] and bar[1] > nxt[1]:
+            return "high", bar[1]
+        if bar[2] < prev[2] and bar[2] < nxt[2]:
+            return "low", bar[2]
+        return None
+
+    def _significant(self, price: float, levels: List[float]) -> bool:
+        return all(abs(price - level) / level >= self.sensitivity for level in levels)
+
+    # ---- snapshot ----
+
+    def view(self, forming: Bar) -> Dict[str, Any]:
+        """Order blocks, S/R levels and Elliott summary for the current frame plus the forming bar"""
+        forming = tuple(float(x) for x in forming)
+        start, f = self.start, self.count
+        bars = list(self._bars)
+
+        order_blocks: Dict[str, List[Dict[str, Any]]] = {}
+        provisional = self._order_block(f - 1, bars[-1], self._prev_vol_ma, forming) if bars else None
+        for side in ("bullish", "bearish"):
+            blocks = list(self._blocks[side])
+            if provisional is not None and provisional[0] == side:
+                blocks.append(provisional[1])
+            order_blocks[side] = [dict(b, start_idx=b["start_idx"] - start) for b in blocks
+                                  if b["start_idx"] >= start + self.ob_lookback][-self.keep_blocks:]
+
+        levels = {side: list(accepted) for side, accepted in self._accepted.items()}
+        w = self.pivot_width
+        if len(bars) >= 2 * w and f - w >= start + w:
+            for side, price in self._pivot(bars[-2 * w:] + [forming]):
+                if self._significant(price, levels[side]):
+                    levels[side].append(price)
+
+        swings = self._swings
+        last_swing = None
+        if bars and len(bars) >= 2 and f - 1 >= start + 1:
+            swing = self._swing(bars[-2], bars[-1], forming)
+            if swing is not None:
+                last_swing = (f - 1, swing[0], swing[1])
+
+        return {
+            "order_blocks": order_blocks,
+            "support_resistance": {
+                "support": sorted(levels["support"], reverse=True)[:self.top_levels],
+                "resistance": sorted(levels["resistance"])[:self.top_levels],
+            },
+            "elliott_waves": self._elliott(swings, last_swing, start),
+        }
+
+    def _elliott(self, swings: deque, last_swing: Optional[Tuple], start: int) -> Dict[str, Any]:
+        count = len(swings) + (last_swing is not None)
+        n_waves = count - 1 if count >= self.min_waves else 0
+
+        def wave(number: int, a: Tuple, b: Tuple) -> Dict[str, Any]:
+            return {"wave": number, "start_idx": a[0] - start, "end_idx": b[0] - start,
+                    "start_price": a[2], "end_price": b[2], "direction": "up" if b[2] > a[2] else "down",
+                    "length": abs(b[2] - a[2]), "duration": b[0] - a[0]}
+
+        out = {"pattern": "unknown", "confidence": 0.0, "wave_count": n_waves, "current_wave": None}
+        if not n_waves:
+            return out
+        tail = list(swings)[-2:] if last_swing is None else list(swings)[-1:] + [last_swing]
+        out["current_wave"] = wave((n_waves - 1) % 5 + 1, tail[0], tail[1])
+        if n_waves >= 5:
+            first = list(islice(swings, 6))
+            if len(first) < 6:
+                first.append(last_swing)
+            waves = [wave(k % 5 + 1, first[k], first[k + 1]) for k in range(5)]
+            confidence = 0.0
+            if waves[2]["length"] > waves[0]["length"] and waves[2]["length"] > waves[4]["length"]:
+                confidence += 0.3
+            wave1_end, wave4_end = waves[0]["end_price"], waves[3]["end_price"]
+            if (waves[0]["direction"] == "up" and wave4_end > wave1_end) or \
+               (waves[0]["direction"] == "down" and wave4_end < wave1_end):
+                confidence += 0.2
+            out["confidence"] = confidence
+            out["pattern"] = "impulse" if confidence > 0.3 else "corrective"
+        return out
@@ -0,0 +1,45 @@
+"""
+Seeded synthetic OHLCV generator.
+
+Produces candles in the same shape as `main.fetch_ohlcv_bybit` (ts, open, high,
+low, close, volume) so the TA functions can be exercised offline.
+"""
+
+import numpy as np
+import pandas as pd
+
+TF_MS = {"1m": 60_000, "3m": 180_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000,
+         "1h": 3_600_000, "2h": 7_200_000, "4h": 14_400_000, "6h": 21_600_000,
+         "12h": 43_200_000, "1d": 86_400_000, "1w": 604_800_000}
+
+def make_ohlcv_arrays(bars: int, seed: int = 42, start_price: float = 30.0,
+                      volatility: float = 0.01, base_volume: float = 1000.0):
+    """Random-walk OHLCV as plain NumPy arrays (open, high, low, close, volume)"""
+    rng = np.random.default_rng(seed)
+    # Log-price random walk with a little drift
+    rets = rng.normal(0.0, volatility, bars)
+    close = start_price * np.exp(np.cumsum(rets))
+    open_ = np.empty(bars)
+    open_[0] = start_price
+    open_[1:] = close[:-1]
+    # Wicks extend beyond the body by a random fraction of the bar volatility
+    body_hi = np.maximum(open_, close)
+    body_lo = np.minimum(open_, close)
+    high = body_hi * (1 + np.abs(rng.normal(0.0, volatility / 2, bars)))
+    low = body_lo * (1 - np.abs(rng.normal(0.0, volatility / 2, bars)))
+    # Volume is lognormal and scales with the size of the move
+    volume = base_volume * rng.lognormal(0.0, 0.5, bars) * (1 + 50 * np.abs(rets))
+    return open_, high, low, close, volume
+
+def make_ohlcv(bars: int, seed: int = 42, tf: str = "15m", end_ms: int = None, **kwargs) -> pd.DataFrame:
+    """Random-walk candles shaped like `fetch_ohlcv_bybit` output"""
+    step = TF_MS.get(tf, 900_000)
+    if end_ms is None:
+        end_ms = 1_700_000_000_000 - 1_700_000_000_000 % step
+    start_ms = end_ms - (bars - 1) * step
+    open_, high, low, close, volume = make_ohlcv_arrays(bars, seed, **kwargs)
+    ts = pd.to_datetime(np.arange(bars, dtype=np.int64) * step + start_ms, unit="ms", utc=True)
+    return pd.DataFrame({
+        "ts": ts.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+        "open": open_, "high": high, "low": low, "close": close, "volume": volume,
+    })
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Tests for the private stream consumer (private_stream.py) against an
+in-process stand-in for Bybit's private WebSocket; no network needed.
+
+    python -m pytest -q test_private_stream.py
+    python test_private_stream.py
+"""
+
+import asyncio, hashlib, hmac, json
+
+import private_stream
+
+def position(symbol, size, updated, category="linear"):
+    """A position record as pushed (REST list items carry no category; the consumer adds it)"""
+    return {"category": category, "symbol": symbol, "side": "Buy", "size": str(size), "positionIdx": 0,
+            "updatedTime": str(updated)}
+
+class FakeSocket:
+    """One connection: acknowledges auth/subscribe, then serves `pushes` in order and closes"""
+
+    def __init__(self, server, pushes):
+        self.server = server
+        self.sent = []
+        self.replies = []  # acks are read before the next push
+        self.pushes = [json.dumps(push) for push in pushes] + [None]  # None: connection closed
+
+    async def send(self, text):
+        message = json.loads(text)
+        self.sent.append(message)
+        self.server.log.append(message["op"])
+        if message["op"] in ("auth", "subscribe"):
+            self.replies.append(json.dumps({"op": message["op"], "success": True, "ret_msg": "", "conn_id": "test"}))
+
+    async def recv(self):
+        if self.replies:
+            return self.replies.pop(0)
+        text = self.pushes.pop(0)
+        if text is None:
+            self.server.closed += 1
+            if self.server.closed >= len(self.server.sessions):
+                self.server.done.set()
+                await asyncio.Event().wait()  # park until the test cancels the stream
+            raise ConnectionError("connection closed")
+        return text
+
+class FakeServer:
+    """`connect` stand-in: each connection gets the next list of pushes from `sessions`"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.sockets = []
+        self.log = []
+        self.closed = 0
+        self.done = asyncio.Event()
+
+    def connect(self, url):
+        server = self
+
+        class Connection:
+            async def __aenter__(self):
+                ws = FakeSocket(server, server.sessions[len(server.sockets)])
+                server.sockets.append(ws)
+                server.log.append("connect")
+                return ws
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Connection()
+
+def run_stream(sessions, rest_snapshots, clock=lambda: 1000.0):
+    """Run a PrivateStream through `sessions`; the n-th resync replaces positions with rest_snapshots[n]"""
+    async def scenario():
+        server = FakeServer(sessions)
+        state = private_stream.AccountState(clock=clock)
+
+        def resync(state):
+            n = server.log.count("resync")
+            server.log.append("resync")
+            as_of_ms, items = rest_snapshots[n]
+            state.replace_positions("linear", items, as_of_ms)
+
+        stream = private_stream.PrivateStream("ws://fake/v5/private", "key", "secret", state, resync,
+                                              connect=server.connect, reconnect_delay=0, clock=clock)
+        task = asyncio.create_task(stream.run())
+        await asyncio.wait_for(server.done.wait(), timeout=5)
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return server, stream, state
+
+    return asyncio.run(scenario())
+
+def test_handshake_authenticates_then_subscribes():
+    server, stream, state = run_stream([[]], [(0, [])])
+    auth, subscribe = server.sockets[0].sent[:2]
+    assert auth["op"] == "auth" and auth["args"][0] == "key"
+    expires = auth["args"][1]
+    assert expires == 1010_000  # clock + 10 s, in ms
+    expected = hmac.new(b"secret", f"GET/realtime{expires}".encode(), hashlib.sha256).hexdigest()
+    assert auth["args"][2] == expected
+    assert subscribe == {"op": "subscribe", "args": list(private_stream.TOPICS)}
+    assert server.log[:4] == ["connect", "auth", "subscribe", "resync"]
+    assert stream.connects == 1
+
+def test_reconnect_resyncs_before_consuming():
+    sessions = [
+        [{"topic": "position", "data": [position("BTCUSDT", 1, 100)]}],
+        [{"topic": "position", "data": [position("ETHUSDT", 3, 300)]}],
+    ]
+    rest = [(50, []), (200, [position("SOLUSDT", 2, 150)])]
+    server, stream, state = run_stream(sessions, rest)
+    assert server.log == ["connect", "auth", "subscribe", "resync",
+                          "connect", "auth", "subscribe", "resync"]
+    assert stream.connects == 2
+    # BTCUSDT was pushed before the second resync and is not in its snapshot: closed since
+    assert [p["symbol"] for p in state.positions()] == ["ETHUSDT", "SOLUSDT"]
+
+def test_push_newer_than_rest_snapshot_wins():
+    # Pushed while the resync was in flight: consumed after it, and newer than the REST record
+    sessions = [[{"topic": "position", "data": [position("BTCUSDT", 5, 250)]},
+                 {"topic": "position", "data": [position("BTCUSDT", 9, 120)]}]]  # older than REST: ignored
+    rest = [(200, [position("BTCUSDT", 4, 180)])]
+    server, stream, state = run_stream(sessions, rest)
+    [btc] = state.positions("BTCUSDT")
+    assert btc["size"] == "5" and btc["updatedTime"] == "250"
+
+def test_replace_positions_keeps_newer_pushes():
+    state = private_stream.AccountState()
+    state.apply_positions([position("BTCUSDT", 1, 300),              # newer than REST
+                           position("ETHUSDT", 1, 100),              # older than REST
+                           position("SOLUSDT", 1, 260),              # opened after as_of
+                           position("XRPUSDT", 1, 90),               # closed before as_of
+                           position("BTCUSDT", 1, 10, "inverse")])   # other category
+    state.replace_positions("linear", [position("BTCUSDT", 2, 200), position("ETHUSDT", 2, 200)], as_of_ms=250)
+    sizes = {(p["category"], p["symbol"]): p["size"] for p in state.positions()}
+    assert sizes == {("linear", "BTCUSDT"): "1", ("linear", "ETHUSDT"): "2", ("linear", "SOLUSDT"): "1",
+                     ("inverse", "BTCUSDT"): "1"}
+
+def serving_stream(main):
+    """Put `main` in the connected-and-synced state; returns a function that restores it"""
+    saved = main.PRIVATE_STREAM, main.PRIVATE_STATE
+    main.PRIVATE_STATE = private_stream.AccountState()
+    main.PRIVATE_STREAM = private_stream.PrivateStream("ws://fake/v5/private", "key", "secret", main.PRIVATE_STATE,
+                                                       lambda state: None)
+    main.PRIVATE_STATE.connected = main.PRIVATE_STATE.synced = True
+
+    def restore():
+        main.PRIVATE_STREAM, main.PRIVATE_STATE = saved
+    return restore
+
+def test_unsynced_category_is_served_from_rest():
+    import main
+    restore = serving_stream(main)
+    try:
+        assert "inverse" not in main.PRIVATE_STREAM_CATEGORIES
+        main.PRIVATE_STATE.apply_positions([position("BTCUSDT", 1, 100), position("BTCUSD", 2, 100, "inverse")])
+        rest = lambda symbol, category: {"source": "rest", "category": category}
+        assert main.get_positions_live(None, "inverse", rest) == {"source": "rest", "category": "inverse"}
+        assert main.get_positions_live("BTCUSD", "inverse", rest)["source"] == "rest"
+        linear = main.get_positions_live(None, "linear", rest)
+        assert linear["source"] == "stream" and [p["symbol"] for p in linear["positions"]] == ["BTCUSDT"]
+    finally:
+        restore()
+
+def test_resync_lists_every_settle_coin():
+    import main
+    calls = []
+
+    def post(endpoint, params):
+        calls.append(dict(params))
+        if endpoint == "/v5/account/wallet-balance":
+            return {"list": []}
+        pages = {("USDT", ""): (["BTCUSDT"], "p2"), ("USDT", "p2"): (["ETHUSDT"], ""), ("USDC", ""): (["BTCPERP"], "")}
+        symbols, cursor = pages[(params["settleCoin"], params.get("cursor", ""))]
+        return {"list": [dict(position(s, 1, 100), category=None) for s in symbols], "nextPageCursor": cursor}
+
+    saved = main.signed_bybit_post, main.PRIVATE_STREAM_CATEGORIES, main.PRIVATE_STREAM_SETTLE_COINS
+    main.signed_bybit_post, main.PRIVATE_STREAM_CATEGORIES, main.PRIVATE_STREAM_SETTLE_COINS = post, ["linear"], ["USDT", "USDC"]
+    try:
+        state = private_stream.AccountState()
+        main.resync_private_state(state)
+    finally:
+        main.signed_bybit_post, main.PRIVATE_STREAM_CATEGORIES, main.PRIVATE_STREAM_SETTLE_COINS = saved
+    assert [(c.get("settleCoin"), c.get("cursor")) for c in calls[:-1]] == [("USDT", None), ("USDT", "p2"), ("USDC", None)]
+    assert [p["symbol"] for p in state.positions(category="linear")] == ["BTCPERP", "BTCUSDT", "ETHUSDT"]
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: ok")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Tests for the candle-close push hub (push.py) with a fake clock and a
+stand-in candle source; no network and no real waiting.
+
+    python -m pytest -q test_push.py
+    python test_push.py
+"""
+
+import asyncio
+
+import push
+
+STEP = {"1m": 60, "5m": 300}
+T0 = 360_010  # 10 s after a 5m (and 1m) boundary
+
+class FakeClock:
+    """`sleep` returns only once the test has advanced the clock past its wake-up time"""
+
+    def __init__(self, now):
+        self.now = now
+        self.limit = now
+        self.sleeps = []
+        self.cond = asyncio.Condition()
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        wake = self.now + seconds
+        async with self.cond:
+            await self.cond.wait_for(lambda: wake <= self.limit)
+            self.now = max(self.now, wake)
+
+    async def advance(self, seconds):
+        async with self.cond:
+            self.limit += seconds
+            self.cond.notify_all()
+        for _ in range(50):  # let the hub run up to its next sleep
+            await asyncio.sleep(0)
+
+class Candles:
+    """Stand-in candle source: a bar shows as closed `lag` seconds after its close"""
+
+    def __init__(self, clock, lag=0):
+        self.clock = clock
+        self.lag = lag
+        self.checks = 0
+
+    async def last_closed(self, symbol, tf, category):
+        self.checks += 1
+        step = STEP[tf]
+        return (self.clock() - self.lag) // step * step - step  # open time of the latest closed bar
+
+def next_close(tf, now):
+    step = STEP[tf]
+    return (now // step + 1) * step
+
+def make_hub(lag=0):
+    clock = FakeClock(T0)
+    candles = Candles(clock, lag)
+    computed = []
+
+    async def compute(symbol, tfs, category, closed):
+        computed.append(closed)
+        return {"symbol": symbol, "n": len(computed), "closed": closed}
+
+    hub = push.SubscriptionHub(compute, candles.last_closed, next_close, clock=clock, sleep=clock.sleep,
+                               grace=1.0, poll_interval=2.0, max_wait=30.0)
+    return hub, clock, computed
+
+async def receive(queue):
+    return await asyncio.wait_for(queue.get(), timeout=1)
+
+def test_one_computation_per_close_shared_by_subscribers():
+    async def scenario():
+        hub, clock, computed = make_hub()
+        async with hub.subscribe("X", ["1m", "5m"], "linear") as q1, \
+                hub.subscribe("X", ["1m", "5m"], "linear") as q2, \
+                hub.subscribe("X", ["1m", "5m"], "linear") as q3:
+            assert hub.stats() == {"topics": 1, "subscribers": 3}
+            first = [await receive(q) for q in (q1, q2, q3)]
+            assert computed == [[]] and first[0] is first[1] is first[2]
+
+            await clock.advance(60)  # 1m close
+            close = [await receive(q) for q in (q1, q2, q3)]
+            assert computed == [[], ["1m"]]
+            assert close[0] is close[1] is close[2] and close[0]["data"]["closed"] == ["1m"]
+
+            await clock.advance(240)  # 1m closes up to the 5m boundary, which closes both TFs at once
+            assert computed[-1] == ["1m", "5m"] and len(computed) == 6
+            assert clock.sleeps == [51, 60, 60, 60, 60, 60]  # next close + grace, no polling needed
+            assert all(q.qsize() == hub.queue_size for q in (q1, q2, q3))  # 4 new, oldest skipped
+
+    asyncio.run(scenario())
+
+def test_late_joiner_gets_latest_snapshot():
+    async def scenario():
+        hub, clock, computed = make_hub()
+        async with hub.subscribe("X", ["1m"], "linear") as q1:
+            await receive(q1)
+            await clock.advance(60)
+            latest = await receive(q1)
+            async with hub.subscribe("X", ["1m"], "linear") as q2:
+                assert await receive(q2) is latest  # no wait for the next close, no extra computation
+                assert len(computed) == 2
+                await clock.advance(60)
+                assert (await receive(q1)) is (await receive(q2))
+            assert len(computed) == 3
+
+    asyncio.run(scenario())
+
+def test_task_stops_when_last_subscriber_leaves():
+    async def scenario():
+        hub, clock, computed = make_hub()
+        async with hub.subscribe("X", ["1m"], "linear") as q1:
+            topic = hub.topics[("X", ("1m",), "linear")]
+            async with hub.subscribe("X", ["1m"], "linear"):
+                await receive(q1)
+            assert not topic.task.done()  # one subscriber left
+        await asyncio.sleep(0)
+        assert topic.task.cancelled()
+        assert hub.topics == {} and hub.stats() == {"topics": 0, "subscribers": 0}
+        await clock.advance(600)
+        assert computed == [[]]
+
+    asyncio.run(scenario())
+
+def test_waits_for_the_exchange_to_publish_the_closed_bar():
+    async def scenario():
+        hub, clock, computed = make_hub(lag=4)  # bar shows 4 s after close; grace is 1 s
+        async with hub.subscribe("X", ["1m"], "linear") as q1:
+            await receive(q1)
+            await clock.advance(52)  # to close + 2 s
+            assert computed == [[]]  # checked at close + 1 s, bar not out yet
+            await clock.advance(4)
+            message = await receive(q1)
+            assert message["data"]["closed"] == ["1m"]
+            assert clock.sleeps == [51, 2, 2, 56]  # polled at +3 s and +5 s, then on to the next close
+
+    asyncio.run(scenario())
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: ok")
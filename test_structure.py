@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests that the incremental structure state (structure.StructureState) gives
+the same order blocks, S/R levels and Elliott summary as a full recomputation
+of every frame, over frames sliding across synthetic candles.
+
+    python -m pytest -q test_structure.py
+    python test_structure.py
+"""
+
+import math
+
+import main
+from synthetic_data import make_ohlcv
+
+FIELDS = ["order_blocks", "support_resistance", "elliott_waves"]
+
+def assert_close(a, b, path="", rel=1e-9):
+    """Equal structure, floats within `rel` (order-block volume ratios differ by an ulp: the state
+    keeps a running sum where the full scan uses a pandas rolling mean)"""
+    if isinstance(a, dict):
+        assert isinstance(b, dict) and a.keys() == b.keys(), f"{path}: keys {list(a)} != {list(b)}"
+        for k in a:
+            assert_close(a[k], b[k], f"{path}.{k}", rel)
+    elif isinstance(a, (list, tuple)):
+        assert isinstance(b, (list, tuple)) and len(a) == len(b), f"{path}: {a} != {b}"
+        for i, (x, y) in enumerate(zip(a, b)):
+            assert_close(x, y, f"{path}[{i}]", rel)
+    elif isinstance(a, float) or isinstance(b, float):
+        assert math.isclose(a, b, rel_tol=rel, abs_tol=1e-12), f"{path}: {a} != {b}"
+    else:
+        assert a == b, f"{path}: {a} != {b}"
+
+def slide(frame_len, bars=400, seed=7, steps=(1, 1, 2, 1, 5, 1, 1, 3)):
+    """Frames of `frame_len` rows (the last one forming) advancing by `steps` in turn"""
+    candles = make_ohlcv(bars, seed=seed, tf="1h")
+    end, k = frame_len, 0
+    while end <= len(candles):
+        yield candles.iloc[end - frame_len:end].reset_index(drop=True)
+        end += steps[k % len(steps)]
+        k += 1
+
+def check(frame_len, **kwargs):
+    symbol = f"TEST{frame_len}"
+    frames = 0
+    for df in slide(frame_len, **kwargs):
+        s = main.last_closed_row(df)
+        incremental = main.build_tf_features(symbol, "1h", s, df, FIELDS, category="linear")
+        full = main.build_tf_features(symbol, "1h", s, df, FIELDS, category=None)
+        assert_close(incremental, full, f"frame ending {df['ts'].iloc[-1]}")
+        frames += 1
+    return frames
+
+def test_matches_full_recomputation():
+    assert main.STRUCTURE_CACHE_SIZE > 0
+    assert check(120) > 100
+
+def test_short_frames_match():
+    # shorter than the order-block lookback and barely wider than the pivots
+    for frame_len in (6, 23, 40):
+        assert check(frame_len, bars=200) > 50
+
+def test_rebuilds_after_a_gap():
+    # jumps wider than the frame leave no overlap, so the state resets and rebuilds
+    assert check(60, bars=400, steps=(1, 1, 90, 1, 2)) > 10
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: ok")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests that the incremental volume profile (volume_profile.ProfileState) gives
+the same levels as `volume_profile.profile` over each whole frame, for frames
+sliding across synthetic candles.
+
+    python -m pytest -q test_volume_profile.py
+    python test_volume_profile.py
+"""
+
+import math
+
+import volume_profile
+from synthetic_data import make_ohlcv_arrays
+
+def assert_close(a, b, path=""):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys(), f"{path}: keys {list(a)} != {list(b)}"
+        for k in a:
+            assert_close(a[k], b[k], f"{path}.{k}")
+    elif isinstance(a, list):
+        assert len(a) == len(b), f"{path}: {a} != {b}"
+        for i, (x, y) in enumerate(zip(a, b)):
+            assert_close(x, y, f"{path}[{i}]")
+    elif isinstance(a, float) or isinstance(b, float):
+        assert math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12), f"{path}: {a} != {b}"
+    else:
+        assert a == b, f"{path}: {a} != {b}"
+
+def check(frame_len, bin_size, bars=1200, seed=3, steps=(1, 1, 2, 1, 4, 1)):
+    """Drive a ProfileState like main.incremental_view (push the bars closed since the last frame,
+    view with the forming bar) and compare every frame with a one-pass profile"""
+    o, h, l, c, v = make_ohlcv_arrays(bars, seed=seed, start_price=30.0)
+    state = volume_profile.ProfileState(frame_len, bin_size)
+    pushed = 0  # bars pushed so far (absolute index of the next one)
+    end, k, frames = frame_len, 0, 0
+    while end <= bars:
+        for j in range(max(pushed, end - frame_len), end - 1):
+            state.push(j, (o[j], h[j], l[j], c[j], v[j]))
+        pushed = end - 1
+        got = state.view((o[end - 1], h[end - 1], l[end - 1], c[end - 1], v[end - 1]))
+        lo = end - frame_len
+        want = volume_profile.profile(l[lo:end], h[lo:end], v[lo:end], bin_size)
+        assert_close(got, want, f"frame ending at bar {end - 1}")
+        frames += 1
+        end += steps[k % len(steps)]
+        k += 1
+    return frames
+
+def test_matches_one_pass_profile():
+    # 0.05 gives tens of bins over these frames; the state rebuilds every `frame_len` pushes
+    assert check(150, 0.05) > 500
+
+def test_coarse_and_fine_bins():
+    assert check(60, 0.5, bars=500) > 200  # a handful of bins, many ties
+    assert check(60, 0.002, bars=500) > 200  # most bars span many bins
+
+def test_choose_bin_size():
+    assert volume_profile.choose_bin_size(1.0, 0.001, ticks=5) == 0.005
+    assert volume_profile.choose_bin_size(10.0, 0.001, bins=100) == 0.1  # 100 ticks per bin
+    assert volume_profile.choose_bin_size(10.0, None, bins=100) == 0.1  # 1/2/5 step without a tick
+    assert volume_profile.choose_bin_size(10.0, 0.001, ticks=1, bins=100) == 0.01  # at most 10x bins
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name}: ok")
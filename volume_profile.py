@@ -0,0 +1,194 @@
+"""
+Volume-at-price profile: point of control, value area and volume nodes.
+
+Each bar's volume is spread uniformly over its high-low range (a bar with no
+range puts it all at one price). Binning is vectorized: the summed volume
+below a price is a piecewise-linear function of it, so it is evaluated at
+every bin edge with two sorted cumulative sums and `searchsorted`, and bin
+volumes are its differences. Bins are aligned to multiples of the bin size,
+so a profile can be updated bar by bar.
+
+`ProfileState` keeps the histogram of the last `window - 1` closed bars and
+adds the forming bar at view time; it follows the same push/view protocol as
+`structure.StructureState`.
+"""
+
+import math, threading
+from collections import deque
+from typing import Any, Dict, Optional, Sequence
+
+from lazy import lazy_module
+
+np = lazy_module("numpy")
+
+def nice_step(raw: float) -> float:
+    """Smallest 1/2/5 x 10^k not below `raw`"""
+    if raw <= 0:
+        return 1.0
+    scale = 10 ** math.floor(math.log10(raw))
+    for m in (1, 2, 5, 10):
+        if m * scale >= raw * (1 - 1e-12):
+            return m * scale
+    return 10 * scale
+
+def choose_bin_size(price_range: float, tick: Optional[float], ticks: int = 0, bins: int = 100) -> float:
+    """`ticks` exchange ticks per bin (0: as many as give about `bins` bins), widened so there are
+    never more than 10x `bins`; without a known tick size a 1/2/5 step is used"""
+    if not tick or tick <= 0:
+        tick = nice_step(price_range / bins) if price_range > 0 else 1.0
+        ticks = ticks if ticks > 0 else 1
+    per_bin = ticks if ticks > 0 else max(1, math.ceil(price_range / bins / tick))
+    per_bin = max(per_bin, math.ceil(price_range / (10 * bins) / tick))
+    return round(per_bin * tick, 12)
+
+def bin_volumes(low, high, volume, bin_size: float, first: int, count: int):
+    """Volume in bins `first .. first + count - 1` (bin k covers [k, k + 1) x bin_size)"""
+    low, high, volume = (np.asarray(x, dtype=np.float64) for x in (low, high, volume))
+    origin = first * bin_size  # measure prices from the first edge to keep the cumulative sums small
+    edges = np.arange(count + 1) * bin_size
+    lo, hi = low - origin, high - origin
+    spread = hi > lo
+
+    cdf = np.zeros(count + 1)
+    if spread.any():
+        slope = volume[spread] / (hi[spread] - lo[spread])
+        for points, sign in ((lo[spread], 1.0), (hi[spread], -1.0)):
+            order = np.argsort(points)
+            cs = np.concatenate(([0.0], np.cumsum(slope[order])))
+            csp = np.concatenate(([0.0], np.cumsum(slope[order] * points[order])))
+            k = np.searchsorted(points[order], edges, side="left")  # points below each edge
+            cdf += sign * (edges * cs[k] - csp[k])
+    if (~spread).any():
+        points = lo[~spread]
+        order = np.argsort(points)
+        cs = np.concatenate(([0.0], np.cumsum(volume[~spread][order])))
+        cdf += cs[np.searchsorted(points[order], edges, side="left")]
+    return np.diff(cdf)
+
+def profile_levels(hist, first: int, bin_size: float, value_area: float = 0.7, nodes: int = 3) -> Dict[str, Any]:
+    """POC, value area (the narrowest bin range around the POC holding `value_area` of the volume)
+    and the strongest high/low-volume nodes (peaks/troughs of the 1-2-1 smoothed profile)"""
+    hist = np.clip(np.asarray(hist, dtype=np.float64), 0.0, None)
+    total = float(hist.sum())
+    if total > 0:
+        # Bins covered by the same bars hold equal volume; rounding the shares keeps such ties
+        # exact however the histogram was accumulated
+        hist = np.round(hist / total, 9)
+        total = float(hist.sum())
+    out: Dict[str, Any] = {"poc": None, "vah": None, "val": None, "hvn": [], "lvn": [],
+                           "bin_size": bin_size, "value_area_pct": value_area}
+    if total <= 0:
+        return out
+    decimals = max(0, 1 - math.floor(math.log10(bin_size)))
+    edge = lambda k: round((first + k) * bin_size, decimals)
+    centre = lambda k: round((first + k + 0.5) * bin_size, decimals)
+
+    poc = int(np.argmax(hist))
+    cum = np.concatenate(([0.0], np.cumsum(hist)))
+    lower = np.arange(poc + 1)
+    need = value_area * total * (1 - 1e-12)
+    upper = np.searchsorted(cum, cum[lower] + need, side="left") - 1
+    upper = np.clip(np.maximum(upper, poc), None, len(hist) - 1)
+    covered = cum[upper + 1] - cum[lower]
+    width = np.where(covered >= need, upper - lower, len(hist))  # lower = 0 always qualifies
+    best = np.lexsort((-covered, width))[0]  # narrowest, then most volume
+    out["poc"], out["val"], out["vah"] = centre(poc), edge(int(lower[best])), edge(int(upper[best]) + 1)
+
+    if len(hist) >= 3:
+        smooth = np.convolve(np.pad(hist, 1, mode="edge"), [0.25, 0.5, 0.25], mode="valid")
+        mid, left, right = smooth[1:-1], smooth[:-2], smooth[2:]
+        peaks = np.flatnonzero((mid > left) & (mid >= right)) + 1
+        nonzero = np.flatnonzero(hist > 0)
+        troughs = np.flatnonzero((mid < left) & (mid <= right)) + 1
+        troughs = troughs[(troughs > nonzero[0]) & (troughs < nonzero[-1])]  # inside the traded range
+        out["hvn"] = [centre(int(k)) for k in peaks[np.argsort(-smooth[peaks], kind="stable")][:nodes]]
+        out["lvn"] = [centre(int(k)) for k in troughs[np.argsort(smooth[troughs], kind="stable")][:nodes]]
+    return out
+
+def profile(low, high, volume, bin_size: float, value_area: float = 0.7, nodes: int = 3) -> Dict[str, Any]:
+    """Profile levels of a whole frame in one pass"""
+    low, high = np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64)
+    if not len(low):
+        return profile_levels(np.zeros(0), 0, bin_size, value_area, nodes)
+    first = math.floor(float(low.min()) / bin_size)
+    count = math.floor(float(high.max()) / bin_size) - first + 1
+    hist = bin_volumes(low, high, volume, bin_size, first, count)
+    return profile_levels(hist, first, bin_size, value_area, nodes)
+
+class ProfileState:
+    def __init__(self, window: int, bin_size: float, value_area: float = 0.7, nodes: int = 3):
+        self.window = window
+        self.bin_size = bin_size
+        self.value_area = value_area
+        self.nodes = nodes
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.last_ts: Any = None
+        self.last_bar: Optional[tuple] = None
+        self._bars: deque = deque()  # (low, high, volume) of the closed bars in the frame
+        self._hist = np.zeros(0)
+        self._first = 0  # bin index of _hist[0]
+        self._since_rebuild = 0
+
+    def _span(self, low: float, high: float):
+        return math.floor(low / self.bin_size), math.floor(high / self.bin_size)
+
+    def _ensure(self, lo_bin: int, hi_bin: int):
+        """Grow the histogram to cover bins lo_bin..hi_bin"""
+        if not len(self._hist):
+            self._first, self._hist = lo_bin, np.zeros(hi_bin - lo_bin + 1)
+            return
+        last = self._first + len(self._hist) - 1
+        if lo_bin < self._first or hi_bin > last:
+            first, last = min(lo_bin, self._first), max(hi_bin, last)
+            grown = np.zeros(last - first + 1)
+            grown[self._first - first:self._first - first + len(self._hist)] = self._hist
+            self._first, self._hist = first, grown
+
+    def _add(self, low: float, high: float, volume: float, sign: float = 1.0):
+        lo_bin, hi_bin = self._span(low, high)
+        self._ensure(lo_bin, hi_bin)
+        i = lo_bin - self._first
+        self._hist[i:i + hi_bin - lo_bin + 1] += sign * bin_volumes([low], [high], [volume], self.bin_size,
+                                                                    lo_bin, hi_bin - lo_bin + 1)
+
+    def _rebuild(self):
+        """Recompute from the frame's bars (drops rounding drift and bins the window left behind)"""
+        self._since_rebuild = 0
+        if not self._bars:
+            self._hist = np.zeros(0)
+            return
+        low, high, volume = (np.array(x) for x in zip(*self._bars))
+        lo_bin, hi_bin = self._span(float(low.min()), float(high.max()))
+        self._first = lo_bin
+        self._hist = bin_volumes(low, high, volume, self.bin_size, lo_bin, hi_bin - lo_bin + 1)
+
+    def push(self, ts: Any, bar: Sequence[float]):
+        """Add the next closed bar (open, high, low, close, volume)"""
+        bar = tuple(float(x) for x in bar)
+        self._bars.append((bar[2], bar[1], bar[4]))
+        self._add(bar[2], bar[1], bar[4])
+        if len(self._bars) > self.window - 1:
+            self._add(*self._bars.popleft(), sign=-1.0)
+        self.count += 1
+        self.last_ts, self.last_bar = ts, bar
+        self._since_rebuild += 1
+        if self._since_rebuild >= max(self.window, 1):
+            self._rebuild()
+
+    def view(self, forming: Sequence[float]) -> Dict[str, Any]:
+        """Profile levels of the frame: closed bars plus the forming bar"""
+        low, high, volume = float(forming[2]), float(forming[1]), float(forming[4])
+        lo_bin, hi_bin = self._span(low, high)
+        self._ensure(lo_bin, hi_bin)
+        hist = self._hist.copy()
+        i = lo_bin - self._first
+        hist[i:i + hi_bin - lo_bin + 1] += bin_volumes([low], [high], [volume], self.bin_size, lo_bin, hi_bin - lo_bin + 1)
+        nonzero = np.flatnonzero(hist > 1e-9 * max(float(hist.max()), 1e-300))
+        if not len(nonzero):
+            return profile_levels(hist[:0], self._first, self.bin_size, self.value_area, self.nodes)
+        trimmed = hist[nonzero[0]:nonzero[-1] + 1]  # bins the window has left behind hold only rounding residue
+        return profile_levels(trimmed, self._first + int(nonzero[0]), self.bin_size, self.value_area, self.nodes)